@@ -6,6 +6,8 @@ import click
 from mako.template import Template
 from mako.lookup import TemplateLookup
 import os
+import sys
+import glob
 import traceback
 import pandas as pd
 from openpyxl import load_workbook
@@ -268,9 +270,41 @@ def notebook(author, foia_name, task):
         raise FileExistsError(f"{task}.ipynb already exists.")
     render_notebook_for_task(task, foia_path, template_vars)
 
+@click.command(name='merge-chain')
+@click.option('--start', default=1, type=int, help="Number of the first merge step to run")
+@click.option('--end', default=None, type=int, help="Number of the last merge step to run, by default the last one")
+@click.option('--checkpoint', multiple=True, type=int, 
+              help="Merge step to write officer-reference for, can be repeated. The last step is always written")
+def merge_chain(start, end, checkpoint):
+    """Runs merge steps in one process, passing officer-reference between steps in memory"""
+    sys.path.insert(0, os.path.abspath(f"{share_path}/src"))
+    from merge_chain import run_merge_chain
+
+    steps = run_merge_chain(f"{root_path}/merge", start, end, list(checkpoint))
+    click.echo(f"Ran {len(steps)} merge steps")
+
+@click.command(name='merge-metrics')
+@click.option('--top', default=20, type=int, help="Number of column lists to show")
+@click.option('--sort-by', default='wall_time', type=click.Choice(['wall_time', 'rss_delta', 'candidate_rows']),
+              help="Metric to rank column lists by")
+def merge_metrics(top, sort_by):
+    """Ranks the slowest (or most memory hungry) column lists across merge steps, 
+    from the merge_metrics.jsonl files written by steps run with MERGE_METRICS=1"""
+    sys.path.insert(0, os.path.abspath(f"{share_path}/src"))
+    from merge_metrics import summarize_metrics
+
+    paths = sorted(glob.glob(f"{root_path}/merge/*/output/*.merge_metrics.jsonl"))
+    if not paths:
+        click.echo("No merge metrics found, run merge steps with MERGE_METRICS=1", err=True)
+        return
+    with pd.option_context('display.max_colwidth', 80, 'display.width', 200):
+        click.echo(summarize_metrics(paths, top, sort_by).to_string())
+
 cpdp.add_command(add)
 cpdp.add_command(merge)
 cpdp.add_command(notebook)
+cpdp.add_command(merge_chain)
+cpdp.add_command(merge_metrics)
 
 def delete_individual_foia_folder(foia_name):
     shutil.rmtree(f"{individual_path}/{foia_name}")
@@ -532,7 +566,9 @@ def add_to_merge(root_path, foia_name, share_path, author):
     os.mkdir(f"{merge_path}/{merge_folder}/note")
 
     # link setup files
-    for file in ["setup.py", "general_utils.py", "match_functions.py", "merge_functions.py", "update_functions.py"]:
+    for file in ["setup.py", "general_utils.py", "match_functions.py", "merge_assignment.py", "merge_audit.py", "merge_cache.py", "merge_chain.py",
+                 "merge_functions.py", "merge_index.py", "merge_metrics.py", "merge_sqlite.py", "probabilistic_merge.py",
+                 "reference_key_index.py", "reference_store.py", "string_similarity.py", "update_functions.py"]:
         os.symlink(f"{os.path.abspath(share_path)}/src/{file}", f"{merge_path}/{merge_folder}/src/{file}") # use absolute path/relative doesn't preserve
 
     # link previous merge officer reference from max merge number
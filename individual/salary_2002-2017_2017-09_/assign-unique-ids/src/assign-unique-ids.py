@@ -120,17 +120,17 @@ if __name__ == "__main__":
 
     log.info("Beginning self-merge process")
 
+    year_slices = []
     for year in range(2002, 2018):
         dfy = df[df['year'] == year].copy()
         yid = cons.year_id.replace('year', str(year))
         dfy.rename(columns={cons.year_id: yid},
                 inplace=True)
-        if year == 2002:
-            sd = ReferenceData(dfy, uid=cons.sid, data_id=yid, log=log)
-        else:
-            sd = (sd.add_sup_data(dfy, add_cols=['F4FN', 'F4LN'], base_OD=[])
-                    .loop_merge(custom_merges=cons.custom_merges, verbose=False)
-                    .append_to_reference())
+        year_slices.append((yid, dfy))
+
+    sd = ReferenceData.link_slices(year_slices, uid=cons.sid, log=log,
+                                   custom_merges=cons.custom_merges,
+                                   add_cols=['F4FN', 'F4LN'])
 
     # manual fix            
     # JEFFREY GOUGIS - a seargant with a new appointed date
@@ -0,0 +1 @@
+../../../../share/src/merge_assignment.py
\ No newline at end of file
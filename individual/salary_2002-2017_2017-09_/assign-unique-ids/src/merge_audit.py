@@ -0,0 +1 @@
+../../../../share/src/merge_audit.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../../share/src/merge_metrics.py
\ No newline at end of file
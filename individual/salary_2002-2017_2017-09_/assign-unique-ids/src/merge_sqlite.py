@@ -0,0 +1 @@
+../../../../share/src/merge_sqlite.py
\ No newline at end of file
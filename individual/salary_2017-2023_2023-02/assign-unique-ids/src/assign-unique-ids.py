@@ -103,6 +103,8 @@ if __name__ == "__main__":
     df = full_df
 
     log.info("Starting self merge between years")
+    # linked one year at a time, merge_functions.ReferenceData.link_slices only takes custom_merges
+    # (not a Merge with base_OD) and links each slice one to one
     for year, year_df in df.groupby("year"):
         # yid = cons.sub_id.replace('year', str(year))
         if year == 2017:
@@ -0,0 +1 @@
+../../../../share/src/merge_chain.py
\ No newline at end of file
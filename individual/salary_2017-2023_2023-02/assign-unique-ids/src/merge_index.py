@@ -0,0 +1 @@
+../../../../share/src/merge_index.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../../share/src/reference_key_index.py
\ No newline at end of file
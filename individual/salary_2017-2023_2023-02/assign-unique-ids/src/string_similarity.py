@@ -0,0 +1 @@
+../../../../share/src/string_similarity.py
\ No newline at end of file
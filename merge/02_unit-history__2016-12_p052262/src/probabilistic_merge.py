@@ -0,0 +1 @@
+../../../share/src/probabilistic_merge.py
\ No newline at end of file
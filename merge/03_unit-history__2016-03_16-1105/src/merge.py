@@ -8,6 +8,7 @@ import pandas as pd
 import __main__
 
 from reference_data import ReferenceData
+from merge_chain import read_reference
 from default_merges import (
     default_merges, 
     base_merge,
@@ -61,7 +62,7 @@ def get_setup():
 if __name__ == "__main__":
     cons, log = get_setup()
 
-    ref_df = pd.read_csv(cons.input_reference_file)
+    ref_df = read_reference(cons.input_reference_file)
     sup_df = pd.read_csv(cons.input_profiles_file)
 
     ref_df.appointed_date = pd.to_datetime(ref_df.appointed_date)
@@ -8,6 +8,7 @@ import pandas as pd
 import __main__
 
 from reference_data import ReferenceData
+from merge_chain import read_reference
 from default_merges import default_merges, whitelist_merge
 from merge_data import Merge
 import setup
@@ -51,7 +52,7 @@ def get_setup():
 if __name__ == "__main__":
     cons, log = get_setup()
 
-    ref_df = pd.read_csv(cons.input_reference_file)
+    ref_df = read_reference(cons.input_reference_file)
     sup_df = pd.read_csv(cons.input_profiles_file)
 
     weaker_married_merge = Merge('married with middle name, not star',
@@ -8,6 +8,7 @@ import pandas as pd
 import __main__
 
 from reference_data import ReferenceData
+from merge_chain import read_reference
 from merge_data import Merge
 from default_merges import default_merges, base_merge
 from general_utils import keep_duplicates, remove_duplicates
@@ -93,7 +94,7 @@ def get_setup():
 if __name__ == "__main__":
     cons, log = get_setup()
 
-    ref_df = pd.read_csv(cons.input_reference_file)
+    ref_df = read_reference(cons.input_reference_file)
     sup_df = pd.read_csv(cons.input_profiles_file)
 
     rd = ReferenceData(ref_df, cons.universal_id, add_cols=cons.add_cols, log=log)\
@@ -9,6 +9,7 @@ import __main__
 
 
 from reference_data import ReferenceData
+from merge_chain import read_reference
 from merge_data import Merge
 from default_merges import default_merges, base_merge
 import setup
@@ -45,7 +46,7 @@ def get_setup():
 if __name__ == "__main__":
     cons, log = get_setup()
 
-    ref_df = pd.read_csv(cons.input_reference_file)
+    ref_df = read_reference(cons.input_reference_file)
     sup_df = pd.read_csv(cons.input_profiles_file)
 
     rd = ReferenceData(ref_df, id=cons.universal_id, add_cols=cons.add_cols, null_flag_cols=['appointed_date'], log=log) \
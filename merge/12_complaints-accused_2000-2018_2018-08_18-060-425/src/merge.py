@@ -9,6 +9,7 @@ import numpy as np
 import __main__
 
 from reference_data import ReferenceData
+from merge_chain import read_reference
 from default_merges import base_merge, married_merge
 from merge_data import Merge
 from general_utils import keep_duplicates, remove_duplicates
@@ -96,7 +97,7 @@ def get_setup():
 if __name__ == "__main__":
     cons, log = get_setup()
 
-    ref_df = pd.read_csv(cons.input_reference_file)
+    ref_df = read_reference(cons.input_reference_file)
     sup_df = pd.read_csv(cons.input_profiles_file)
 
     base_merge.merge_dict['cr_id'] = ['cr_id', '']
@@ -0,0 +1 @@
+../../../share/src/merge_cache.py
\ No newline at end of file
@@ -9,6 +9,7 @@ import numpy as np
 import __main__
 
 from reference_data import ReferenceData
+from merge_chain import read_reference
 from default_merges import (
     base_merge,
     null_appointed_date_supplemental_merge,
@@ -99,7 +100,7 @@ if __name__ == "__main__":
     cons, log = get_setup()
 
     # cast cr_id to string in ref here
-    ref_df = pd.read_csv(cons.input_reference_file)
+    ref_df = read_reference(cons.input_reference_file)
     ref_df.cr_id = ref_df.cr_id.fillna('').astype(str).str.replace(".0", "", regex=False) \
         .replace("", np.nan)
 
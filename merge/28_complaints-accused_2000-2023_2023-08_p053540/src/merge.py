@@ -15,6 +15,7 @@ import numpy as np
 import __main__
 
 from reference_data import ReferenceData
+from merge_chain import read_reference
 from default_merges import (
     base_merge,
     base_merge_dict,
@@ -54,7 +55,7 @@ def get_setup():
 if __name__ == "__main__":
     cons, log = get_setup()
     
-    ref_df = pd.read_csv(cons.input_reference_file)
+    ref_df = read_reference(cons.input_reference_file)
     sup_df = pd.read_csv(cons.input_profiles_file)
 
     sup_df.loc[sup_df['first_name_NS'].isnull(), 'merge'] = 0
@@ -0,0 +1 @@
+../../../share/src/reference_store.py
\ No newline at end of file
@@ -3,42 +3,103 @@
 # if both appointed date and birth year are null, require first name, last name, 
 
 from merge_data import Merge, MergePostProcessor
+from probabilistic_merge import ProbabilisticMerge
 from foia_data import FoiaData
 import pandas as pd
-from typing import List, Callable
+from typing import List, Callable, Tuple
 from functools import partial
 import numpy as np
 from fuzzywuzzy import fuzz
 from general_utils import list_intersect
 from filters import name_matching_ensemble
+from string_similarity import score_pairs, is_substring
 
 ## filters ##
 # note that these filters should all be MergePostProcessor type
 # meaning they should take the same arguments as that type (see merge_data.py)
 # a lot of these filters are converted to specific MergePostProcessors with partials specifying optional parameters
+def matched_on_bits(on_lists: List[List[str]]) -> Tuple[np.ndarray, List[str]]:
+    """Encodes column lists matched on (matched_on strings split on '-') as bitmasks of the columns
+
+    Columns get bits in order of first appearance, in as many 64 bit words as needed.
+
+    Returns
+    -------
+    Tuple[np.ndarray, List[str]]
+        (lists x words) uint64 bitmasks, and the column of each bit
+    """
+    columns = list(dict.fromkeys(col for on_list in on_lists for col in on_list))
+    bits = {col: i for i, col in enumerate(columns)}
+
+    words = max((len(columns) + 63) // 64, 1)
+    on_list_bits = np.zeros((len(on_lists), words), dtype=np.uint64)
+    for i, on_list in enumerate(on_lists):
+        for col in on_list:
+            on_list_bits[i, bits[col] // 64] |= np.uint64(1) << np.uint64(bits[col] % 64)
+
+    return on_list_bits, columns
+
+
+def columns_bits(cols: List[str], columns: List[str], words: int) -> np.ndarray:
+    """Bitmask of cols, with the bits of matched_on_bits columns"""
+    col_bits = np.zeros(words, dtype=np.uint64)
+    for col in cols:
+        i = columns.index(col)
+        col_bits[i // 64] |= np.uint64(1) << np.uint64(i % 64)
+    return col_bits
+
+
+def render_matched_on(pairs: np.ndarray, codes: np.ndarray, on_lists: List[List[str]]) -> np.ndarray:
+    """matched_on string of each pair, columns in the order the rows of the pair first matched on them
+
+    pairs and codes (of on_lists) are per row, rows of a pair in order. Each distinct sequence
+    of column lists is rendered once, in pair order
+    """
+    sequences = pd.DataFrame({'pair': pairs, 'code': codes}).drop_duplicates() \
+        .groupby('pair', sort=True)['code'].agg(tuple)
+    rendered = {sequence: "-".join(dict.fromkeys(col for code in sequence for col in on_lists[code]))
+                for sequence in set(sequences)}
+    return np.array([rendered[sequence] for sequence in sequences], dtype=object)
+
+
 def multirow_merge_process(ref_unmerged: pd.DataFrame,
                            sup_unmerged: pd.DataFrame,
                            ref_id: int,
                            sup_id: int,
                            merged_df: pd.DataFrame,
                            required_cols: List[str]) -> pd.DataFrame:
-    all_matched_columns = merged_df.assign(matched_on=merged_df.matched_on.str.split("-")) \
-        .explode('matched_on') \
-        .drop_duplicates() \
-        .groupby([ref_id, sup_id]) \
-        .agg(matched_on=('matched_on', '-'.join)) 
-    
-    required_cols = [col for col in required_cols if (col in sup_unmerged) and (col in ref_unmerged)]
+    """Keeps id pairs that matched on every required column, across all the column lists they matched on
 
-    def get_matched_mask(df, required_cols):
-        mask = pd.Series([True] * len(df), index=df.index)
-        for col in required_cols:
-            mask = mask & df.matched_on.str.contains(col)
-        return mask
-    
-    multirow_match_mask = get_matched_mask(all_matched_columns, required_cols)
+    Columns matched on are combined per id pair as bitmasks (bitwise or), 
+    matched_on is rendered only for the pairs kept
+    """
+    required_cols = [col for col in required_cols if (col in sup_unmerged) and (col in ref_unmerged)]
+    if merged_df.empty:
+        return pd.DataFrame(columns=[ref_id, sup_id, 'matched_on'])
+
+    codes, on_lists = pd.factorize(merged_df['matched_on'])
+    on_lists = [on_list.split("-") for on_list in on_lists]
+    on_list_bits, columns = matched_on_bits(on_lists)
+    bits = on_list_bits[codes]
+
+    # or the bitmasks of every row of each id pair, pairs in sorted order like groupby
+    pair_codes = merged_df.groupby([ref_id, sup_id], sort=True).ngroup().to_numpy()
+    order = np.argsort(pair_codes, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(pair_codes[order]) != 0])
+    pair_bits = np.bitwise_or.reduceat(bits[order], starts, axis=0)
+    pairs = merged_df[[ref_id, sup_id]].iloc[order[starts]]
+
+    if any(col not in columns for col in required_cols):
+        # a required column no pair matched on
+        multirow_match_mask = np.zeros(len(pairs), dtype=bool)
+    else:
+        required_bits = columns_bits(required_cols, columns, bits.shape[1])
+        multirow_match_mask = ((pair_bits & required_bits) == required_bits).all(axis=1)
 
-    return all_matched_columns[multirow_match_mask].reset_index()
+    kept_rows = multirow_match_mask[pair_codes]
+    return pairs[multirow_match_mask] \
+        .assign(matched_on=render_matched_on(pair_codes[kept_rows], codes[kept_rows], on_lists)) \
+        .reset_index(drop=True)
     
 def link_ref_and_sup(ref_unmerged: pd.DataFrame, 
                     sup_unmerged: pd.DataFrame,
@@ -111,13 +172,39 @@ def filter_substring_names(ref_unmerged: pd.DataFrame,
     ref_col = col + "_ref"
     sup_col = col + "_sup"
 
-    substring_mask = merged_with_columns.apply(lambda row: (row[ref_col] in row[sup_col]) or 
-                                               (row[sup_col] in row[ref_col]), axis=1)
+    substring_mask = score_pairs(merged_with_columns[ref_col], merged_with_columns[sup_col],
+                                 is_substring, null_score=False)
     
     filtered_df = merged_with_columns[substring_mask][[ref_id, sup_id]].drop_duplicates()
 
     return merged_df.merge(filtered_df[[ref_id, sup_id]], on=[ref_id, sup_id]) 
 
+def filter_fuzzy_match_names(ref_unmerged: pd.DataFrame,
+                             sup_unmerged: pd.DataFrame,
+                             ref_id: int,
+                             sup_id: int,
+                             merged_df: pd.DataFrame,
+                             col: str) -> pd.DataFrame:
+    """Filters candidate merges of a fuzzy merge to those whose col values match by name_matching_ensemble
+    (jaro winkler similarity, double metaphone or nicknames), linked with merged_df
+
+    Parameters
+    ----------
+    col : str
+        column to fuzzy match on
+
+    Returns
+    -------
+    pd.DataFrame
+        merged_df with only rows whose col values match
+    """
+    merged_with_columns = name_matching_ensemble(
+        link_ref_and_sup(ref_unmerged, sup_unmerged, ref_id, sup_id, merged_df, [col]), col)
+
+    filtered_df = merged_with_columns[merged_with_columns['ensemble_match']][[ref_id, sup_id]].drop_duplicates()
+
+    return merged_df.merge(filtered_df, on=[ref_id, sup_id])
+
 def remove_sup_duplicate_merges_filter(ref_unmerged: pd.DataFrame,
                            sup_unmerged: pd.DataFrame,
                            ref_id: int,
@@ -156,6 +243,9 @@ last_name_substring_filter: MergePostProcessor = partial(filter_substring_names,
 
 first_name_phonetic_filter: MergePostProcessor = partial(filter_substring_names)
 
+first_name_fuzzy_match_filter: MergePostProcessor = partial(filter_fuzzy_match_names, col='first_name_NS')
+last_name_fuzzy_match_filter: MergePostProcessor = partial(filter_fuzzy_match_names, col='last_name_NS')
+
 ## default merges ##
 base_merge_dict = {'star': ['star', ''],
                     'first_name': ['first_name_NS', 'F4FN'],
@@ -222,15 +312,24 @@ first_name_substring_merge = Merge(name='first name substring merge',
                                                'first_name': ['first_name_NS', 'F4FN', '']},
                                     merge_postprocess=first_name_substring_filter)
 
-# first_name_fuzzy_match_merge = Merge(name='first name fuzzy match merge',
-#                                      merge_dict={**base_merge_dict,
-#                                                 'first_name': ['first_name_NS', 'F4FN', '']},
-#                                     merge_postprocess=first_name_fuzzy_match_filter)
-
-# last_name_fuzzy_match_merge = Merge(name='last name fuzzy match merge',
-#                                      merge_dict={**base_merge_dict,
-#                                                 'last_name': ['last_name_NS', 'F4LN', '']},
-#                                     merge_postprocess=last_name_fuzzy_match_filter)
+# candidates are names within 2 typos in the same block of other columns, see MergeIndex.fuzzy_join
+first_name_fuzzy_match_merge = Merge(name='first name fuzzy match merge',
+                                     merge_dict={**base_merge_dict,
+                                                 'first_name': ['first_name_NS']},
+                                     fuzzy_cols=['first_name_NS'],
+                                     max_edits=2,
+                                     merge_postprocess=first_name_fuzzy_match_filter)
+
+last_name_fuzzy_match_merge = Merge(name='last name fuzzy match merge',
+                                    merge_dict={**base_merge_dict,
+                                                'last_name': ['last_name_NS']},
+                                    fuzzy_cols=['last_name_NS'],
+                                    max_edits=2,
+                                    merge_postprocess=last_name_fuzzy_match_filter)
+
+# scores candidate pairs on every class of base_merge_dict at once instead of its cartesian on_lists,
+# for large supplemental files, see ProbabilisticMerge
+probabilistic_base_merge = ProbabilisticMerge(name='probabilistic base merge', merge_dict=base_merge_dict)
 
 def view_possible_matches(ref_unmerged: pd.DataFrame, 
                            sup_unmerged: pd.DataFrame, 
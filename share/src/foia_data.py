@@ -1,7 +1,11 @@
-from general_utils import reshape_data, list_intersect
+from general_utils import reshape_data, list_intersect, map_unique
+from merge_index import KeyDictionary, KEY_DICTIONARY, ConsumedIds, matches_cached
+from string_similarity import metaphone_codes, nickname_class
+from reference_store import ReferenceStore
+from merge_cache import PreparedCache
 import pandas as pd
 import logging
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Union, Optional
 import pandas as pd 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -16,7 +20,9 @@ class FoiaData:
                  null_flag_cols: List[str] = ['birth_year',],
                  from_year: int = 2017, 
                  one_to_one: bool = True,
-                 log: logging.Logger = None) -> None:
+                 log: logging.Logger = None,
+                 key_dictionary: KeyDictionary = None,
+                 prepared_cache: Optional[PreparedCache] = None) -> None:
         """FOIA data class, encapsulates data from a foia request and its metadata
 
         Has methods to prepare data for merging
@@ -29,11 +35,18 @@ class FoiaData:
             id for this foia_data
         add_cols : List[str], optional
             list of columns to add to the data, by default []
+            e.g. F4FN (first 4 letters of first name), MPLN/MSLN (double metaphone primary/secondary code
+            of last name), NNFN (nickname class of first name), see add_columns
         from_year : int, optional
             the year this data began on, by default 2017 based on first roster
             for supplemental foias, this is the year the data was given
         log : logging.Logger, optional
             logging object, by default None
+        key_dictionary : KeyDictionary, optional
+            dictionary merge key columns are encoded with, see encode_keys, 
+            by default the dictionary shared by all FoiaData in this process
+        prepared_cache : Optional[PreparedCache], optional
+            cache to read the prepared df from, and write it to, by default None (always prepared)
         """        
         self.id = id
         self.add_cols = add_cols
@@ -41,14 +54,76 @@ class FoiaData:
         self.from_year = from_year
         self.one_to_one = one_to_one
         self.log = log or logging.getLogger(__name__)
+        self.key_dictionary = key_dictionary or KEY_DICTIONARY
+        # codes of each key column of df, with a copy of the values they were encoded from
+        self.key_codes: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.key_codes_df = None
+
+        # keyed before preparing, add_columns can change df in place
+        key = None if prepared_cache is None else \
+            prepared_cache.key(df, [id, add_cols, null_flag_cols, from_year], self.prepare_steps)
+        if key is None:
+            self.df = self.prepare_data(df, id, add_cols, from_year)
+        else:
+            self.df = prepared_cache.get(key)
+            if self.df is None:
+                self.df = self.prepare_data(df, id, add_cols, from_year)
+                prepared_cache.put(key, self.df)
+            else:
+                self.log.info(f'Prepared data with ID = {id} read from cache')
+
+        # shares the data of df, unmerged is always read as a slice of it (a copy), so changes to it don't reach df
+        self.unmerged = self.df.copy(deep=False)
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """Prepared data, the unified view of its partitions if it is kept in a ReferenceStore"""
+        return self._df.df if isinstance(self._df, ReferenceStore) else self._df
+
+    @property
+    def columns(self) -> List[str]:
+        """Columns of df, without building the unified view of a ReferenceStore"""
+        return self._df.columns if isinstance(self._df, ReferenceStore) else self._df.columns.tolist()
+
+    def id_count(self) -> int:
+        """Number of distinct ids in df, reading only the id column of a ReferenceStore"""
+        if isinstance(self._df, ReferenceStore):
+            return self._df.view([self.id])[self.id].nunique()
+        return self._df[self.id].nunique()
+
+    @df.setter
+    def df(self, df: Union[pd.DataFrame, ReferenceStore]) -> None:
+        self._df = df
+
+    @property
+    def unmerged(self) -> pd.DataFrame:
+        """Rows whose ids aren't merged yet
+
+        Merged ids are kept in a bitset (see mark_merged), the frame is only sliced when read.
+        The slice is a copy even before anything is merged, the frame it is sliced from can share data with df
+        """
+        if self._unmerged is None:
+            self._unmerged = self._unmerged_base[self.merged_ids.row_mask()]
+        return self._unmerged
+
+    @unmerged.setter
+    def unmerged(self, unmerged: pd.DataFrame) -> None:
+        id_codes, id_uniques = pd.factorize(unmerged[self.id])
+        self._unmerged_base = unmerged
+        self._unmerged = None
+        self.unmerged_ids = pd.Index(id_uniques)
+        self.merged_ids = ConsumedIds(id_codes, len(id_uniques))
+
+    def mark_merged(self, ids: pd.Series) -> None:
+        """Remove ids from unmerged, without copying it until it is next read
 
-        self.df = df.pipe(self.drop_unmergeable_rows) \
-            .pipe(self.reshape_star_cols_to_rows, id=id) \
-            .pipe(self.reshape_cr_id_cols_to_rows, id=id) \
-            .pipe(self.add_columns, add_cols=add_cols, from_year=from_year) \
-            .pipe(self.calculate_null_flags, cols=self.null_flag_cols)
-
-        self.unmerged = self.df.copy()
+        Parameters
+        ----------
+        ids : pd.Series
+            merged ids, ids not in unmerged are ignored
+        """
+        self.merged_ids.add_codes(self.unmerged_ids.get_indexer(ids.drop_duplicates()))
+        self._unmerged = None
 
     def prepare_data(self, df: pd.DataFrame, id: str, add_cols: List[str] = [], from_year: int = 2017) -> pd.DataFrame:
         """Prepare data for merging
@@ -76,6 +151,12 @@ class FoiaData:
             .pipe(self.add_columns, add_cols=add_cols, from_year=from_year) \
             .pipe(self.calculate_null_flags, cols=self.null_flag_cols)
 
+    @property
+    def prepare_steps(self) -> List:
+        """Functions prepare_data runs, part of the prepared cache key so changes to them aren't read from cache"""
+        return [FoiaData.prepare_data, FoiaData.drop_unmergeable_rows, FoiaData.reshape_star_cols_to_rows,
+                FoiaData.reshape_cr_id_cols_to_rows, FoiaData.add_columns, FoiaData.calculate_null_flags]
+
     def drop_unmergeable_rows(self, df: pd.DataFrame) -> pd.DataFrame:
         row_count = df.shape[0]
         if 'merge' in df.columns:
@@ -125,7 +206,15 @@ class FoiaData:
                                else 'last_name_NS'
                     start, end = (0, int(add_col[1])) if add_col[0] == 'F'\
                                  else (-int(add_col[1]), None)
-                    df[add_col] = df[use_col].map(lambda x: x[start:end])
+                    df[add_col] = map_unique(df[use_col], lambda x: x[start:end])
+                if re.fullmatch("M[PS][FL]N", add_col):
+                    # double metaphone primary (MP) or secondary (MS) code of the first or last name
+                    use_col = 'first_name_NS' if add_col[2] == 'F'\
+                               else 'last_name_NS'
+                    code = 0 if add_col[1] == 'P' else 1
+                    df[add_col] = map_unique(df[use_col], lambda x: metaphone_codes(x)[code] or np.nan)
+                if add_col == 'NNFN':
+                    df[add_col] = map_unique(df['first_name_NS'], nickname_class)
                 if add_col == 'current_age' and "current_age" in df.columns:
                     df['current_age_p1'] = df['current_age'] + (2017-from_year)
                     df['current_age_m1'] = df['current_age'] + (2017-from_year)
@@ -176,14 +265,72 @@ class FoiaData:
 
         return df.join(null_flags)
     
+    def encode_keys(self, frame: pd.DataFrame, cols: List[str], same_values: bool = True) -> Dict[str, np.ndarray]:
+        """Integer codes of merge key columns in frame, from the key dictionary
+
+        Columns of df are encoded once and cached, frames that are row subsets of df 
+        (unmerged, or a query of it) reuse those codes by index instead of re-encoding.
+        Columns whose values no longer match the values they were encoded from
+        (e.g. assigned to in unmerged or df) are encoded again
+
+        Parameters
+        ----------
+        frame : pd.DataFrame
+            dataframe to get codes for, usually unmerged
+        cols : List[str]
+            merge key columns, columns not in frame are skipped
+        same_values : bool, optional
+            whether frame has the same values as df for its rows, by default True
+            set to false if frame was transformed, so its columns are encoded directly
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+            int32 codes for each column, aligned with the rows of frame
+        """
+        cols = [col for col in cols if col in frame.columns]
+
+        rows = None
+        if same_values and self.df.index.is_unique:
+            if self.key_codes_df is not self.df:
+                # df was replaced, cached codes are stale
+                self.key_codes, self.key_codes_df = {}, self.df
+            rows = self.df.index.get_indexer(frame.index)
+            if (rows < 0).any():
+                rows = None
+
+        codes = {}
+        for col in cols:
+            if rows is None or col not in self.df.columns:
+                codes[col] = self.key_dictionary.encode(col, frame[col])
+            else:
+                if col not in self.key_codes:
+                    self.key_codes[col] = (self.key_dictionary.encode(col, self.df[col]),
+                                           self.df[col].to_numpy(copy=True))
+                col_codes, col_values = self.key_codes[col]
+                if matches_cached(frame[col].to_numpy(), col_values[rows]):
+                    codes[col] = col_codes[rows]
+                else:
+                    codes[col] = self.key_dictionary.encode(col, frame[col])
+
+        return codes
+
+    def reset_keys(self, key_dictionary: KeyDictionary) -> None:
+        """Codes keys from key_dictionary from now on, dropping codes cached from the last dictionary"""
+        self.key_dictionary = key_dictionary
+        self.key_codes, self.key_codes_df = {}, None
+
     def filter_merges(self, merged_df, unmerged):
         return unmerged[~unmerged[self.id].isin(merged_df[self.id])]
 
     def merged_percent(self, merged_count):
-        return round(100 * (merged_count / self.df[self.id].nunique()), 2)
+        return round(100 * (merged_count / self.id_count()), 2)
     
+    def unmerged_count(self):
+        return self.merged_ids.remaining()
+
     def unmerged_percent(self):
-        return round(100 * (self.unmerged[self.id].nunique() / self.df[self.id].nunique()), 2)
+        return round(100 * (self.unmerged_count() / self.id_count()), 2)
 
     def get_column_changes(self, col: str, keep_cols: List[str] = None) -> pd.DataFrame:
         """Get changes in a column for the same id
@@ -9,6 +9,7 @@ import itertools
 import pandas as pd
 import numpy as np
 import hashlib
+import gzip
 from functools import reduce
 
 def get_default_logger(outpath=None):
@@ -362,6 +363,30 @@ def fill_data(df, id_col):
     return filled_df
 
 
+def map_unique(series, func):
+    """Applies func once per unique non-null value of series, instead of once per row
+
+    Parameters
+    ----------
+    series : pandas Series
+    func : function
+        Applied to each unique value
+
+    Returns
+    -------
+    mapped : pandas Series
+        func of each value, nulls left as NaN, same index as series
+
+    Examples
+    --------
+    >>> map_unique(pd.Series(['JOHN', 'JOHNNY', 'JOHN', np.nan]), lambda x: x[:4]).tolist()
+    ['JOHN', 'JOHN', 'JOHN', nan]
+    """
+    codes, uniques = pd.factorize(series)
+    mapped = np.append(np.array([func(x) for x in uniques], dtype=object), np.nan)
+    return pd.Series(mapped[codes], index=series.index, name=series.name)
+
+
 def list_unique(dup_list):
     """Returns list of first unique values in a list
     Parameters
@@ -601,6 +626,82 @@ def sterilize_df(df, sterilize_columns):
     return df
 
 
+def open_output(output_path, compression='infer'):
+    """Opens output_path for writing text, gzipped if compression is gzip
+    (or inferred from a .gz output_path)"""
+    if compression == 'infer':
+        compression = 'gzip' if output_path.endswith('.gz') else None
+    if compression == 'gzip':
+        return gzip.open(output_path, 'wt', newline='')
+    if compression is None:
+        return open(output_path, 'w', newline='')
+    raise ValueError('Unsupported compression for streamed output: %s' % compression)
+
+
+def stream_link(input_path, output_path, link_df, on, link_col,
+                csv_opts={}, chunksize=100000):
+    """Adds link_col to input_path by its on column, chunk by chunk,
+    and writes each chunk to output_path as soon as it is linked
+
+    Same as a left merge of link_df on the full file, without holding it in memory:
+    on values are looked up in an index of link_df built once, so every input
+    row gives exactly one output row. Input values are copied as text,
+    and link_col is written as nullable integers if it is an integer column
+
+    Parameters
+    ----------
+    input_path : str
+        Path of input file (csv)
+    output_path : str
+        Path of output file (csv)
+    link_df : pandas DataFrame
+        Columns on and link_col
+    on : str
+        Column of input_path to link by
+    link_col : str
+        Column of link_df added to the output
+    csv_opts : dict
+        Dictionary of pandas .to_csv options
+    chunksize : int
+        Number of rows read and written at a time
+
+    Returns
+    -------
+    rows : int
+        Number of rows written
+    """
+    link_df = link_df[[on, link_col]].drop_duplicates()
+    # on values linked to several link_col values would duplicate rows in a merge
+    multiple = set(link_df.loc[link_df[on].duplicated(), on])
+    link_df = link_df.drop_duplicates(on)
+    link_index = pd.Index(link_df[on])
+    links = pd.array(link_df[link_col],
+                     dtype='Int64' if pd.api.types.is_integer_dtype(link_df[link_col]) else None)
+
+    csv_opts = dict(csv_opts)
+    compression = csv_opts.pop('compression', 'infer')
+    csv_opts.pop('header', None)
+    read_rows = written_rows = 0
+    with open_output(output_path, compression) as output:
+        chunks = pd.read_csv(input_path, chunksize=chunksize, dtype=str,
+                             keep_default_na=False, na_values=[''])
+        for chunk in chunks:
+            keys = chunk[on]
+            if pd.api.types.is_numeric_dtype(link_index):
+                keys = pd.to_numeric(keys, errors='coerce')
+            assert not keys.isin(multiple).any(), 'Missing rows!'
+            positions = link_index.get_indexer(keys)
+            chunk[link_col] = links.take(positions, allow_fill=True)
+            chunk.to_csv(output, header=(written_rows == 0), **csv_opts)
+            read_rows += keys.shape[0]
+            written_rows += chunk.shape[0]
+        if not read_rows:
+            columns = pd.read_csv(input_path, nrows=0).columns.tolist()
+            pd.DataFrame(columns=columns + [link_col]).to_csv(output, **csv_opts)
+    assert written_rows == read_rows, 'Missing rows!'
+    return written_rows
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -0,0 +1,139 @@
+import pandas as pd
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# components with more reference or supplemental ids than this are resolved greedily (see greedy_component),
+# checking every assigned pair of a component re-solves it once per pair
+MAX_COMPONENT_IDS = 100
+
+
+def pair_components(ref_codes: np.ndarray, sup_codes: np.ndarray) -> np.ndarray:
+    """Connected component of each candidate pair, in the bipartite graph of reference and supplemental ids
+
+    Parameters
+    ----------
+    ref_codes : np.ndarray
+        reference id code (0 to number of reference ids) of each pair
+    sup_codes : np.ndarray
+        supplemental id code of each pair
+
+    Returns
+    -------
+    np.ndarray
+        component label of each pair
+    """
+    ref_count = int(ref_codes.max()) + 1 if len(ref_codes) else 0
+    nodes = ref_count + (int(sup_codes.max()) + 1 if len(sup_codes) else 0)
+    graph = coo_matrix((np.ones(len(ref_codes), dtype=np.int8), (ref_codes, sup_codes + ref_count)),
+                       shape=(nodes, nodes))
+    _, labels = connected_components(graph, directed=False)
+    return labels[ref_codes]
+
+
+def assign_component(ref_codes: np.ndarray, sup_codes: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Pairs of one component in a maximum weight one to one assignment, that every such assignment has
+
+    Pairs that a different assignment of the same total weight leaves out are ambiguous,
+    and aren't kept, so ids that match equally well to several ids stay unmerged.
+
+    Returns
+    -------
+    np.ndarray
+        boolean mask of kept pairs
+    """
+    ref_local, ref_uniques = pd.factorize(ref_codes)
+    sup_local, sup_uniques = pd.factorize(sup_codes)
+    # pairs that aren't candidates weigh 0, assigning them is the same as leaving ids unassigned
+    matrix = np.zeros((len(ref_uniques), len(sup_uniques)))
+    matrix[ref_local, sup_local] = weights
+
+    def solve(matrix):
+        rows, cols = linear_sum_assignment(matrix, maximize=True)
+        assigned = matrix[rows, cols] > 0
+        return rows[assigned], cols[assigned], matrix[rows, cols].sum()
+
+    rows, cols, best = solve(matrix)
+    kept = np.zeros(len(ref_codes), dtype=bool)
+    for row, col in zip(rows, cols):
+        without = matrix.copy()
+        without[row, col] = 0
+        if solve(without)[2] < best:
+            kept |= (ref_local == row) & (sup_local == col)
+    return kept
+
+
+def greedy_component(ref_codes: np.ndarray, sup_codes: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Pairs of one component kept best weight first, each only if both of its ids are still unassigned
+
+    Stand in for assign_component on components too large to re-solve for every pair. Ambiguous pairs
+    are left out the same way: if an id's best unassigned candidates are tied, none of them are kept
+    and the tied ids are left unmerged.
+
+    Returns
+    -------
+    np.ndarray
+        boolean mask of kept pairs
+    """
+    kept = np.zeros(len(ref_codes), dtype=bool)
+    done_ref, done_sup = set(), set()
+    order = np.argsort(-weights, kind='stable')
+    bounds = np.flatnonzero(np.diff(weights[order])) + 1
+    for tier in np.split(order, bounds):
+        # pairs of the same weight, among ids not assigned by a better pair
+        tier = np.array([pair for pair in tier if ref_codes[pair] not in done_ref and sup_codes[pair] not in done_sup],
+                        dtype=int)
+        _, ref_tier, ref_counts = np.unique(ref_codes[tier], return_inverse=True, return_counts=True)
+        _, sup_tier, sup_counts = np.unique(sup_codes[tier], return_inverse=True, return_counts=True)
+        kept[tier[(ref_counts[ref_tier] == 1) & (sup_counts[sup_tier] == 1)]] = True
+        done_ref.update(ref_codes[tier].tolist())
+        done_sup.update(sup_codes[tier].tolist())
+    return kept
+
+
+def assign_pairs(ref_codes: np.ndarray,
+                 sup_codes: np.ndarray,
+                 weights: np.ndarray,
+                 max_component_ids: int = MAX_COMPONENT_IDS) -> np.ndarray:
+    """Candidate pairs kept by an optimal one to one assignment, solved separately for each connected component
+
+    Candidates of a merge form a bipartite graph between reference and supplemental ids
+    that is almost entirely small components, most of them a single pair, which are kept without solving.
+
+    Parameters
+    ----------
+    ref_codes : np.ndarray
+        reference id code of each pair, see pd.factorize
+    sup_codes : np.ndarray
+        supplemental id code of each pair, pairs are unique
+    weights : np.ndarray
+        positive weight of each pair, higher for better matches
+    max_component_ids : int, optional
+        components with more ids than this on either side are resolved by greedy_component,
+        by default MAX_COMPONENT_IDS
+
+    Returns
+    -------
+    np.ndarray
+        boolean mask of the pairs kept, each reference and supplemental id is in at most one,
+        see assign_component for how equally good assignments are resolved
+    """
+    ref_codes, sup_codes = np.asarray(ref_codes), np.asarray(sup_codes)
+    weights = np.asarray(weights, dtype=float)
+    assert (weights > 0).all(), 'Pair weights must be positive'
+    if not len(weights):
+        return np.zeros(0, dtype=bool)
+
+    labels = pair_components(ref_codes, sup_codes)
+    sizes = np.bincount(labels)[labels]
+    kept = sizes == 1
+
+    multiple = np.flatnonzero(sizes > 1)
+    order = multiple[np.argsort(labels[multiple], kind='stable')]
+    bounds = np.flatnonzero(np.diff(labels[order])) + 1
+    for pairs in np.split(order, bounds) if len(order) else []:
+        ids = max(len(np.unique(ref_codes[pairs])), len(np.unique(sup_codes[pairs])))
+        resolve = assign_component if ids <= max_component_ids else greedy_component
+        kept[pairs] = resolve(ref_codes[pairs], sup_codes[pairs], weights[pairs])
+    return kept
@@ -0,0 +1,231 @@
+import pandas as pd
+import numpy as np
+import __main__
+import os
+from typing import List, Optional
+from typing_extensions import Self
+
+# columns shown for each side of a merge, in this order, by default
+AUDIT_COLUMNS = ["first_name_NS", "last_name_NS", "star", "cr_id", "log_no", "appointed_date",
+                 "birth_year", "gender", "race", "current_unit", "middle_initial",
+                 "middle_initial2", "suffix_name"]
+
+# set to write the audit of every loop_merge of a merge step run, without changing merge scripts
+AUDIT_ENV = 'MERGE_AUDIT'
+
+
+def audit_path_from_env(loop: int = 1) -> Optional[str]:
+    """output/<script>.merge_audit.npz of the running script if MERGE_AUDIT is set, None otherwise
+
+    Audits of loop_merges after the first of a script are numbered, e.g. <script>.merge_audit_2.npz
+    """
+    if not os.environ.get(AUDIT_ENV) or not hasattr(__main__, '__file__'):
+        return None
+    script = os.path.basename(__main__.__file__)[:-3]
+    suffix = '' if loop == 1 else f'_{loop}'
+    return f'output/{script}.merge_audit{suffix}.npz'
+
+
+class MergeAudit:
+    def __init__(self, table: pd.DataFrame, ref_id: str, sup_id: str, columns: List[str]) -> None:
+        """Columnar table of the id pairs of a merge step, to review merges by querying instead of reading a workbook
+
+        One row per merged pair (and merge it came from): the merge_name, matched_on and the values of each audited
+        column on each side. Columns are numbered by bit in columns: matched_bits has the bits of the columns
+        matched on, compared_bits of the columns with values on both sides and agreed_bits of those with a value
+        in common, so pairs are filtered on them with integer operations.
+
+        Use build to make one from a merge and save / load to keep it with the output of a merge step.
+
+        Parameters
+        ----------
+        table : pd.DataFrame
+            audit table, see build
+        ref_id : str
+            reference id column
+        sup_id : str
+            supplemental id column
+        columns : List[str]
+            column of each bit of the bitmask columns
+        """
+        assert len(columns) <= 64, 'Merge audits have at most 64 columns'
+        self.table = table
+        self.ref_id = ref_id
+        self.sup_id = sup_id
+        self.columns = columns
+
+    @classmethod
+    def build(cls,
+              merged_df: pd.DataFrame,
+              ref_df: pd.DataFrame,
+              sup_df: pd.DataFrame,
+              ref_id: str,
+              sup_id: str,
+              ordered_cols: Optional[List[str]] = None) -> Self:
+        """Audit of merged_df, with the values of ordered_cols of the merged ids in ref_df and sup_df
+
+        Parameters
+        ----------
+        merged_df : pd.DataFrame
+            merged id pairs with matched_on and, if it has one, merge_name
+        ref_df : pd.DataFrame
+            reference data, only rows of merged ids are read
+        sup_df : pd.DataFrame
+            supplemental data, only rows of merged ids are read
+        ref_id : str
+            reference id column
+        sup_id : str
+            supplemental id column
+        ordered_cols : Optional[List[str]], optional
+            columns to audit, the ones in both ref_df and sup_df are kept in this order, by default AUDIT_COLUMNS
+
+        Returns
+        -------
+        MergeAudit
+        """
+        audit_cols = [col for col in ordered_cols or AUDIT_COLUMNS if col in ref_df.columns and col in sup_df.columns]
+        pairs = merged_df[[ref_id, sup_id]].reset_index(drop=True)
+        pairs['merge_name'] = pd.Categorical(merged_df['merge_name'].to_numpy() if 'merge_name' in merged_df.columns
+                                             else np.full(len(pairs), ''))
+        pairs['matched_on'] = pd.Categorical(merged_df['matched_on'].to_numpy())
+
+        # bits of audited columns first, then of any other column matched on
+        on_lists = [on_list.split('-') for on_list in pairs['matched_on'].cat.categories]
+        columns = list(dict.fromkeys(audit_cols + [col for on_list in on_lists for col in on_list]))
+        on_list_bits = np.array([bitmask(on_list, columns) for on_list in on_lists] or [0], dtype=np.uint64)
+        pairs['matched_bits'] = on_list_bits[pairs['matched_on'].cat.codes.clip(lower=0)]
+        pairs['compared_bits'] = np.zeros(len(pairs), dtype=np.uint64)
+        pairs['agreed_bits'] = np.zeros(len(pairs), dtype=np.uint64)
+
+        ref_rows = ref_df[ref_df[ref_id].isin(pairs[ref_id])]
+        sup_rows = sup_df[sup_df[sup_id].isin(pairs[sup_id])]
+        for bit, col in enumerate(audit_cols):
+            ref_values = ref_rows[[ref_id, col]].dropna().drop_duplicates()
+            sup_values = sup_rows[[sup_id, col]].dropna().drop_duplicates()
+            pairs[f'ref_{col}'] = pairs[ref_id].map(joined_values(ref_values, ref_id, col))
+            pairs[f'sup_{col}'] = pairs[sup_id].map(joined_values(sup_values, sup_id, col))
+
+            compared = pairs[ref_id].isin(ref_values[ref_id]) & pairs[sup_id].isin(sup_values[sup_id])
+            agreed = pairs.index.isin(shared_value_pairs(pairs, ref_values, sup_values, ref_id, sup_id, col))
+            pairs['compared_bits'] |= np.where(compared, np.uint64(1) << np.uint64(bit), np.uint64(0))
+            pairs['agreed_bits'] |= np.where(agreed, np.uint64(1) << np.uint64(bit), np.uint64(0))
+
+        return cls(pairs, ref_id, sup_id, columns)
+
+    def select(self,
+               ref_ids: Optional[List] = None,
+               sup_ids: Optional[List] = None,
+               merge_names: Optional[List[str]] = None,
+               matched_on: Optional[List[str]] = None,
+               disagree_on: Optional[List[str]] = None) -> pd.DataFrame:
+        """Rows of the audit table matching every filter given
+
+        Parameters
+        ----------
+        ref_ids : Optional[List], optional
+            reference ids (UIDs) to keep, by default all
+        sup_ids : Optional[List], optional
+            supplemental ids to keep, by default all
+        merge_names : Optional[List[str]], optional
+            merges to keep the pairs of, by default all
+        matched_on : Optional[List[str]], optional
+            columns every kept pair matched on, by default none
+        disagree_on : Optional[List[str]], optional
+            columns a kept pair has values on both sides of but none in common, any of them, by default none
+
+        Returns
+        -------
+        pd.DataFrame
+            selected rows of the audit table
+        """
+        mask = np.ones(len(self.table), dtype=bool)
+        if ref_ids is not None:
+            mask &= self.table[self.ref_id].isin(ref_ids).to_numpy()
+        if sup_ids is not None:
+            mask &= self.table[self.sup_id].isin(sup_ids).to_numpy()
+        if merge_names is not None:
+            mask &= self.table['merge_name'].isin(merge_names).to_numpy()
+        if matched_on:
+            matched_bits = np.uint64(bitmask(matched_on, self.columns))
+            mask &= (self.table['matched_bits'].to_numpy() & matched_bits) == matched_bits
+        if disagree_on:
+            disagree_bits = np.uint64(bitmask(disagree_on, self.columns))
+            disagreed = self.table['compared_bits'].to_numpy() & ~self.table['agreed_bits'].to_numpy()
+            mask &= (disagreed & disagree_bits) != 0
+        return self.table[mask]
+
+    def disagreements(self) -> pd.Series:
+        """Number of pairs that disagree on each audited column, by merge"""
+        disagreed = self.table['compared_bits'].to_numpy() & ~self.table['agreed_bits'].to_numpy()
+        counts = pd.DataFrame({col: (disagreed >> np.uint64(bit)) & np.uint64(1)
+                               for bit, col in enumerate(self.columns) if f'ref_{col}' in self.table.columns},
+                              index=self.table.index).astype(int)
+        return counts.groupby(self.table['merge_name'].to_numpy()).sum().stack()
+
+    def report(self) -> pd.DataFrame:
+        """The audit as the match / ref / sup column MultiIndex frame of ReferenceData.generate_merge_report"""
+        table = self.table.set_index([self.ref_id, self.sup_id])
+        audit_cols = [col for col in self.columns if f'ref_{col}' in table.columns]
+        matched = pd.DataFrame({col: ((table['matched_bits'].to_numpy() >> np.uint64(bit)) & np.uint64(1)).astype(int)
+                                for bit, col in enumerate(self.columns)}, index=table.index)
+        matched = matched.loc[:, matched.any()]
+
+        match = pd.concat([table[['matched_on', 'merge_name']].astype(object), matched], axis=1)
+        ref = table[[f'ref_{col}' for col in audit_cols]].set_axis(audit_cols, axis=1)
+        sup = table[[f'sup_{col}' for col in audit_cols]].set_axis(audit_cols, axis=1)
+        return pd.concat({'match': match, 'ref': ref, 'sup': sup}, axis=1)
+
+    def save(self, path: str) -> Self:
+        """Writes the audit table to a compressed .npz file of one array per column, strings as category codes"""
+        assert str(path).endswith('.npz'), f'Merge audits are written as .npz files, not {path}'
+        arrays = {'__columns__': np.array(self.columns, dtype=str),
+                  '__ids__': np.array([self.ref_id, self.sup_id], dtype=str),
+                  '__order__': np.array(self.table.columns, dtype=str)}
+        for col in self.table.columns:
+            values = self.table[col]
+            if values.dtype.kind in 'biuf':
+                arrays[col] = values.to_numpy()
+            else:
+                codes, categories = pd.factorize(values.astype('string'))
+                arrays[f'{col}.codes'] = codes.astype(np.int32)
+                arrays[f'{col}.categories'] = np.array(categories, dtype=str)
+        np.savez_compressed(path, **arrays)
+        return self
+
+    @classmethod
+    def load(cls, path: str) -> Self:
+        """Audit saved by save"""
+        with np.load(path) as arrays:
+            table = pd.DataFrame({col: arrays[col] if col in arrays else
+                                  pd.Categorical.from_codes(arrays[f'{col}.codes'], arrays[f'{col}.categories'])
+                                  for col in arrays['__order__']})
+            ref_id, sup_id = arrays['__ids__'].tolist()
+            columns = arrays['__columns__'].tolist()
+        return cls(table, ref_id, sup_id, columns)
+
+
+def bitmask(cols: List[str], columns: List[str]) -> int:
+    """Bits of cols, numbered by position in columns"""
+    return sum(1 << columns.index(col) for col in set(cols))
+
+
+def joined_values(values: pd.DataFrame, id: str, col: str) -> pd.Series:
+    """Distinct values of col of each id, joined in one string"""
+    return values.assign(**{col: values[col].astype(str)}) \
+        .sort_values([id, col]) \
+        .groupby(id)[col].agg(', '.join)
+
+
+def shared_value_pairs(pairs: pd.DataFrame,
+                       ref_values: pd.DataFrame,
+                       sup_values: pd.DataFrame,
+                       ref_id: str,
+                       sup_id: str,
+                       col: str) -> np.ndarray:
+    """Index of the pairs with a value of col on the reference side that the supplemental side has too"""
+    pair_values = pairs[[ref_id, sup_id]].reset_index().merge(ref_values, on=ref_id)
+    try:
+        return pair_values.merge(sup_values, on=[sup_id, col])['index'].unique()
+    except ValueError:
+        # values of different types on each side, compare them as strings
+        return pair_values.astype({col: str}).merge(sup_values.astype({col: str}), on=[sup_id, col])['index'].unique()
@@ -0,0 +1,240 @@
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+import types
+import functools
+import logging
+import re
+from typing import Any, Callable, List, Optional, Set
+
+
+class UnstableFingerprint(Exception):
+    """A value has no fingerprint that is the same in every process, so what uses it can't be cached"""
+
+
+class MergeCache:
+    def __init__(self,
+                 directory: str = 'merge_cache',
+                 max_bytes: int = 500 * 2**20,
+                 log: logging.Logger = None) -> None:
+        """On disk cache of Merge results, keyed by the merge definition and the data it was applied to
+
+        A merge is looked up by a hash of its definition (see merge_fingerprint) and of the unmerged
+        reference and supplemental data, so when a merge script is rerun after changing only a late merge,
+        every merge before it is read back instead of recomputed. Any change to a merge changes the unmerged
+        data of every merge after it, so those are recomputed.
+
+        Parameters
+        ----------
+        directory : str, optional
+            directory the cached merges are stored in, by default 'merge_cache'
+        max_bytes : int, optional
+            total size of cached files, least recently used files are removed above this, by default 500MB
+        log : logging.Logger, optional
+            logging object, by default None
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.log = log or logging.getLogger(__name__)
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, merge: Any, ref_unmerged: pd.DataFrame, sup_unmerged: pd.DataFrame) -> Optional[str]:
+        """Cache key of merge applied to ref_unmerged and sup_unmerged
+
+        None if the merge refers to a value that can't be fingerprinted the same way in every process
+        (see value_fingerprint), it would never be read back, so it isn't cached
+        """
+        try:
+            fingerprint = merge_fingerprint(merge)
+        except UnstableFingerprint as error:
+            self.log.warning('Merge %s is not cached, %s', merge.name, error)
+            return None
+        digest = hashlib.sha256(fingerprint.encode())
+        digest.update(frame_fingerprint(ref_unmerged).encode())
+        digest.update(frame_fingerprint(sup_unmerged).encode())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.pkl')
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Cached merged_df for key, None if not cached"""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+
+        # mark as recently used for eviction
+        os.utime(path)
+        return pd.read_pickle(path)
+
+    def put(self, key: str, merged_df: pd.DataFrame) -> None:
+        merged_df.to_pickle(self.path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used files until the cache fits in max_bytes"""
+        paths = [os.path.join(self.directory, file) for file in os.listdir(self.directory) if file.endswith('.pkl')]
+        paths.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in paths)
+
+        # keep the newest file even if it is above max_bytes on its own
+        while total > self.max_bytes and len(paths) > 1:
+            path = paths.pop(0)
+            total -= os.path.getsize(path)
+            os.remove(path)
+            self.log.info('Evicted %s from merge cache', path)
+
+
+class PreparedCache(MergeCache):
+    def __init__(self,
+                 directory: str = 'prepared_cache',
+                 max_bytes: int = 2 * 2**30,
+                 log: logging.Logger = None) -> None:
+        """On disk cache of prepared FoiaData frames, keyed by the input data and how it is prepared
+
+        Preparing the officer reference (reshaping star and cr_id columns, adding columns, null flags)
+        costs the same at every merge step and every rerun of a step, so the prepared frame is stored
+        as a pickle and read back when the same input is prepared the same way again.
+        Any change to the code of the preparation steps changes the key.
+
+        Parameters
+        ----------
+        directory : str, optional
+            directory the prepared frames are stored in, by default 'prepared_cache'
+        max_bytes : int, optional
+            total size of cached files, least recently used files are removed above this, by default 2GB
+        log : logging.Logger, optional
+            logging object, by default None
+        """
+        super().__init__(directory, max_bytes, log)
+
+    def key(self, df: pd.DataFrame, params: List[Any], steps: List[Callable]) -> Optional[str]:
+        """Cache key of df prepared by the functions steps, given params (id, add_cols, ...), None if not cacheable"""
+        try:
+            fingerprints = [callable_fingerprint(step) for step in steps]
+        except UnstableFingerprint as error:
+            self.log.warning('Prepared data is not cached, %s', error)
+            return None
+        digest = hashlib.sha256(frame_fingerprint(df).encode())
+        digest.update(repr(params).encode())
+        digest.update(repr(fingerprints).encode())
+        return digest.hexdigest()
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    """Hash of the columns, dtypes, index and values of df"""
+    digest = hashlib.sha256(json.dumps([list(map(str, df.columns)), list(map(str, df.dtypes))]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def merge_fingerprint(merge: Any) -> str:
+    """Hash of everything that decides a Merge's results
+
+    Execution options that don't change results (engine, plan, workers) are left out.
+    Preprocess and postprocess functions are identified by their code,
+    including the code of functions they call and the values they close over.
+    """
+    spec = [merge.name, list(merge.merge_dict.items()), merge.custom_merges,
+            merge.filter_reference_merges_flag, merge.filter_supplemental_merges_flag, merge.check_duplicates,
+            merge.fuzzy_cols, merge.max_edits, merge.resolve,
+            callable_fingerprint(merge.reference_preprocess),
+            callable_fingerprint(merge.supplemental_preprocess),
+            callable_fingerprint(merge.post_process)]
+    return hashlib.sha256(repr(spec).encode()).hexdigest()
+
+
+def callable_fingerprint(func: Any, seen: Optional[Set[int]] = None) -> str:
+    seen = seen if seen is not None else set()
+    if id(func) in seen:
+        return 'recursive'
+    seen.add(id(func))
+
+    if isinstance(func, functools.partial):
+        return repr(['partial', callable_fingerprint(func.func, seen),
+                     [value_fingerprint(arg, seen) for arg in func.args],
+                     {key: value_fingerprint(value, seen) for key, value in func.keywords.items()}])
+
+    if not isinstance(func, types.FunctionType):
+        return value_fingerprint(func, seen)
+
+    code = func.__code__
+    # functions and values the code refers to by global name, also in its comprehensions, lambdas and inner functions
+    global_names = [(name, value_fingerprint(func.__globals__[name], seen))
+                    for name in code_names(code) if name in func.__globals__]
+    closure = [value_fingerprint(cell.cell_contents, seen) for cell in func.__closure__ or []]
+
+    return repr([func.__module__, func.__qualname__, code_fingerprint(code), value_fingerprint(func.__defaults__, seen),
+                 value_fingerprint(func.__kwdefaults__, seen), global_names, closure])
+
+
+def code_names(code: types.CodeType) -> List[str]:
+    """Names code and the code objects nested in it refer to, in order of first use"""
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.extend(code_names(const))
+    return list(dict.fromkeys(names))
+
+
+def code_fingerprint(code: types.CodeType) -> str:
+    consts = [code_fingerprint(const) if isinstance(const, types.CodeType) else repr(const)
+              for const in code.co_consts]
+    return hashlib.sha256(code.co_code + repr([consts, code.co_names]).encode()).hexdigest()
+
+
+def value_fingerprint(value: Any, seen: Set[int]) -> str:
+    """Fingerprint of a value a merge refers to, the same in every process
+
+    Objects are identified by their type and state (their __dict__), or by their repr if it is their own.
+
+    Raises
+    ------
+    UnstableFingerprint
+        if value has neither, e.g. its repr has the memory address of the object
+    """
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return repr(value)
+    if isinstance(value, (types.FunctionType, functools.partial)):
+        return callable_fingerprint(value, seen)
+    if isinstance(value, types.MethodType):
+        return repr(['method', callable_fingerprint(value.__func__, seen), value_fingerprint(value.__self__, seen)])
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return frame_fingerprint(value.to_frame() if isinstance(value, pd.Series) else value)
+    if isinstance(value, np.ndarray):
+        return hashlib.sha256(repr([value.dtype, value.shape]).encode() + value.tobytes()).hexdigest()
+    if isinstance(value, types.ModuleType):
+        return value.__name__
+    if isinstance(value, type):
+        return f'{value.__module__}.{value.__qualname__}'
+    if isinstance(value, logging.Logger):
+        # logging doesn't change results
+        return repr(['logger', value.name])
+    # builtin and numpy functions, by name
+    if isinstance(value, (types.BuiltinFunctionType, np.ufunc)):
+        owner = getattr(value, '__self__', None)
+        return repr([getattr(value, '__module__', None), getattr(value, '__qualname__', value.__name__),
+                     None if owner is None or isinstance(owner, types.ModuleType) else value_fingerprint(owner, seen)])
+    # lru_cache and other wrappers, whose repr changes between processes
+    if callable(value) and hasattr(value, '__wrapped__'):
+        return callable_fingerprint(value.__wrapped__, seen)
+
+    if id(value) in seen:
+        return 'recursive'
+    seen.add(id(value))
+    if isinstance(value, (list, tuple)):
+        return repr([type(value).__name__, [value_fingerprint(item, seen) for item in value]])
+    if isinstance(value, (set, frozenset)):
+        return repr([type(value).__name__, sorted(value_fingerprint(item, seen) for item in value)])
+    if isinstance(value, dict):
+        return repr([type(value).__name__, [(value_fingerprint(key, seen), value_fingerprint(item, seen))
+                                            for key, item in value.items()]])
+    if type(value).__repr__ is object.__repr__ and hasattr(value, '__dict__'):
+        return repr([value_fingerprint(type(value), seen), value_fingerprint(vars(value), seen)])
+
+    text = repr(value)
+    if re.search(r' at 0x[0-9a-fA-F]+', text):
+        raise UnstableFingerprint(f'{text} changes between processes')
+    return repr([value_fingerprint(type(value), seen), text])
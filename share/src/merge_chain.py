@@ -0,0 +1,147 @@
+import pandas as pd
+import os
+import sys
+import runpy
+import logging
+from typing import Dict, List, Optional
+
+REFERENCE_FILE = 'officer-reference.csv.gz'
+
+
+class ReferenceHandoff:
+    def __init__(self, checkpoints: List[str]) -> None:
+        """Passes the officer-reference of a merge step to the next one in memory, written to disk only at checkpoints
+
+        The next step gets the frame the previous step would have written, without writing and parsing it
+
+        Parameters
+        ----------
+        checkpoints : List[str]
+            paths of officer-reference outputs that are still written to disk
+        """
+        self.checkpoints = {os.path.realpath(path) for path in checkpoints}
+        self.references: Dict[str, pd.DataFrame] = {}
+
+    def write(self, path: str, df: pd.DataFrame) -> bool:
+        """Keeps df as the reference at path, True if it is a checkpoint and should still be written to disk"""
+        # only the latest reference is ever read again
+        self.references = {os.path.realpath(path): df}
+        return os.path.realpath(path) in self.checkpoints
+
+    def read(self, path: str) -> Optional[pd.DataFrame]:
+        # input references are links to the output of the step before
+        return self.references.get(os.path.realpath(path))
+
+
+# set by run_merge_chain while merge steps run
+handoff: Optional[ReferenceHandoff] = None
+
+
+def read_reference(input_path: str) -> pd.DataFrame:
+    """Reads the officer-reference a merge step starts from,
+    handed over in memory by the step before when steps are run by run_merge_chain"""
+    df = handoff.read(input_path) if handoff is not None else None
+    return pd.read_csv(input_path) if df is None else df
+
+
+def hand_off(output_path: str, reference) -> bool:
+    """Hands the officer-reference a merge step writes (a reference_store.ReferenceStore) to the next step
+
+    Returns True if it should still be written to output_path, always when steps are not run by run_merge_chain
+    """
+    if handoff is None:
+        return True
+    return handoff.write(output_path, reference.df)
+
+
+def get_merge_steps(merge_path: str, start: int = 1, end: Optional[int] = None) -> List[str]:
+    """Merge step folders (NN_foia-name) from start to end, in order"""
+    steps = sorted((int(folder.split('_')[0]), folder) for folder in os.listdir(merge_path) if folder[0].isdigit())
+    return [os.path.join(merge_path, folder) for number, folder in steps
+            if number >= start and (end is None or number <= end)]
+
+
+def run_merge_step(step_path: str) -> None:
+    """Runs src/merge.py of a merge step as if it was run by make, from the step folder
+
+    Modules shared between steps are imported fresh for every step, since merge scripts
+    change merges defined at module level (e.g. default_merges)
+    """
+    src_path = os.path.abspath(os.path.join(step_path, 'src'))
+    share_src = os.path.dirname(os.path.realpath(__file__))
+
+    def step_modules() -> Dict[str, object]:
+        modules = {}
+        for name, module in list(sys.modules.items()):
+            module_file = getattr(module, '__file__', None) or ''
+            module_dir = os.path.dirname(os.path.realpath(module_file))
+            if module_dir in (share_src, src_path) and name != __name__:
+                modules[name] = module
+        return modules
+
+    # modules the caller imported are put back after the step
+    imported = step_modules()
+    for name in imported:
+        del sys.modules[name]
+
+    cwd = os.getcwd()
+    os.chdir(step_path)
+    sys.path.insert(0, src_path)
+    try:
+        runpy.run_path('src/merge.py', run_name='__main__')
+    finally:
+        sys.path.remove(src_path)
+        os.chdir(cwd)
+        for name in step_modules():
+            del sys.modules[name]
+        sys.modules.update(imported)
+        # setup.get_basic_logger adds handlers to the same logger name in every step
+        logger = logging.getLogger('merge.py')
+        for handler in list(logger.handlers):
+            handler.close()
+            logger.removeHandler(handler)
+
+
+def run_merge_chain(merge_path: str,
+                    start: int = 1,
+                    end: Optional[int] = None,
+                    checkpoints: List[int] = None) -> List[str]:
+    """Runs merge steps start to end in one process, keeping officer-reference in memory between them
+
+    Each step still writes all its other outputs (remerged file, log, yaml) as when run by make,
+    and the officer-reference it reads is the frame the previous step wrote (see read_reference),
+    with the dtypes it had in that step rather than the ones read back from csv.
+
+    Parameters
+    ----------
+    merge_path : str
+        path of the merge folder
+    start : int, optional
+        number of the first step to run, by default 1
+        reads the officer-reference of the step before it from disk
+    end : int, optional
+        number of the last step to run, by default None, the last step
+    checkpoints : List[int], optional
+        steps whose officer-reference is written to disk, by default None
+        the officer-reference of the last step is always written
+
+    Returns
+    -------
+    List[str]
+        step folders that were run
+    """
+    steps = get_merge_steps(merge_path, start, end)
+    if not steps:
+        return steps
+
+    checkpoint_steps = [step for step in steps if int(os.path.basename(step).split('_')[0]) in (checkpoints or [])]
+    checkpoint_steps.append(steps[-1])
+    global handoff
+    handoff = ReferenceHandoff([os.path.join(step, 'output', REFERENCE_FILE) for step in checkpoint_steps])
+    try:
+        for step in steps:
+            run_merge_step(step)
+    finally:
+        handoff = None
+
+    return steps
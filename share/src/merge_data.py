@@ -1,13 +1,20 @@
 import pandas as pd
-from general_utils import reshape_data, list_diff, list_intersect, keep_duplicates
+from general_utils import reshape_data, list_diff, list_intersect, list_unique, keep_duplicates
 import logging
-from typing import List, Mapping, Any, Callable, Optional
+from typing import List, Mapping, Any, Callable, Optional, Tuple
 from typing_extensions import Self
 import re
 import numpy as np
 from fuzzywuzzy import fuzz
 from foia_data import FoiaData
+from merge_index import MergeIndex, ConsumedIds
+from merge_metrics import MergeMetrics, measure
+from merge_assignment import assign_pairs
+from merge_sqlite import SqliteMergeStore
+from concurrent.futures import ProcessPoolExecutor
 import itertools
+import copy
+import os
 
 # postprocess filter: takes in ref_unmerged, sup_unmerged, ref_id, sup_id, merged_df returns merged_df
 MergePostProcessor = Callable[
@@ -19,6 +26,9 @@ MergePostProcessor = Callable[
 
 DataFrameFilter = Callable[[pd.DataFrame], pd.DataFrame]
 
+# below this many rows (reference + supplemental) starting worker processes costs more than the joins
+PARALLEL_MIN_ROWS = 200000
+
 class Merge: 
     def __init__(self, 
                  name: str = "",
@@ -30,7 +40,14 @@ class Merge:
                  merge_postprocess: MergePostProcessor = None,
                  filter_reference_merges_flag: bool = True,
                  filter_supplemental_merges_flag: bool = True,
-                 check_duplicates: bool = True) -> None:
+                 check_duplicates: bool = True,
+                 engine: str = 'index',
+                 plan: bool = True,
+                 workers: Optional[int] = 1,
+                 fuzzy_cols: List[str] = None,
+                 max_edits: int = 1,
+                 resolve: str = 'greedy',
+                 shard_on: Optional[str] = None) -> None:
         """Encapsulates a valid merge criteria, including a list of columns to merge on, 
         pre-processing transformation, and any post-merge transformations
 
@@ -59,7 +76,43 @@ class Merge:
         filter_supplemental_merge_flag: bool, optional
             whether to filter out already merged rows from the supplemental unmerged data, by default True
             set to false usually when merge_postprocess looks for multiple types of merges and consolidates them
+        engine: str, optional
+            how each list of columns is merged, by default 'index'
+            'index' answers every on_list from integer codes built once per merge (see merge_index.py),
+            'pandas' runs a full pandas merge per on_list, useful for cross-checking
+            'sqlite' runs each on_list as an indexed join in a temporary sqlite database (see merge_sqlite.py),
+            for data whose pandas merges don't fit in memory, with the same results as 'pandas'
+        plan: bool, optional
+            whether to skip column lists that can't produce a new match, see plan_on_lists, by default True
+            the order of column lists, and so the merge results, are unchanged
+        workers: Optional[int], optional
+            number of processes to join column lists on when neither side is filtered between them, 
+            by default 1, which never starts processes, None uses every cpu for data with more than PARALLEL_MIN_ROWS rows
+        fuzzy_cols: List[str], optional
+            string columns matched approximately instead of exactly, by default None
+            column lists with one of these are joined by MergeIndex.fuzzy_join: exactly on their other columns,
+            and on candidate pairs of similar values for the fuzzy column, to be scored by merge_postprocess
+        max_edits: int, optional
+            edits between values of a fuzzy column that candidate pairs allow for, by default 1
+        resolve: str, optional
+            how ids matched by several column lists are resolved, by default 'greedy'
+            'greedy' merges column lists in order, the first to match an id claims it,
+            'assignment' joins every column list on all rows, and keeps an optimal one to one assignment
+            of the candidate pairs weighted by their best column list (see get_assignment_merges),
+            ids matching equally well to several ids are left unmerged instead of raising duplicate errors
+        shard_on: Optional[str], optional
+            column in every column list to split the data into shards by, by default None
+            rows are hash partitioned by its value (see MergeIndex.shard_rows), and each shard is merged greedily
+            in its own process (workers of them, see get_workers), with the same results as merging all rows at once
         """        
+        assert engine in ['index', 'pandas', 'sqlite'], f'Unknown merge engine {engine}'
+        assert resolve in ['greedy', 'assignment'], f'Unknown merge resolution {resolve}'
+        assert not shard_on or (engine == 'index' and resolve == 'greedy'), \
+            'Sharded merges need the index engine and greedy resolution'
+        # fuzzy matches can join rows with different values of shard_on, which can be in different shards
+        assert not (shard_on and shard_on in (fuzzy_cols or [])), 'Can not shard on a fuzzy column'
+        assert not (engine == 'sqlite' and fuzzy_cols), 'The sqlite engine only joins exactly'
+
         self.name = name
         self.merge_dict = merge_dict or {}
         self.custom_merges = custom_merges or [[]]
@@ -71,15 +124,36 @@ class Merge:
             self.reference_preprocess: DataFrameFilter = self.get_dataframe_filter(reference_preprocess) 
             self.supplemental_preprocess: DataFrameFilter = self.get_dataframe_filter(supplemental_preprocess)
 
+        # queries only drop rows, so the key codes cached by FoiaData stay valid
+        self.reference_keeps_values = not reference_preprocess or isinstance(reference_preprocess, str) or bool(query)
+        self.supplemental_keeps_values = not supplemental_preprocess or isinstance(supplemental_preprocess, str) or bool(query)
+
         self.post_process: MergePostProcessor = merge_postprocess or (lambda ref_unmerged, sup_unmerged, ref_id, sup_id, merged_df: merged_df)
         self.filter_reference_merges_flag = filter_reference_merges_flag
         self.filter_supplemental_merges_flag = filter_supplemental_merges_flag
         self.check_duplicates = check_duplicates
+        self.engine = engine
+        self.plan = plan
+        self.workers = workers
+        self.fuzzy_cols = fuzzy_cols or []
+        self.max_edits = max_edits
+        self.resolve = resolve
+        self.shard_on = shard_on
+        self.plan_report = ""
+        self.metrics: Optional[MergeMetrics] = None
+        self.candidate_rows = (0, 0)
+        self.estimates = pd.DataFrame()
+        self.estimate_report = ""
 
         self.merged_df = pd.DataFrame()
 
 
-    def apply_merge(self, reference: FoiaData, supplemental: FoiaData, common_columns: List[str] = None) -> Self:
+    def apply_merge(self, 
+                    reference: FoiaData, 
+                    supplemental: FoiaData, 
+                    common_columns: List[str] = None,
+                    metrics: Optional[MergeMetrics] = None,
+                    dry_run: bool = False) -> Self:
         """
         Applies a merge operation to the unmerged dataframes of the reference and supplemental FoiaData objects, using the merge rules and custom merges specified in the object's attributes. 
 
@@ -93,6 +167,11 @@ class Merge:
             A list of column names to be used as the join keys for the merge operation. 
             If not given will calculate the intersection of the columns in the reference and supplemental dataframes, 
             excluding the unique identifier columns.
+        metrics: MergeMetrics, optional
+            recorder of the timings, candidate rows, matches and memory of each join, by default None
+        dry_run: bool, optional
+            whether to only estimate the size of each join instead of merging, by default False
+            see estimate_merges, the estimates are returned (and kept as estimates) instead of merged_df
 
         Returns
         -------
@@ -105,17 +184,26 @@ class Merge:
         AssertionError:
             If the merged dataframe contains duplicate unique identifier values after the merge operation.
         """
+        self.metrics = metrics
         ref_unmerged = self.reference_preprocess(reference.unmerged)
         sup_unmerged = self.supplemental_preprocess(supplemental.unmerged)
 
         if not common_columns:
-            common_columns = list_diff(list_intersect(reference.df.columns, supplemental.df.columns), 
+            common_columns = list_diff(list_intersect(reference.columns, supplemental.columns), 
                                        [reference.id, supplemental.id])
 
         cols_list = self.generate_on_lists(self.merge_dict, common_columns, self.custom_merges)
         self.cols_list = cols_list
 
-        all_merges = self.get_all_merges(ref_unmerged, sup_unmerged, reference.id, supplemental.id, cols_list)
+        index = self.build_index(reference, supplemental, ref_unmerged, sup_unmerged, cols_list)
+        if dry_run:
+            self.estimates = self.estimate_merges(index, self.plan_on_lists(index, cols_list) if self.plan else cols_list)
+            reference.log.info('\n'.join(report for report in [self.plan_report, self.estimate_report] if report))
+            return self.estimates
+
+        all_merges = self.get_all_merges(ref_unmerged, sup_unmerged, reference.id, supplemental.id, cols_list, index)
+        if self.plan_report:
+            reference.log.info(self.plan_report)
 
         self.merged_df =  self.post_process(ref_unmerged, sup_unmerged, reference.id, supplemental.id, pd.concat(all_merges))
         self.merged_df['merge_name'] = self.name
@@ -131,7 +219,8 @@ class Merge:
                        sup_unmerged: pd.DataFrame, 
                        ref_id: str,
                        sup_id: str,
-                       cols_list: List[List[str]]) -> pd.DataFrame:
+                       cols_list: List[List[str]],
+                       index: Optional[MergeIndex] = None) -> pd.DataFrame:
         """Returns a list of dataframes resulting from merging the reference and supplemental unmerged dataframes on all possible combinations of columns specified in the cols_list parameter.
 
         Parameters
@@ -146,25 +235,396 @@ class Merge:
             The name of the unique identifier column in the supplemental dataframe.
         cols_list: List[List[str]]
             A list of lists of column names to be used as the join keys for the merge operation. Each inner list represents a set of columns that can be used to merge the dataframes.
+        index: Optional[MergeIndex], optional
+            index over ref_unmerged and sup_unmerged, by default None, which builds one without any pre-encoded keys
 
         Returns
         -------
         all_merges: List[pd.DataFrame]
             A list of dataframes resulting from merging the reference and supplemental unmerged dataframes on all possible combinations of columns specified in the cols_list parameter.
         """
-        all_merges = []
+        index = index or MergeIndex(ref_unmerged, sup_unmerged, ref_id, sup_id)
+        if self.plan:
+            cols_list = self.plan_on_lists(index, cols_list)
+
+        if self.resolve == 'assignment':
+            return [self.get_assignment_merges(index, cols_list)]
+
+        if self.engine == 'index' and self.shard_on and self.get_shards(index) > 1:
+            all_merges = self.get_sharded_merges(index, cols_list)
+        elif self.engine == 'index':
+            all_merges = self.get_all_index_merges(index, cols_list)
+        elif self.engine == 'sqlite':
+            all_merges = self.get_all_sqlite_merges(ref_unmerged, sup_unmerged, ref_id, sup_id, cols_list)
+        else:
+            all_merges = []
+            for on_cols in cols_list:
+                if self.exhausted(ref_unmerged.empty, sup_unmerged.empty):
+                    break
+
+                with self.measure(on_cols) as record:
+                    merged_df = self.merge_on_cols(ref_unmerged, sup_unmerged, ref_id, sup_id, on_cols)
+                    record.update(ref_rows=self.candidate_rows[0], sup_rows=self.candidate_rows[1],
+                                  matches=len(merged_df))
+                all_merges.append(merged_df)
+
+                if self.filter_supplemental_merges_flag:
+                    sup_unmerged = self.filter_merges(merged_df, sup_unmerged, sup_id)
+                if self.filter_reference_merges_flag:
+                    ref_unmerged = self.filter_merges(merged_df, ref_unmerged, ref_id)
+
+        if not all_merges:
+            # every on_list was pruned, keep the merge columns for concatenation downstream
+            all_merges.append(self.format_merges(index.merge_on_cols([], np.zeros(index.ref_size, dtype=bool)), sup_id, []))
+
+        return all_merges
+
+    def build_index(self,
+                    reference: FoiaData,
+                    supplemental: FoiaData,
+                    ref_unmerged: pd.DataFrame,
+                    sup_unmerged: pd.DataFrame,
+                    cols_list: List[List[str]]) -> MergeIndex:
+        """MergeIndex over the unmerged data, using the key codes of reference and supplemental
+
+        Key columns are coded from the dictionary shared by both FoiaData, so no column is factorized again here.
+        Falls back to factorizing in the index if reference and supplemental use different dictionaries.
+        """
+        index = MergeIndex(ref_unmerged, sup_unmerged, reference.id, supplemental.id)
+        key_dictionary = reference.key_dictionary
+        if key_dictionary is not supplemental.key_dictionary:
+            return index
+
+        key_cols = list_unique([col for on_cols in cols_list for col in on_cols])
+        ref_codes = reference.encode_keys(ref_unmerged, key_cols, self.reference_keeps_values)
+        sup_codes = supplemental.encode_keys(sup_unmerged, key_cols, self.supplemental_keeps_values)
+        for col in list_intersect(ref_codes, sup_codes):
+            index.add_codes(col, ref_codes[col], sup_codes[col], key_dictionary.size(col))
+
+        return index
+
+    def get_all_index_merges(self, index: MergeIndex, cols_list: List[List[str]]) -> List[pd.DataFrame]:
+        """Same as get_all_merges, but every on_list is answered from a MergeIndex built once
+
+        Merged ids are tracked in bitsets and skipped when building each join's candidates,
+        instead of re-slicing the unmerged dataframes
+        """
+        workers = self.get_workers(index, cols_list)
+        if workers > 1:
+            # on_lists don't depend on each other, join them all at once, timed together
+            with self.measure([f'{len(cols_list)} column lists in {workers} processes']) as record:
+                all_merges = [self.format_merges(index.id_pairs(ref_rows, sup_rows), index.sup_id, on_cols)
+                              for on_cols, (ref_rows, sup_rows) in zip(cols_list, index.parallel_join(cols_list, workers))]
+                record.update(ref_rows=index.ref_size, sup_rows=index.sup_size,
+                              matches=sum(len(merged_df) for merged_df in all_merges))
+            return all_merges
+
+        return [self.format_merges(index.id_pairs(ref_rows, sup_rows), index.sup_id, on_cols)
+                for on_cols, (ref_rows, sup_rows) in zip(cols_list, self.greedy_joins(index, cols_list))]
+
+    def greedy_joins(self, index: MergeIndex, cols_list: List[List[str]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Rows joined by each on_list in order, skipping ids merged by earlier on_lists (see the filter flags)
+
+        Stops once a filtered side has no ids left, so it can return fewer joins than there are on_lists
+        """
+        ref_consumed = index.consumed_ref()
+        sup_consumed = index.consumed_sup()
+        # distinct rows of every merge column once, each on_list's are narrowed from them
+        index.distinct_rows(list_unique([col for on_cols in cols_list for col in on_cols]))
+
+        joins = []
         for on_cols in cols_list:
-            merged_df = self.merge_on_cols(ref_unmerged, sup_unmerged, ref_id, sup_id, on_cols)
-            all_merges.append(merged_df)
+            if self.exhausted(ref_consumed.exhausted(), sup_consumed.exhausted()):
+                break
+
+            with self.measure(on_cols) as record:
+                ref_rows, sup_rows = self.join(index, on_cols, ref_consumed, sup_consumed)
+                record.update(ref_rows=index.candidate_rows[0], sup_rows=index.candidate_rows[1],
+                              matches=index.pair_count(ref_rows, sup_rows))
+            joins.append((ref_rows, sup_rows))
 
             if self.filter_supplemental_merges_flag:
-                sup_unmerged = self.filter_merges(merged_df, sup_unmerged, sup_id)
+                sup_consumed.add(sup_rows)
             if self.filter_reference_merges_flag:
-                ref_unmerged = self.filter_merges(merged_df, ref_unmerged, ref_id)
+                ref_consumed.add(ref_rows)
+
+        return joins
+
+    def get_all_sqlite_merges(self,
+                              ref_unmerged: pd.DataFrame,
+                              sup_unmerged: pd.DataFrame,
+                              ref_id: str,
+                              sup_id: str,
+                              cols_list: List[List[str]]) -> List[pd.DataFrame]:
+        """Same as the pandas engine of get_all_merges, but every on_list is an indexed join in sqlite
+
+        Key columns are loaded once into a SqliteMergeStore, merged ids are tracked in its consumed tables
+        instead of re-slicing the unmerged dataframes
+        """
+        store = SqliteMergeStore(ref_unmerged, sup_unmerged, ref_id, sup_id,
+                                 list_unique([col for on_cols in cols_list for col in on_cols]))
+        try:
+            all_merges = []
+            for on_cols in cols_list:
+                if self.exhausted(store.exhausted('ref'), store.exhausted('sup')):
+                    break
+
+                with self.measure(on_cols) as record:
+                    ref_rows, sup_rows = store.join(on_cols)
+                    all_merges.append(self.format_merges(store.id_pairs(ref_rows, sup_rows), sup_id, on_cols))
+                    record.update(ref_rows=store.candidate_rows[0], sup_rows=store.candidate_rows[1],
+                                  matches=len(all_merges[-1]))
+
+                if self.filter_supplemental_merges_flag:
+                    store.consume('sup', sup_rows)
+                if self.filter_reference_merges_flag:
+                    store.consume('ref', ref_rows)
+        finally:
+            store.close()
 
         return all_merges
 
-        
+    def get_sharded_merges(self, index: MergeIndex, cols_list: List[List[str]]) -> List[pd.DataFrame]:
+        """Same as get_all_index_merges, but rows are split into shards by shard_on, each merged in a worker process
+
+        Every on_list has shard_on, so rows only join rows of their own shard, and ids stay in one shard,
+        so merging each shard greedily finds the same pairs as merging all rows. Joined rows of every shard
+        are put back in the order a join of all rows returns them, duplicates are checked on all of them by apply_merge.
+        """
+        missing = [on_cols for on_cols in cols_list if self.shard_on not in on_cols]
+        assert not missing, f'Can not shard on {self.shard_on}, not in column lists {missing}'
+
+        shards = self.get_shards(index)
+        ref_shards, sup_shards = index.shard_rows(self.shard_on, shards)
+        subsets = [(np.flatnonzero(ref_shards == shard), np.flatnonzero(sup_shards == shard)) for shard in range(shards)]
+        subsets = [(ref_rows, sup_rows) for ref_rows, sup_rows in subsets if len(ref_rows) and len(sup_rows)]
+
+        with self.measure([f'{len(cols_list)} column lists in {len(subsets)} shards on {self.shard_on}']) as record:
+            key_cols = list_unique([col for on_cols in cols_list for col in on_cols])
+            indexes = [index.subset(ref_rows, sup_rows, key_cols, self.fuzzy_cols) for ref_rows, sup_rows in subsets]
+            worker = self.shard_worker()
+            if min(shards, len(subsets)) > 1:
+                with ProcessPoolExecutor(max_workers=min(shards, len(subsets))) as executor:
+                    results = list(executor.map(_merge_shard, [worker] * len(indexes), indexes,
+                                                [cols_list] * len(indexes)))
+            else:
+                results = [_merge_shard(worker, shard_index, cols_list) for shard_index in indexes]
+
+            def rows_of(position, side, item):
+                # shard row positions back to rows of index
+                return np.concatenate([subset[side][result[position][item]] for subset, result in zip(subsets, results)]
+                                      + [np.zeros(0, dtype=np.int64)])
+
+            all_merges = []
+            for position, on_cols in enumerate(cols_list):
+                ref_rows, sup_rows, first_rows = rows_of(position, 0, 0), rows_of(position, 1, 1), rows_of(position, 0, 2)
+                # in the order of a join of every row
+                order = np.lexsort((sup_rows, ref_rows, first_rows))
+                all_merges.append(self.format_merges(index.id_pairs(ref_rows[order], sup_rows[order]),
+                                                     index.sup_id, on_cols))
+            record.update(ref_rows=index.ref_size, sup_rows=index.sup_size,
+                          matches=sum(len(merged_df) for merged_df in all_merges))
+
+        return all_merges
+
+    def shard_worker(self) -> Self:
+        """Copy of this merge to join shards with in worker processes, without the callables that can't be pickled"""
+        worker = copy.copy(self)
+        worker.reference_preprocess = worker.supplemental_preprocess = worker.post_process = None
+        worker.metrics = None
+        worker.merged_df = pd.DataFrame()
+        return worker
+
+    def first_rows(self, index: MergeIndex, on_cols: List[str], ref_rows: np.ndarray) -> np.ndarray:
+        """First reference row of the key of each joined row, joins are ordered by it, then by row (see MergeIndex.join)"""
+        if list_intersect(self.fuzzy_cols, on_cols):
+            # fuzzy joins are ordered by row
+            return ref_rows
+        ref_key, _ = index.composite_codes(on_cols)
+        return pd.Series(ref_rows).groupby(ref_key[ref_rows]).transform('min').to_numpy(dtype=np.int64)
+
+    def get_assignment_merges(self, index: MergeIndex, cols_list: List[List[str]]) -> pd.DataFrame:
+        """Matches ids by an optimal one to one assignment of the candidate pairs of every on_list
+
+        Every on_list is joined on all unmerged rows, each candidate pair keeps the first on_list it matches on,
+        weighted len(cols_list) for the first on_list down to 1 for the last.
+        Pairs are then assigned in each connected component of the candidate graph, see merge_assignment.assign_pairs
+
+        Returns
+        -------
+        pd.DataFrame
+            assigned id pairs, with the matched_on and matched_to columns of format_merges, in on_list order
+        """
+        ranks, ref_rows, sup_rows = [], [], []
+        for rank, on_cols in enumerate(cols_list):
+            with self.measure(on_cols) as record:
+                joined_ref, joined_sup = self.join(index, on_cols)
+                record.update(ref_rows=index.candidate_rows[0], sup_rows=index.candidate_rows[1],
+                              matches=len(joined_ref))
+            ranks.append(np.full(len(joined_ref), rank))
+            ref_rows.append(joined_ref)
+            sup_rows.append(joined_sup)
+
+        pairs = pd.DataFrame({'rank': np.concatenate(ranks or [np.zeros(0, dtype=int)]),
+                              'ref_row': np.concatenate(ref_rows or [np.zeros(0, dtype=int)]),
+                              'sup_row': np.concatenate(sup_rows or [np.zeros(0, dtype=int)])})
+        pairs['ref_code'] = index.ref_id_codes[pairs['ref_row']]
+        pairs['sup_code'] = index.sup_id_codes[pairs['sup_row']]
+        pairs = pairs.drop_duplicates(['ref_code', 'sup_code']).reset_index(drop=True)
+
+        assigned = pairs[assign_pairs(pairs['ref_code'], pairs['sup_code'], len(cols_list) - pairs['rank'])]
+        merged_df = pd.DataFrame({index.ref_id: index.ref_ids[assigned['ref_row']],
+                                  index.sup_id: index.sup_ids[assigned['sup_row']],
+                                  'matched_on': ['-'.join(cols_list[rank]) for rank in assigned['rank']],
+                                  'matched_to': index.sup_id})
+        print('%d Matches assigned from %d candidate pairs over %d column lists'
+              % (merged_df.shape[0], pairs.shape[0], len(cols_list)))
+        return merged_df
+
+    def estimate_merges(self, index: MergeIndex, cols_list: List[List[str]], hot_spots: int = 3) -> pd.DataFrame:
+        """Estimated size of the join of each on_list, counted from key codes without joining (see MergeIndex.join_counts)
+
+        Counts are over every unmerged row, as if no ids were merged by earlier on_lists, so they are upper bounds.
+        For on_lists with a fuzzy column, candidate pairs are every pair of rows matching on the other columns.
+        The cost of a join grows with its rows and candidate pairs, on_lists with the highest cost are reported
+        in estimate_report as hot spots, logged by apply_merge.
+
+        Parameters
+        ----------
+        index : MergeIndex
+            index over the unmerged reference and supplemental data
+        cols_list : List[List[str]]
+            on_lists to estimate
+        hot_spots : int, optional
+            number of the costliest on_lists to report, by default 3
+
+        Returns
+        -------
+        pd.DataFrame
+            one row per on_list: matched_on, non-null rows on each side, shared keys, candidate pairs,
+            expected matches (ids with a candidate on the smaller side), cost and pairs per row
+        """
+        estimates = []
+        for on_cols in cols_list:
+            counts = index.join_counts(list_diff(on_cols, self.fuzzy_cols) if len(on_cols) > 1 else on_cols)
+            estimates.append({'matched_on': '-'.join(on_cols), **counts,
+                              'expected_matches': min(counts['ref_ids'], counts['sup_ids'])})
+
+        estimates = pd.DataFrame(estimates, columns=['matched_on', 'ref_rows', 'sup_rows', 'shared_keys',
+                                                     'candidate_pairs', 'ref_ids', 'sup_ids', 'expected_matches'])
+        estimates['cost'] = estimates['ref_rows'] + estimates['sup_rows'] + estimates['candidate_pairs']
+        estimates['pairs_per_row'] = estimates['candidate_pairs'] / (estimates['ref_rows'] + estimates['sup_rows']).clip(lower=1)
+
+        hottest = estimates.nlargest(hot_spots, 'cost')
+        self.estimate_report = (f"Dry run of {self.name}: {len(cols_list)} column lists, "
+                                f"{estimates['candidate_pairs'].sum()} candidate pairs, "
+                                f"at most {estimates['expected_matches'].max()} matches in a column list. Hot spots: " +
+                                ('; '.join(f"{row.matched_on} ({row.candidate_pairs} pairs, {row.pairs_per_row:.1f} per row)"
+                                           for row in hottest.itertuples()) or 'none'))
+        return estimates
+
+    def join(self,
+             index: MergeIndex,
+             on_cols: List[str],
+             ref_consumed: Optional[ConsumedIds] = None,
+             sup_consumed: Optional[ConsumedIds] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Reference and supplemental rows matching on on_cols, approximately on a fuzzy column if it has one"""
+        fuzzy_cols = list_intersect(self.fuzzy_cols, on_cols)
+        assert len(fuzzy_cols) <= 1, f'Only one fuzzy column per column list, got {fuzzy_cols}'
+        if fuzzy_cols:
+            return index.fuzzy_join(on_cols, fuzzy_cols[0], self.max_edits,
+                                    ref_consumed=ref_consumed, sup_consumed=sup_consumed)
+        return index.join(on_cols, ref_consumed=ref_consumed, sup_consumed=sup_consumed, distinct=True)
+
+    def measure(self, on_cols: List[str]):
+        """Context recording metrics of a join on on_cols if this merge has a recorder, see MergeMetrics.measure"""
+        return measure(self.metrics, merge=self.name, matched_on='-'.join(on_cols), engine=self.engine)
+
+    def get_workers(self, index: MergeIndex, cols_list: List[List[str]]) -> int:
+        """Number of processes to join cols_list with, 1 unless merged ids are never filtered between on_lists"""
+        if self.filter_reference_merges_flag or self.filter_supplemental_merges_flag or len(cols_list) < 2 \
+                or self.fuzzy_cols:
+            return 1
+        if self.workers is None:
+            return (os.cpu_count() or 1) if index.ref_size + index.sup_size > PARALLEL_MIN_ROWS else 1
+        return self.workers
+
+    def get_shards(self, index: MergeIndex) -> int:
+        """Number of shards (and processes) to split a merge with shard_on into, see get_workers"""
+        if self.workers is None:
+            return (os.cpu_count() or 1) if index.ref_size + index.sup_size > PARALLEL_MIN_ROWS else 1
+        return self.workers
+
+    def exhausted(self, ref_exhausted: bool, sup_exhausted: bool) -> bool:
+        """True if a side that is filtered after every on_list has no ids left, so no later on_list can match"""
+        return (self.filter_supplemental_merges_flag and sup_exhausted) or \
+            (self.filter_reference_merges_flag and ref_exhausted)
+
+    def plan_on_lists(self, index: MergeIndex, cols_list: List[List[str]]) -> List[List[str]]:
+        """Drops on_lists that can't produce a new match, keeping the priority order of the rest
+
+        Uses column statistics from the index, an on_list is dropped if:
+        - one of its columns is entirely null on either side
+        - one of its columns has no value in common between the two sides (no values on a side for fuzzy_cols)
+        - an earlier on_list that is kept uses a subset of its columns, and merged ids are filtered
+          after every on_list: every pair matching this on_list already matched the earlier one
+
+        Sets plan_report, a summary of the plan, logged by apply_merge
+
+        Parameters
+        ----------
+        index : MergeIndex
+            index over the unmerged reference and supplemental data
+        cols_list : List[List[str]]
+            on_lists in priority order, from generate_on_lists
+
+        Returns
+        -------
+        List[List[str]]
+            on_lists to execute, in the same order
+        """
+        filtered = self.filter_reference_merges_flag or self.filter_supplemental_merges_flag
+        # columns of dtypes pandas can't merge are kept, so their joins raise like pandas (see MergeIndex.check_dtypes)
+        dead_columns = [col for col in list_unique([col for on_cols in cols_list for col in on_cols])
+                        if not self.can_match(index, col) and not index.dtype_check_cols([col])]
+
+        planned, dead, covered = [], 0, 0
+        for on_cols in cols_list:
+            if any(col in dead_columns for col in on_cols):
+                dead += 1
+            elif filtered and any(set(kept) <= set(on_cols) for kept in planned):
+                covered += 1
+            else:
+                planned.append(on_cols)
+
+        self.plan_report = (f"Merge plan for {self.name}: running {len(planned)} of {len(cols_list)} column lists. "
+                            f"Dropped {dead} with columns null or without shared values "
+                            f"({', '.join(dead_columns) or 'none'}), "
+                            f"{covered} covered by an earlier column list.")
+        return planned
+
+    def can_match(self, index: MergeIndex, col: str) -> bool:
+        """Whether col has a value in common on both sides, or values on both sides for fuzzy columns"""
+        stats = index.column_stats(col)
+        if col in self.fuzzy_cols:
+            return stats['ref_distinct'] > 0 and stats['sup_distinct'] > 0
+        return stats['shared_distinct'] > 0
+
+    def format_merges(self, merged_df: pd.DataFrame, sup_id: str, on_cols: List[str]) -> pd.DataFrame:
+        """Adds matched_on and matched_to columns to a single on_list merge, prints matches if any
+
+        Rows are numbered from 0, engines may join duplicate rows or not, but find the same id pairs in the same order
+        """
+        merged_df = merged_df.reset_index(drop=True)
+        merged_df['matched_on'] = "-".join(on_cols)
+        merged_df['matched_to'] = sup_id
+
+        if merged_df.shape[0] > 0:
+            print('%d Matches on \n %s columns'
+                    %(merged_df.shape[0], on_cols))
+
+        return merged_df
+
     def merge_on_cols(self, 
                       ref_unmerged: pd.DataFrame, 
                       sup_unmerged: pd.DataFrame, 
@@ -194,21 +654,21 @@ class Merge:
         """
         id_cols = [ref_id, sup_id]
 
+        if list_intersect(self.fuzzy_cols, on_cols):
+            index = MergeIndex(ref_unmerged, sup_unmerged, ref_id, sup_id)
+            merged_df = index.id_pairs(*self.join(index, on_cols))
+            self.candidate_rows = index.candidate_rows
+            return self.format_merges(merged_df, sup_id, on_cols)
+
         # drop nulls from each side for relevant columns
-        merged_df = ref_unmerged[[ref_id] + on_cols] \
-            .dropna(how='any') \
-            .merge(sup_unmerged[[sup_id] + on_cols].dropna(how='any'), 
-                    on=on_cols) \
+        ref_keys = ref_unmerged[[ref_id] + on_cols].dropna(how='any')
+        sup_keys = sup_unmerged[[sup_id] + on_cols].dropna(how='any')
+        self.candidate_rows = (len(ref_keys), len(sup_keys))
+        merged_df = ref_keys \
+            .merge(sup_keys, on=on_cols) \
             [id_cols].drop_duplicates()
         
-        merged_df['matched_on'] = "-".join(on_cols)
-        merged_df['matched_to'] = sup_id
-
-        if merged_df.shape[0] > 0:
-            print('%d Matches on \n %s columns'
-                    %(merged_df.shape[0], on_cols))
-
-        return merged_df
+        return self.format_merges(merged_df, sup_id, on_cols)
 
     def generate_on_lists(self, 
                           merge_dict: Mapping[str, Any], 
@@ -338,4 +798,19 @@ class Merge:
                 if '' in col_list]        
 
     def __repr__(self):
-        return f"Merge ({self.name})"
\ No newline at end of file
+        return f"Merge ({self.name})"
+
+
+def _merge_shard(merge: Merge, index: MergeIndex, cols_list: List[List[str]]) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Greedy joins of one shard in a worker process, see Merge.get_sharded_merges
+
+    Returns
+    -------
+    List[Tuple[np.ndarray, np.ndarray, np.ndarray]]
+        joined reference rows, supplemental rows and first reference rows of their keys, for every on_list
+    """
+    empty = np.zeros(0, dtype=np.int64)
+    joins = merge.greedy_joins(index, cols_list)
+    joins += [(empty, empty)] * (len(cols_list) - len(joins))
+    return [(ref_rows, sup_rows, merge.first_rows(index, on_cols, ref_rows))
+            for on_cols, (ref_rows, sup_rows) in zip(cols_list, joins)]
@@ -14,7 +14,13 @@ import numpy as np
 
 from general_utils import remove_duplicates, keep_duplicates, \
                           reshape_data, fill_data,\
-                          list_intersect, list_diff, list_union
+                          list_intersect, list_diff, list_union, map_unique,\
+                          list_unique, stream_link
+from merge_index import MergeIndex, KeyDictionary, KeyOwners, matches_cached
+from merge_metrics import MergeMetrics, measure
+from reference_store import ReferenceStore
+from reference_key_index import ReferenceKeyIndex
+from merge_audit import MergeAudit, AUDIT_COLUMNS
 
 np.seterr(divide='ignore')
 pd.options.display.max_rows = 99
@@ -50,6 +56,7 @@ class ReferenceData:
             Starting value for uids
         """
         self.log = log
+        self.uid = uid
 
         if uid not in data_df.columns:
             assert (data_id and data_id in data_df.columns), "Need data_id"
@@ -77,9 +84,137 @@ class ReferenceData:
 
 
 
-        self.uid = uid
         self.sup_id = data_id
         self.null_flag_cols = []
+        self.key_dictionary = KeyDictionary()
+        self.metrics = MergeMetrics.from_env()
+
+    @property
+    def ref_df(self):
+        """Reference data, built from reference_store partitions when read"""
+        return self.reference_store.df
+
+    @ref_df.setter
+    def ref_df(self, ref_df):
+        self.reference_store = ReferenceStore(ref_df, self.uid)
+
+    @classmethod
+    def link_slices(cls, slices, uid, log, custom_merges,
+                    add_cols=[], starting_uid=1):
+        """Links data split into slices (e.g. years) in a single pass
+
+        Gives the same reference data as creating it from the first slice,
+        then for each following slice calling
+        add_sup_data(slice, add_cols, base_OD=[]).loop_merge(custom_merges)
+        .append_to_reference(), but the keys of every slice are encoded and
+        indexed once, instead of re-preparing the growing reference for every slice.
+
+        For each on_list, the reference keys of a single uid are kept in a
+        KeyOwners index that each slice is added to after it is linked.
+
+        Parameters
+        ----------
+        slices : list (of tuples)
+            (intra-slice ID column, DataFrame) for each slice, in linking order
+        uid : str
+            Name of Unique ID column used to identify individuals
+        log : logging object
+        custom_merges : list (of lists or dicts)
+            on_lists tried in order, as in loop_merge()
+        add_cols : list
+            List of columns/codes to be added to every slice
+        starting_uid : int
+            Starting value for uids
+
+        Returns
+        ----------
+        ReferenceData
+        """
+        (first_id, first_df), slices = slices[0], slices[1:]
+        rd = cls(first_df, uid, log, data_id=first_id, starting_uid=starting_uid)
+
+        def queries(merge_cols):
+            """(ref, sup) queries of an on_list, same as loop_merge: split only if both are given"""
+            if not isinstance(merge_cols, dict):
+                return None, None
+            if ("sup_query" in merge_cols) and ("ref_query" in merge_cols):
+                return merge_cols['ref_query'], merge_cols['sup_query']
+            return merge_cols['query'], merge_cols['query']
+
+        on_lists = [(merge_cols['cols'] if isinstance(merge_cols, dict) else merge_cols, *queries(merge_cols))
+                    for merge_cols in custom_merges]
+        keys = KeyDictionary()
+        owners = [KeyOwners() for _ in on_lists]
+
+        def slice_keys(df, query_index):
+            """composite key codes of df for every on_list, -1 where a query excludes the row"""
+            slice_codes = []
+            for cols, *queries in on_lists:
+                codes = keys.encode_composite(df, cols)
+                if queries[query_index]:
+                    codes[~rd.query_mask(df, queries[query_index])] = -1
+                slice_codes.append(codes)
+            return slice_codes
+
+        ref_um = rd.prepare_data(rd.ref_df.copy(), uid, add_cols)
+        for on_owners, codes in zip(owners, slice_keys(ref_um, 0)):
+            on_owners.add(codes, ref_um[uid].to_numpy())
+
+        linked = [rd.ref_df]
+        max_uid = rd.ref_df[uid].max()
+        for sup_id, sup_df in slices:
+            log.info('Linking slice with intrafile ID: %s', sup_id)
+            sup_df = rd.prepare_data(sup_df, sup_id)
+            sup_um = rd.prepare_data(sup_df.copy(), sup_id, add_cols)
+            sup_ids = sup_um[sup_id].to_numpy()
+            sup_codes = slice_keys(sup_um, 1)
+
+            merged_sup = np.zeros(len(sup_um), dtype=bool)
+            merged_uids, merges = [], []
+            for (cols, *_), on_owners, codes in zip(on_lists, owners, sup_codes):
+                # keys of a single unmerged sup id, same as remove_duplicates(unique=True)
+                pairs = pd.DataFrame({'key': codes, sup_id: sup_ids})[(codes >= 0) & ~merged_sup]\
+                    .drop_duplicates()
+                pairs = pairs[~pairs['key'].duplicated(keep=False)]
+                pairs[uid] = on_owners.owner(pairs['key'].to_numpy(),
+                                             np.array(merged_uids, dtype=np.int64))
+                pairs = pairs[pairs[uid] != KeyOwners.NO_OWNER]
+                if pairs.empty:
+                    continue
+                pairs['matched_on'] = '-'.join(cols)
+                merges.append(pairs[[uid, sup_id, 'matched_on']])
+                merged_uids.extend(pairs[uid])
+                merged_sup |= np.isin(sup_ids, pairs[sup_id])
+
+            # unmerged sup ids get new uids, in order of appearance
+            new_ids = pd.unique(sup_ids[~merged_sup])
+            new_link = pd.DataFrame({uid: np.arange(len(new_ids)) + max_uid + 1, sup_id: new_ids,
+                                     'matched_on': np.nan})
+            max_uid += len(new_ids)
+            link_df = pd.concat(merges + [new_link], ignore_index=True)
+            assert not link_df[uid].duplicated().any(),\
+                'Same UID matched to multiple sup_ids'
+            log.info('%d ids merged, %d new ids', len(pd.unique(sup_ids[merged_sup])), len(new_ids))
+
+            sup_df = sup_df.merge(link_df[[uid, sup_id, 'matched_on']], on=sup_id, how='left')
+            linked.append(sup_df)
+
+            ref_slice = rd.prepare_data(sup_df.copy(), uid, add_cols) \
+                if 'current_age' in add_cols else sup_um.assign(**{uid: sup_df[uid].to_numpy()})
+            for on_owners, codes in zip(owners, slice_keys(ref_slice, 0)):
+                on_owners.add(codes, ref_slice[uid].to_numpy())
+
+            rd.sup_id = sup_id
+
+        rd.ref_df = pd.concat(linked, ignore_index=True)\
+            .dropna(subset=[uid], axis=0, how='any')\
+            .reset_index(drop=True)
+        id_cols = [uid] + [sup_id for sup_id, _ in slices]
+        rd.ref_df[id_cols] = rd.ref_df[id_cols].apply(pd.to_numeric)
+        assert max(rd.ref_df[uid]) - min(rd.ref_df[uid]) + 1 == \
+            rd.ref_df[uid].nunique(),\
+            'Missing some uids'
+        return rd
 
     def prepare_data(self, df, df_id,
                      add_cols=None, fill_cols=None, reshape_cols=[]):
@@ -174,7 +309,7 @@ class ReferenceData:
                                else 'last_name_NS'
                     start, end = (0, int(add_col[1])) if add_col[0] == 'F'\
                                  else (-int(add_col[1]), None)
-                    df[add_col] = df[use_col].map(lambda x: x[start:end])
+                    df[add_col] = map_unique(df[use_col], lambda x: x[start:end])
                 if add_col == 'current_age' and "current_age" in df.columns:
                     df['current_age_p1'] = df['current_age'] + (2017-from_year)
                     df['current_age_m1'] = df['current_age'] + (2016-from_year)
@@ -339,10 +474,103 @@ class ReferenceData:
                 and ('current_age' in
                      list_union(self.ref_df.columns, self.sup_df.columns))):
             add_cols.extend(["BY_to_CA", "current_age"])
-        self.ref_um = self.prepare_data(self.ref_df.copy(), self.uid, add_cols, fill_cols=fill_cols)
-        self.sup_um = self.prepare_data(self.sup_df.copy(), self.sup_id, add_cols)
+        # only the columns loop_merge can use are taken (and copied) from ref_df and sup_df
+        ref_cols = self.merge_columns(self.reference_store.columns, self.sup_df.columns,
+                                      self.uid, add_cols, fill_cols)
+        sup_cols = self.merge_columns(self.sup_df.columns, self.reference_store.columns,
+                                      self.sup_id, add_cols)
+        self.ref_um = self.prepare_data(self.reference_store.view(ref_cols), self.uid, add_cols, fill_cols=fill_cols)
+        self.sup_um = self.prepare_data(self.sup_df[sup_cols], self.sup_id, add_cols)
+
+        key_cols = [col for cols in self.base_OD.values() for col in cols if col]
+        # a new dictionary for each sup_df, so keys of earlier files aren't kept alive
+        self.key_dictionary = KeyDictionary()
+        self.ref_codes, self.ref_key_values = self.encode_keys(self.ref_um, key_cols)
+        self.sup_codes, self.sup_key_values = self.encode_keys(self.sup_um, key_cols)
         return self
 
+    def merge_columns(self, data_cols, other_cols, data_id, add_cols, fill_cols=None):
+        """Columns of data needed to prepare it for loop_merge with other data
+
+        Parameters
+        ----------
+        data_cols : list
+            Columns of the data to be prepared
+        other_cols : list
+            Columns of the data it will be merged with
+        data_id : str
+            Name of unique identifier in data
+        add_cols : list
+            List of columns/codes to be added in add_columns()
+        fill_cols : list
+            columns used for fill_data
+
+        Returns
+        ----------
+        merge_cols : list
+            data_id, shared columns, null flags, fill_cols and columns
+            read by prepare_data() and add_columns(), in the order of data_cols
+        """
+        prepare_cols = ['merge', 'current_star', 'first_name_NS', 'last_name_NS',
+                        'birth_year', 'current_age']
+        # columns named in executed add_cols
+        exec_cols = [col for add_col in add_cols if isinstance(add_col, Dict)
+                     for col in data_cols if col in add_col['exec']]
+        keep_cols = [data_id] + list_intersect(data_cols, other_cols) +\
+            self.null_flag_cols + (fill_cols or []) + prepare_cols + exec_cols
+        return [col for col in data_cols
+                if col in keep_cols or re.fullmatch(r'star\d+', col)]
+
+    def encode_keys(self, df, key_cols):
+        """Encodes merge key columns of df with the key dictionary of this sup_df
+
+        Parameters
+        ----------
+        df : pandas DataFrame
+            ref_um or sup_um
+        key_cols : list
+            Columns that can be merged on, columns not in df are skipped
+
+        Returns
+        ----------
+        codes : pandas DataFrame
+            int32 codes of each key column, same index as df
+        values : pandas DataFrame
+            copy of the key columns of df the codes were encoded from
+        """
+        key_cols = [col for col in key_cols if col in df.columns]
+        codes = pd.DataFrame({col: self.key_dictionary.encode(col, df[col])
+                              for col in key_cols},
+                             index=df.index)
+        return codes, df[key_cols].copy()
+
+    def sorted_key_codes(self, codes, values, df):
+        """Returns codes of the rows of df, ordered like the values they represent
+
+        Parameters
+        ----------
+        codes : pandas DataFrame
+            Output of encode_keys() for a frame df is a row subset of
+        values : pandas DataFrame
+            Values codes were encoded from, columns of df that were
+            changed since (e.g. sup_um assigned to) are left out
+        df : pandas DataFrame
+
+        Returns
+        ----------
+        sorted_codes : dict
+            Codes of each key column in df, empty if rows of df
+            can't be found by index label in codes
+        """
+        if not (df.index.is_unique and codes.index.is_unique):
+            return {}
+        rows = codes.index.get_indexer(df.index)
+        if (rows < 0).any():
+            return {}
+        return {col: self.key_dictionary.sorted_codes(col, codes[col].to_numpy()[rows])
+                for col in codes.columns
+                if col in df.columns and matches_cached(df[col].to_numpy(), values[col].to_numpy()[rows])}
+
     def loop_merge(
             self, custom_merges=[], verbose=True, one_to_one=True, multiple_merges=False,
             base_OD_edits=OrderedDict()):
@@ -383,55 +611,76 @@ class ReferenceData:
 
         ref_ids = self.ref_um[self.uid].nunique()
         sup_ids = self.sup_um[self.sup_id].nunique()
-        multi = self.sup_um[self.sup_id].size > sup_ids
 
         self.on_lists = self.generate_on_lists(intersect_cols, custom_merges,
                                                base_OD_edits)
         self.id_cols = [self.uid, self.sup_id]
         self.merged_df = pd.DataFrame(columns=self.id_cols + ['matched_on'])
         self.log.info('Beginning loop_merge.')
-        for merge_cols in self.on_lists:
+        # key columns are encoded once, merged ids are skipped rather than re-sliced
+        index = MergeIndex(self.ref_um, self.sup_um, self.uid, self.sup_id)
+        ref_codes = self.sorted_key_codes(self.ref_codes, self.ref_key_values, self.ref_um)
+        sup_codes = self.sorted_key_codes(self.sup_codes, self.sup_key_values, self.sup_um)
+        for col in list_intersect(ref_codes, sup_codes):
+            index.add_codes(col, ref_codes[col], sup_codes[col], self.key_dictionary.size(col))
+        ref_consumed = index.consumed_ref()
+        sup_consumed = index.consumed_sup()
+        # unique rows of every key column once, each on_list's unique rows are narrowed from them
+        index.distinct_rows(list_unique([col for merge_cols in self.on_lists for col in
+                                         (merge_cols['cols'] if isinstance(merge_cols, dict) else merge_cols)]))
+        merges = [self.merged_df]
+        skipped = 0
+        for i, merge_cols in enumerate(self.on_lists):
             assert len(merge_cols) > 0
-            reft = self.ref_um
-            supt = self.sup_um
+            if (one_to_one and ref_consumed.exhausted()) or \
+                    (not multiple_merges and sup_consumed.exhausted()):
+                self.log.info('No unmerged ids left, skipping last %d on_lists.',
+                              len(self.on_lists) - i)
+                break
+            cols = merge_cols['cols'] if isinstance(merge_cols, dict) else merge_cols
+            if any(index.column_stats(col)['shared_distinct'] == 0 for col in cols) and \
+                    not index.dtype_check_cols(cols):
+                # a column null or without shared values on either side can't match,
+                # columns of dtypes pandas can't merge are still joined, to raise like pandas
+                skipped += 1
+                continue
+            reft = supt = None
             if isinstance(merge_cols, dict):
                 # allow split to separate sup and merge query
                 if ("sup_query" in merge_cols) and ("ref_query" in merge_cols):
-                    reft = reft.query(merge_cols['ref_query'])
-                    supt = supt.query(merge_cols['sup_query'])
+                    reft = self.query_mask(self.ref_um, merge_cols['ref_query'])
+                    supt = self.query_mask(self.sup_um, merge_cols['sup_query'])
                 else:
-                    reft = reft.query(merge_cols['query'])
-                    supt = supt.query(merge_cols['query'])
+                    reft = self.query_mask(self.ref_um, merge_cols['query'])
+                    supt = self.query_mask(self.sup_um, merge_cols['query'])
                 merge_cols = merge_cols['cols']
-            reft = remove_duplicates(reft[[self.uid] +
-                                          merge_cols].dropna(how='any'),
-                                     merge_cols, True)
-            if one_to_one:
-                supt = remove_duplicates(supt[[self.sup_id] +
-                                              merge_cols].dropna(how='any'),
-                                         merge_cols, True)
-            else:
-                supt = supt[[self.sup_id] + merge_cols].dropna(how='any')
-            mergedt = reft.merge(supt,
-                                 on=merge_cols, how='inner')[self.id_cols]
-            if multi:
-                mergedt = mergedt.drop_duplicates()
+            with measure(self.metrics, merge='loop_merge', matched_on='-'.join(merge_cols),
+                         engine='index') as record:
+                ref_rows, sup_rows = index.join(merge_cols, reft, supt,
+                                                unique_ref=True,
+                                                unique_sup=one_to_one,
+                                                sort=True,
+                                                ref_consumed=ref_consumed,
+                                                sup_consumed=sup_consumed,
+                                                distinct=True)
+                mergedt = index.id_pairs(ref_rows, sup_rows)
+                record.update(ref_rows=index.candidate_rows[0], sup_rows=index.candidate_rows[1],
+                              matches=len(mergedt))
             if mergedt.shape[0] > 0:
                 if verbose:
                     print('%d Matches on \n %s columns'
                           %(mergedt.shape[0], merge_cols))
                 mergedt['matched_on'] = '-'.join(merge_cols)
-                self.merged_df = self.merged_df\
-                    .append(mergedt[self.id_cols + ['matched_on']])\
-                    .reset_index(drop=True)
+                merges.append(mergedt[self.id_cols + ['matched_on']])
                 if one_to_one:
-                    self.ref_um = self.ref_um.loc[
-                        ~self.ref_um[self.uid].isin(self.merged_df[self.uid])
-                        ]
+                    ref_consumed.add(ref_rows)
                 if not multiple_merges:
-                    self.sup_um = self.sup_um.loc[
-                        ~self.sup_um[self.sup_id].isin(self.merged_df[self.sup_id])
-                        ]
+                    sup_consumed.add(sup_rows)
+        if skipped:
+            self.log.info('Skipped %d on_lists with columns null or without shared values.', skipped)
+        self.merged_df = pd.concat(merges, ignore_index=True)
+        self.ref_um = self.ref_um.loc[ref_consumed.row_mask()]
+        self.sup_um = self.sup_um.loc[sup_consumed.row_mask()]
         self.merged_df.reset_index(drop=True, inplace=True)
         if verbose:
             self.log_merge_report(self.merged_df.shape[0], ref_ids, sup_ids)
@@ -462,6 +711,10 @@ class ReferenceData:
 
         return self
     
+    def query_mask(self, df, query):
+        """Boolean mask of rows in df satisfying query, same rows as df.query(query)"""
+        return np.asarray(df.eval(query), dtype=bool)
+
     def multirow_loop_merge(self, required_columns, sup_um=None):
         """Merges instances where required columns match to the same UID, but not all on the same row. 
         E.g., if first name and appointed date match one row, but appointed date match another for the same UID in ref
@@ -592,18 +845,18 @@ class ReferenceData:
 
         self.sup_df = self.sup_df.merge(
             link_df[self.id_cols + ['matched_on']], on=self.sup_id, how='left')
-        self.ref_df = self.ref_df\
-            .append(self.sup_df.drop(drop_cols, axis=1))\
-            .dropna(subset=[self.uid], axis=0, how='any')\
-            .reset_index(drop=True)
-        assert max(self.ref_df[self.uid]) - min(self.ref_df[self.uid]) + 1 == \
-            self.ref_df[self.uid].nunique(),\
+        # only sup_df is added, as a new partition of the reference
+        sup_ref = self.sup_df.drop(drop_cols, axis=1)\
+            .dropna(subset=[self.uid], axis=0, how='any')
+        sup_ref = sup_ref.assign(**{col: pd.to_numeric(sup_ref[col])
+                                    for col in self.id_cols})
+        self.reference_store.append(self.sup_id, sup_ref)
+        uids = self.reference_store.view([self.uid])[self.uid]
+        assert max(uids) - min(uids) + 1 == uids.nunique(),\
             'Missing some uids'
-        self.ref_df[self.id_cols] = self.ref_df[self.id_cols]\
-            .apply(pd.to_numeric)
         return self
 
-    def remerge_to_file(self, input_path, output_path, csv_opts):
+    def remerge_to_file(self, input_path, output_path, csv_opts, chunksize=None):
         """Merges sup_df (with uids) to input_path, writes data to output_path
 
         Parameters
@@ -614,14 +867,25 @@ class ReferenceData:
             Path of output file (csv)
         csv_opts : dict
             Dictionary of pandas .to_csv options
+        chunksize : int
+            If given, input_path is read, linked and written chunksize rows at a time
+            (see general_utils.stream_link), instead of merged in memory
 
         Returns
         ----------
         self
         """
+        if chunksize:
+            rows = stream_link(input_path, output_path,
+                               self.reference_store.view([self.uid, self.sup_id]),
+                               on=self.sup_id, link_col=self.uid,
+                               csv_opts=csv_opts, chunksize=chunksize)
+            self.log.info('Streamed %d rows to %s', rows, output_path)
+            return self
         full_df = pd.read_csv(input_path)
         rows = full_df.shape[0]
-        link_df = self.ref_df[[self.uid, self.sup_id]].drop_duplicates()
+        link_df = self.reference_store.view([self.uid, self.sup_id])\
+            .drop_duplicates()
         full_df = full_df.merge(
             link_df, on=self.sup_id, how='left')
         assert full_df.shape[0] == rows, 'Missing rows!'
@@ -642,35 +906,47 @@ class ReferenceData:
         ----------
         self
         """
-        self.ref_df.to_csv(output_path, **csv_opts)
+        self.reference_store.to_csv(output_path, **csv_opts)
         return self
 
-    def generate_merge_report(self, output_filename=None, ordered_cols = ["first_name_NS", "last_name_NS", "star", "cr_id", "log_no", "appointed_date", 
-                                                                        "birth_year", "gender", "race", "current_unit", "middle_initial", 
-                                                                        "middle_initial2", "suffix_name"]):
-        """Generates a report showing each row of the merge: what was used in match and what came from each side
-           Shows which columns were used in merged (concat and one hot) and respective columns from ref_df and sup_df with muliindex
-           Useful for manually inspecting merges, particularly with filtering
+    def write_key_index(self, output_path, key_cols):
+        """Writes an on disk index of key_cols of the reference (ref_df) to output_path
 
-           If given output_filename, will output to excel. If given ordered cols, will preserve that order. 
-        """
-        match_cols = [col for col in ordered_cols if (col in self.ref_df.columns) and (col in self.sup_df.columns)]
-        matches = self.merged_df.join(self.merged_df.matched_on.str.replace("-", "|").str.get_dummies()).set_index([self.uid, self.sup_id])
-        ref_df_matches = self.ref_df.groupby(self.uid)[match_cols].agg(lambda x: ", ".join(list(set(x.dropna().astype(str)))))
-        sup_df_matches = self.sup_df.groupby(self.sup_id)[match_cols].agg(lambda x: ", ".join(list(set(x.dropna().astype(str)))))
+        New files can then be matched against the reference with ReferenceKeyIndex,
+        without reading the reference file
 
-        def make_columns_multiindex(df, key):
-            df.columns = pd.MultiIndex.from_product([[key], df.columns])
-            return df
+        Parameters
+        ----------
+        output_path : str
+            Path of output index file (sqlite)
+        key_cols : list
+            Columns to index, usually the columns of base_OD
 
-        matches = make_columns_multiindex(matches, "match")
-        ref_df_matches = make_columns_multiindex(ref_df_matches, "ref")
-        sup_df_matches = make_columns_multiindex(sup_df_matches, "sup")
+        Returns
+        ----------
+        self
+        """
+        ReferenceKeyIndex.build(self.reference_store.df, self.uid, key_cols, output_path).close()
+        return self
 
-        self.merge_report = matches.join(ref_df_matches).join(sup_df_matches)
+    def generate_merge_report(self, output_filename=None, ordered_cols=AUDIT_COLUMNS, audit_filename=None):
+        """Generates a report showing each row of the merge: what was used in match and what came from each side
+           Shows which columns were used in merged (one hot) and respective values from ref_df and sup_df with multiindex
+           Useful for manually inspecting merges, particularly with filtering
+
+           The report is built from a merge audit (self.merge_audit, see merge_audit.MergeAudit),
+           which can be filtered by UID, merge or column disagreement with MergeAudit.select.
+           If given output_filename, will output the report to excel.
+           If given audit_filename, will write the audit to it (.npz, see MergeAudit.load).
+           If given ordered cols, will preserve that order.
+        """
+        self.merge_audit = MergeAudit.build(self.merged_df, self.ref_df, self.sup_df, self.uid, self.sup_id, ordered_cols)
+        self.merge_report = self.merge_audit.report()
 
         if output_filename:
             self.merge_report.to_excel(output_filename)
+        if audit_filename:
+            self.merge_audit.save(audit_filename)
 
         return self
 
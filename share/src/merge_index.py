@@ -0,0 +1,823 @@
+import pandas as pd
+import numpy as np
+import os
+import tempfile
+import json
+from concurrent.futures import ProcessPoolExecutor
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from pandas.api.types import (infer_dtype, is_bool_dtype, is_categorical_dtype, is_datetime64_any_dtype,
+                              is_dtype_equal, is_numeric_dtype, is_object_dtype, is_period_dtype,
+                              is_timedelta64_dtype)
+from typing import List, Dict, Optional, Tuple
+
+
+class KeyDictionary:
+    def __init__(self) -> None:
+        """Dictionary of the values of every merge key column, shared by all data merged together
+
+        Each column's values are coded once, in order of first appearance, into int32 codes
+        (nulls coded as -1). Codes never change as new values are added, so codes computed
+        for different data with the same dictionary can be joined directly.
+        """
+        self.values: Dict[str, pd.Index] = {}
+        self.ranks: Dict[str, np.ndarray] = {}
+
+    def size(self, col: str) -> int:
+        return len(self.values.get(col, []))
+
+    def encode(self, col: str, values: pd.Series) -> np.ndarray:
+        """Codes of values in the dictionary of col, adding any new values
+
+        Returns
+        -------
+        np.ndarray
+            int32 codes, -1 where null
+        """
+        null = values.isnull().to_numpy()
+        known = self.values.get(col)
+
+        if known is None:
+            codes, uniques = pd.factorize(values)
+            self.values[col] = pd.Index(uniques)
+        else:
+            codes = known.get_indexer(values)
+            new = (codes < 0) & ~null
+            if new.any():
+                new_codes, new_uniques = pd.factorize(values[new])
+                codes[new] = new_codes + len(known)
+                self.values[col] = known.append(pd.Index(new_uniques))
+                self.ranks.pop(col, None)
+
+        codes = np.asarray(codes, dtype=np.int32)
+        codes[null] = -1
+        return codes
+
+    def sorted_codes(self, col: str, codes: np.ndarray) -> np.ndarray:
+        """Recode codes of col so they order the same way as the values they represent"""
+        if col not in self.ranks:
+            try:
+                ranks, _ = pd.factorize(self.values[col], sort=True)
+            except TypeError:
+                # mixed types can't be sorted, same as MergeIndex.encode_column
+                ranks = np.arange(self.size(col))
+            self.ranks[col] = np.append(ranks, -1).astype(np.int32)
+
+        return self.ranks[col][codes]
+
+    def encode_composite(self, df: pd.DataFrame, cols: List[str]) -> np.ndarray:
+        """Stable codes of the combined values of cols, -1 where any is null
+
+        Built by folding one column at a time into the dictionary of the columns before it,
+        so codes of a combination never change as new combinations are added
+        """
+        key = self.encode(cols[0], df[cols[0]]).astype(np.int64)
+        for i in range(1, len(cols)):
+            codes = self.encode(cols[i], df[cols[i]])
+            valid = (key >= 0) & (codes >= 0)
+            packed = pd.Series((key[valid] << 32) | codes[valid].astype(np.int64))
+            key = np.full(len(df), -1, dtype=np.int64)
+            key[valid] = self.encode('-'.join(cols[:i + 1]), packed)
+
+        return key
+
+
+class KeyOwners:
+    def __init__(self) -> None:
+        """Which id owns each key, built up one slice of data at a time
+
+        Keys are stable integer codes (see KeyDictionary.encode_composite), so adding a slice
+        only touches that slice's keys. A key owned by one id maps to it directly, keys shared
+        by several ids keep their (key, id) pairs, so they can still be resolved when all but one
+        of those ids are excluded (see owner).
+        """
+        # id owning each key code, NO_OWNER if none, SHARED if several
+        self.owners = np.full(0, self.NO_OWNER, dtype=np.int64)
+        self.shared = pd.DataFrame({'key': np.array([], dtype=np.int64), 'id': np.array([], dtype=np.int64)})
+
+    NO_OWNER = -1
+    SHARED = -2
+
+    def add(self, keys: np.ndarray, ids: np.ndarray) -> None:
+        """Add keys owned by ids, keys less than 0 (nulls) are skipped"""
+        pairs = pd.DataFrame({'key': keys, 'id': ids})
+        pairs = pairs[pairs['key'] >= 0].drop_duplicates()
+        if pairs.empty:
+            return
+
+        size = pairs['key'].max() + 1
+        if size > len(self.owners):
+            self.owners = np.append(self.owners, np.full(size - len(self.owners), self.NO_OWNER))
+
+        touched = pairs['key'].unique()
+        current = self.owners[touched]
+        pairs = pd.concat([pd.DataFrame({'key': touched[current >= 0], 'id': current[current >= 0]}),
+                           self.shared[self.shared['key'].isin(touched[current == self.SHARED])],
+                           pairs]).drop_duplicates()
+
+        counts = pairs.groupby('key')['id'].transform('size').to_numpy()
+        single = pairs[counts == 1]
+        self.owners[single['key'].to_numpy()] = single['id'].to_numpy()
+
+        shared = pairs[counts > 1]
+        self.owners[shared['key'].to_numpy()] = self.SHARED
+        self.shared = pd.concat([self.shared[~self.shared['key'].isin(shared['key'])], shared], ignore_index=True)
+
+    def owner(self, keys: np.ndarray, excluded: Optional[np.ndarray] = None) -> np.ndarray:
+        """Id owning each key, ignoring excluded ids, NO_OWNER where there is no single owner
+
+        Same as keeping keys of a single id in the added data, after dropping rows of excluded ids
+        """
+        owners = np.full(len(keys), self.NO_OWNER, dtype=np.int64)
+        known = (keys >= 0) & (keys < len(self.owners))
+        owners[known] = self.owners[keys[known]]
+
+        if excluded is not None and len(excluded):
+            owners[np.isin(owners, excluded)] = self.NO_OWNER
+
+            shared_rows = np.flatnonzero(owners == self.SHARED)
+            if len(shared_rows):
+                candidates = self.shared[self.shared['key'].isin(keys[shared_rows]) & ~self.shared['id'].isin(excluded)]
+                candidates = candidates[~candidates['key'].duplicated(keep=False)]
+                resolved = pd.Series(candidates['id'].to_numpy(), index=candidates['key'].to_numpy())
+                owners[shared_rows] = resolved.reindex(keys[shared_rows]).fillna(self.NO_OWNER).to_numpy()
+
+        owners[owners == self.SHARED] = self.NO_OWNER
+        return owners
+
+
+# default dictionary of FoiaData made on their own, so their codes match
+# ReferenceData runs use a new dictionary for each supplemental, so keys of earlier steps aren't kept
+KEY_DICTIONARY = KeyDictionary()
+
+
+def check_key_dtypes(ref_values: pd.Series, sup_values: pd.Series) -> None:
+    """Raises the ValueError pd.merge raises for key columns of incompatible dtypes, same checks as pandas
+
+    Codes can join any two columns, so joins pandas refuses (e.g. strings against floats)
+    fail the same way instead of matching on codes. Values are the rows pandas would merge,
+    types are inferred from them and nothing is checked if only one side has rows.
+    """
+    ref_dtype, sup_dtype = ref_values.dtype, sup_values.dtype
+    if bool(len(ref_values)) != bool(len(sup_values)):
+        return
+    if is_dtype_equal(ref_dtype, sup_dtype) or is_categorical_dtype(ref_dtype) or is_categorical_dtype(sup_dtype):
+        return
+
+    msg = f"You are trying to merge on {ref_dtype} and {sup_dtype} columns. If you wish to proceed you should use pd.concat"
+    ref_object, sup_object = is_object_dtype(ref_dtype), is_object_dtype(sup_dtype)
+    if is_numeric_dtype(ref_dtype) and is_numeric_dtype(sup_dtype):
+        return
+    if (ref_object and is_bool_dtype(sup_dtype)) or (is_bool_dtype(ref_dtype) and sup_object):
+        return
+    if (ref_object and is_numeric_dtype(sup_dtype)) or (is_numeric_dtype(ref_dtype) and sup_object):
+        ref_inferred, sup_inferred = infer_dtype(ref_values, skipna=False), infer_dtype(sup_values, skipna=False)
+        bool_types = ["integer", "mixed-integer", "boolean", "empty"]
+        string_types = ["string", "unicode", "mixed", "bytes", "empty"]
+        if ref_inferred in bool_types and sup_inferred in bool_types:
+            return
+        if (ref_inferred in string_types) != (sup_inferred in string_types):
+            raise ValueError(msg)
+        return
+    if is_datetime_like(ref_dtype) != is_datetime_like(sup_dtype) or \
+            isinstance(ref_dtype, pd.DatetimeTZDtype) != isinstance(sup_dtype, pd.DatetimeTZDtype):
+        raise ValueError(msg)
+
+
+def is_datetime_like(dtype) -> bool:
+    return is_datetime64_any_dtype(dtype) or is_timedelta64_dtype(dtype) or is_period_dtype(dtype)
+
+
+def matches_cached(values: np.ndarray, cached: np.ndarray) -> bool:
+    """True if values are the same as cached (nulls match nulls), so codes encoded from cached are still current"""
+    null = pd.isnull(values)
+    if values.shape != cached.shape or not np.array_equal(null, pd.isnull(cached)):
+        return False
+    return bool(np.all(values[~null] == cached[~null]))
+
+
+class ConsumedIds:
+    def __init__(self, id_codes: np.ndarray, id_count: int) -> None:
+        """Bitset of ids already merged, indexed by factorized id
+
+        Tracks which ids are used up during a merge loop, so rows of merged ids can be
+        skipped when building each join's candidates instead of re-slicing the data.
+
+        Parameters
+        ----------
+        id_codes : np.ndarray
+            factorized id of each row, -1 for null ids
+        id_count : int
+            number of distinct ids
+        """
+        self.id_codes = id_codes
+        # extra last flag for null ids (code -1), never set
+        self.flags = np.zeros(id_count + 1, dtype=bool)
+
+    def add(self, rows: np.ndarray) -> None:
+        """Mark the ids of rows as merged"""
+        self.add_codes(self.id_codes[rows])
+
+    def add_codes(self, codes: np.ndarray) -> None:
+        """Mark ids as merged by their codes, ignoring -1 (null or unknown ids)"""
+        self.flags[codes[codes >= 0]] = True
+
+    def filter(self, rows: np.ndarray) -> np.ndarray:
+        """Rows whose ids are not merged yet"""
+        return rows[~self.flags[self.id_codes[rows]]]
+
+    def row_mask(self) -> np.ndarray:
+        """Boolean mask of all rows whose ids are not merged yet"""
+        return ~self.flags[self.id_codes]
+
+    def exhausted(self) -> bool:
+        return bool(self.flags[:-1].all())
+
+    def remaining(self) -> int:
+        """Number of ids not merged yet"""
+        return int((~self.flags[:-1]).sum())
+
+
+class MergeIndex:
+    def __init__(self,
+                 ref_df: pd.DataFrame,
+                 sup_df: pd.DataFrame,
+                 ref_id: str,
+                 sup_id: str) -> None:
+        """Index over the key columns of a reference and supplemental dataframe pair
+
+        Every key column is factorized once into integer codes shared by both sides
+        (nulls coded as -1), so each list of merge columns can be answered by combining
+        codes and joining integer arrays instead of running a full pandas merge.
+
+        Rows are addressed by position in the frames the index was built on, so
+        callers track which rows are still unmerged with boolean masks rather than
+        re-slicing the frames after every join.
+
+        Parameters
+        ----------
+        ref_df : pd.DataFrame
+            unmerged reference dataframe
+        sup_df : pd.DataFrame
+            unmerged supplemental dataframe
+        ref_id : str
+            id column of the reference dataframe
+        sup_id : str
+            id column of the supplemental dataframe
+        """
+        self.ref_df = ref_df
+        self.sup_df = sup_df
+        self.ref_id = ref_id
+        self.sup_id = sup_id
+
+        self.ref_ids = ref_df[ref_id].to_numpy()
+        self.sup_ids = sup_df[sup_id].to_numpy()
+        self.ref_valid = ref_df[ref_id].notnull().to_numpy()
+        self.sup_valid = sup_df[sup_id].notnull().to_numpy()
+        self.ref_id_codes, ref_id_uniques = pd.factorize(self.ref_ids)
+        self.sup_id_codes, sup_id_uniques = pd.factorize(self.sup_ids)
+        self.ref_id_count, self.sup_id_count = len(ref_id_uniques), len(sup_id_uniques)
+
+        self.ref_codes: Dict[str, np.ndarray] = {}
+        self.sup_codes: Dict[str, np.ndarray] = {}
+        self.cardinality: Dict[str, int] = {}
+        self.stats: Dict[str, Dict[str, float]] = {}
+        # first rows of each distinct id and key values on each side, by set of key columns, see distinct_rows
+        self.projections: Dict[frozenset, Tuple[np.ndarray, np.ndarray]] = {}
+        # rows of each side considered by the last join, after dropping nulls and merged ids
+        self.candidate_rows: Tuple[int, int] = (0, 0)
+
+    @property
+    def ref_size(self) -> int:
+        return len(self.ref_valid)
+
+    @property
+    def sup_size(self) -> int:
+        return len(self.sup_valid)
+
+    def save_keys(self, directory: str, on_cols: List[str]) -> None:
+        """Write the codes of on_cols (and row validity) to .npy files, to be memory mapped by load_keys"""
+        for col in on_cols:
+            self.encode_column(col)
+
+        arrays = {'ref_valid': self.ref_valid, 'sup_valid': self.sup_valid}
+        for i, col in enumerate(on_cols):
+            arrays[f'ref_{i}'] = self.ref_codes[col]
+            arrays[f'sup_{i}'] = self.sup_codes[col]
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f'{name}.npy'), array)
+
+        with open(os.path.join(directory, 'columns.json'), 'w') as f:
+            json.dump({'columns': on_cols, 'cardinality': [self.cardinality[col] for col in on_cols]}, f)
+
+    @classmethod
+    def load_keys(cls, directory: str) -> 'MergeIndex':
+        """Index over memory mapped codes written by save_keys, without the frames
+
+        Can join on the saved columns, but not map rows back to ids (see id_pairs)
+        """
+        with open(os.path.join(directory, 'columns.json')) as f:
+            spec = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+        index = cls.__new__(cls)
+        index.ref_df = index.sup_df = None
+        index.ref_valid, index.sup_valid = load('ref_valid'), load('sup_valid')
+        index.ref_ids = index.sup_ids = None
+        index.ref_codes = {col: load(f'ref_{i}') for i, col in enumerate(spec['columns'])}
+        index.sup_codes = {col: load(f'sup_{i}') for i, col in enumerate(spec['columns'])}
+        index.cardinality = dict(zip(spec['columns'], spec['cardinality']))
+        index.stats = {}
+        return index
+
+    def parallel_join(self, cols_list: List[List[str]], workers: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Joins every on_list in cols_list independently, over a pool of worker processes
+
+        Only for merges where no ids are removed between on_lists, each join sees all rows.
+        Key codes are written once to memory mapped files, so workers read them
+        instead of each task pickling the frames.
+
+        Returns
+        -------
+        List[Tuple[np.ndarray, np.ndarray]]
+            reference and supplemental row positions of each join, in the order of cols_list
+        """
+        on_cols = list(dict.fromkeys(col for cols in cols_list for col in cols))
+        # workers join codes only, dtypes are checked here on the non null rows of each join
+        for cols in cols_list:
+            if self.dtype_check_cols(cols):
+                ref_key, sup_key = self.composite_codes(cols)
+                self.check_dtypes(cols, np.flatnonzero(ref_key >= 0), np.flatnonzero(sup_key >= 0))
+        with tempfile.TemporaryDirectory(prefix='merge_index_') as directory:
+            self.save_keys(directory, on_cols)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(_join_saved_keys, [directory] * len(cols_list), cols_list))
+
+    def shard_rows(self, col: str, shards: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Hash partition of the rows of both sides into shards by the values of col
+
+        Rows only join rows with the same value of col if col is in every on_list, but merged ids are
+        removed from all their rows, so values shared by an id (on either side) are kept in the same shard:
+        values are grouped into connected components of the graph linking each value to the ids of its rows,
+        and each component goes to the shard of its label modulo shards.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            shard of each reference and supplemental row, -1 for rows that can't join (null col or id)
+        """
+        self.encode_column(col)
+        ref_rows = np.flatnonzero(self.ref_valid & (self.ref_codes[col] >= 0))
+        sup_rows = np.flatnonzero(self.sup_valid & (self.sup_codes[col] >= 0))
+
+        # nodes are values of col, then reference ids, then supplemental ids
+        values = self.cardinality[col]
+        nodes = values + self.ref_id_count + self.sup_id_count
+        graph = coo_matrix((np.ones(len(ref_rows) + len(sup_rows), dtype=np.int8),
+                            (np.concatenate([self.ref_codes[col][ref_rows], self.sup_codes[col][sup_rows]]),
+                             np.concatenate([values + self.ref_id_codes[ref_rows],
+                                             values + self.ref_id_count + self.sup_id_codes[sup_rows]]))),
+                           shape=(nodes, nodes))
+        _, labels = connected_components(graph, directed=False)
+
+        ref_shards = np.full(self.ref_size, -1, dtype=np.int64)
+        sup_shards = np.full(self.sup_size, -1, dtype=np.int64)
+        ref_shards[ref_rows] = labels[self.ref_codes[col][ref_rows]] % shards
+        sup_shards[sup_rows] = labels[self.sup_codes[col][sup_rows]] % shards
+        return ref_shards, sup_shards
+
+    def subset(self,
+               ref_rows: np.ndarray,
+               sup_rows: np.ndarray,
+               on_cols: List[str],
+               value_cols: Optional[List[str]] = None) -> 'MergeIndex':
+        """Index over some rows of each side, with the codes of on_cols already encoded
+
+        Frames only keep the id columns and value_cols, columns read as values rather than codes (see fuzzy_join),
+        so the subset is small to send to a worker process. Row positions are into the subset, in the order of the rows.
+        """
+        for col in on_cols:
+            self.encode_column(col)
+
+        ref_cols = list(dict.fromkeys([self.ref_id] + (value_cols or [])))
+        sup_cols = list(dict.fromkeys([self.sup_id] + (value_cols or [])))
+        index = MergeIndex(self.ref_df[ref_cols].iloc[ref_rows], self.sup_df[sup_cols].iloc[sup_rows],
+                           self.ref_id, self.sup_id)
+        for col in on_cols:
+            index.add_codes(col, self.ref_codes[col][ref_rows], self.sup_codes[col][sup_rows], self.cardinality[col])
+        return index
+
+    def consumed_ref(self) -> ConsumedIds:
+        """Empty bitset of merged reference ids, see join"""
+        return ConsumedIds(self.ref_id_codes, self.ref_id_count)
+
+    def consumed_sup(self) -> ConsumedIds:
+        """Empty bitset of merged supplemental ids, see join"""
+        return ConsumedIds(self.sup_id_codes, self.sup_id_count)
+
+    def encode_column(self, col: str) -> None:
+        """Factorize a column of both frames into shared integer codes, once per column
+
+        Codes are sorted by value where the values are sortable, so composite codes
+        order the same way as the values they represent.
+        """
+        if col in self.cardinality:
+            return
+
+        values = pd.concat([self.ref_df[col], self.sup_df[col]], ignore_index=True)
+        try:
+            codes, uniques = pd.factorize(values, sort=True)
+        except TypeError:
+            # mixed types can't be sorted, order doesn't matter for matching
+            codes, uniques = pd.factorize(values)
+
+        codes = codes.astype(np.int64)
+        self.ref_codes[col] = codes[:self.ref_size]
+        self.sup_codes[col] = codes[self.ref_size:]
+        self.cardinality[col] = len(uniques)
+
+    def add_codes(self, col: str, ref_codes: np.ndarray, sup_codes: np.ndarray, cardinality: int) -> None:
+        """Use codes encoded ahead of time (see KeyDictionary) for col instead of factorizing it"""
+        assert len(ref_codes) == self.ref_size and len(sup_codes) == self.sup_size
+        self.ref_codes[col] = ref_codes
+        self.sup_codes[col] = sup_codes
+        self.cardinality[col] = cardinality
+
+    def column_stats(self, col: str) -> Dict[str, float]:
+        """Cheap statistics of a key column on each side, computed once from its codes
+
+        Returns
+        -------
+        Dict[str, float]
+            null fractions and distinct value counts on each side,
+            and the number of distinct values found on both sides
+        """
+        if col not in self.stats:
+            self.encode_column(col)
+            ref_values = np.unique(self.ref_codes[col][self.ref_valid])
+            sup_values = np.unique(self.sup_codes[col][self.sup_valid])
+            ref_values, sup_values = ref_values[ref_values >= 0], sup_values[sup_values >= 0]
+
+            self.stats[col] = {
+                'ref_null_fraction': float(np.mean(self.ref_codes[col] < 0)) if self.ref_size else 1.0,
+                'sup_null_fraction': float(np.mean(self.sup_codes[col] < 0)) if self.sup_size else 1.0,
+                'ref_distinct': len(ref_values),
+                'sup_distinct': len(sup_values),
+                'shared_distinct': len(np.intersect1d(ref_values, sup_values, assume_unique=True))}
+
+        return self.stats[col]
+
+    def join_counts(self, on_cols: List[str]) -> Dict[str, int]:
+        """Size of the join on on_cols, counted from the key codes without joining
+
+        Returns
+        -------
+        Dict[str, int]
+            non-null rows on each side, keys found on both sides, joined row pairs,
+            and reference and supplemental ids with a row in the join
+        """
+        ref_key, sup_key = self.composite_codes(on_cols)
+        ref_rows, sup_rows = np.flatnonzero(ref_key >= 0), np.flatnonzero(sup_key >= 0)
+        keys, ref_key_rows = np.unique(ref_key[ref_rows], return_inverse=True)
+
+        sup_key_rows = np.searchsorted(keys, sup_key[sup_rows])
+        shared = sup_key_rows < len(keys)
+        shared[shared] = keys[sup_key_rows[shared]] == sup_key[sup_rows][shared]
+        ref_counts = np.bincount(ref_key_rows, minlength=len(keys))
+        sup_counts = np.bincount(sup_key_rows[shared], minlength=len(keys))
+
+        return {'ref_rows': len(ref_rows),
+                'sup_rows': len(sup_rows),
+                'shared_keys': int((sup_counts > 0).sum()),
+                'candidate_pairs': int((ref_counts * sup_counts).sum()),
+                'ref_ids': len(np.unique(self.ref_id_codes[ref_rows[sup_counts[ref_key_rows] > 0]])),
+                'sup_ids': len(np.unique(self.sup_id_codes[sup_rows[shared]]))}
+
+    def distinct_rows(self, on_cols: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """First row of each distinct id and values of on_cols on each side, like drop_duplicates of [id] + on_cols
+
+        Projections are memoized by set of columns, and each is computed from the rows of the smallest memoized
+        superset instead of every row: a row repeating an earlier row's values of more columns repeats them on
+        on_cols too. Computing the projection of every column of a merge first shares that work with all of its on_lists.
+        Nulls count as a value, so projections with nulls can still be narrowed to columns without them.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            ascending reference and supplemental row positions
+        """
+        cols = frozenset(on_cols)
+        if cols not in self.projections:
+            supersets = [self.projections[key] for key in self.projections if cols <= key]
+            ref_rows, sup_rows = min(supersets, key=lambda rows: len(rows[0]) + len(rows[1]),
+                                     default=(np.arange(self.ref_size), np.arange(self.sup_size)))
+            for col in on_cols:
+                self.encode_column(col)
+
+            def first_rows(rows, id_codes, codes):
+                projected = pd.DataFrame({'id': id_codes[rows], **{col: codes[col][rows] for col in cols}})
+                return rows[~projected.duplicated().to_numpy()]
+
+            self.projections[cols] = (first_rows(ref_rows, self.ref_id_codes, self.ref_codes),
+                                      first_rows(sup_rows, self.sup_id_codes, self.sup_codes))
+        return self.projections[cols]
+
+    def composite_codes(self, on_cols: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Combine the codes of several columns into a single integer key per row
+
+        Uses mixed radix arithmetic while the key space fits in an int64,
+        re-densifying (order preserving) when it would overflow.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            reference and supplemental keys, -1 where any column is null
+        """
+        for col in on_cols:
+            self.encode_column(col)
+
+        ref_key = np.zeros(self.ref_size, dtype=np.int64)
+        sup_key = np.zeros(self.sup_size, dtype=np.int64)
+        ref_null = ~self.ref_valid
+        sup_null = ~self.sup_valid
+        key_space = 1
+
+        for col in on_cols:
+            ref_col, sup_col = self.ref_codes[col], self.sup_codes[col]
+            ref_null = ref_null | (ref_col < 0)
+            sup_null = sup_null | (sup_col < 0)
+
+            radix = max(self.cardinality[col], 1)
+            if key_space * radix >= np.iinfo(np.int64).max:
+                # re-densify the key so far, keeping its order
+                ref_key, sup_key, key_space = self._densify(ref_key, sup_key)
+
+            ref_key = ref_key * radix + ref_col
+            sup_key = sup_key * radix + sup_col
+            key_space *= radix
+
+        ref_key[ref_null] = -1
+        sup_key[sup_null] = -1
+        return ref_key, sup_key
+
+    def _densify(self, ref_key: np.ndarray, sup_key: np.ndarray) -> Tuple[np.ndarray, np.ndarray, int]:
+        codes, uniques = pd.factorize(np.concatenate([ref_key, sup_key]), sort=True)
+        codes = codes.astype(np.int64)
+        return codes[:self.ref_size], codes[self.ref_size:], max(len(uniques), 1)
+
+    def join(self,
+             on_cols: List[str],
+             ref_mask: Optional[np.ndarray] = None,
+             sup_mask: Optional[np.ndarray] = None,
+             unique_ref: bool = False,
+             unique_sup: bool = False,
+             sort: bool = False,
+             ref_consumed: Optional[ConsumedIds] = None,
+             sup_consumed: Optional[ConsumedIds] = None,
+             distinct: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Inner join of reference and supplemental rows on on_cols, from the index
+
+        Row order matches an inner pandas merge of the (masked, non-null) frames:
+        keys in order of first appearance on the reference side (or in sorted order if sort),
+        then reference rows, then supplemental rows in their original order.
+
+        Parameters
+        ----------
+        on_cols : List[str]
+            columns to join on
+        ref_mask : np.ndarray, optional
+            boolean mask of reference rows still eligible, by default all rows
+        sup_mask : np.ndarray, optional
+            boolean mask of supplemental rows still eligible, by default all rows
+        unique_ref : bool, optional
+            drop keys shared by more than one reference id, keeping one row per remaining key,
+            same as remove_duplicates(..., unique=True), by default False
+        unique_sup : bool, optional
+            same as unique_ref, for the supplemental side, by default False
+        sort : bool, optional
+            order output by key value instead of first appearance, by default False
+        ref_consumed : ConsumedIds, optional
+            reference ids already merged, their rows are skipped, by default None
+        sup_consumed : ConsumedIds, optional
+            supplemental ids already merged, their rows are skipped, by default None
+        distinct : bool, optional
+            only join the first row of each id and values of on_cols (see distinct_rows) on sides without a mask,
+            by default False. The id pairs of the join, and the order they first appear in, are the same,
+            but rows repeating an earlier row's id and key aren't joined again
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            matched reference row positions and supplemental row positions
+        """
+        ref_key, sup_key = self.composite_codes(on_cols)
+
+        ref_rows = np.flatnonzero((ref_key >= 0) if ref_mask is None else (ref_key >= 0) & ref_mask)
+        sup_rows = np.flatnonzero((sup_key >= 0) if sup_mask is None else (sup_key >= 0) & sup_mask)
+        if distinct:
+            # masks select rows by their other values, an earlier row with the same key may not be selected
+            ref_distinct, sup_distinct = self.distinct_rows(on_cols)
+            if ref_mask is None:
+                ref_rows = ref_rows[np.isin(ref_rows, ref_distinct, assume_unique=True)]
+            if sup_mask is None:
+                sup_rows = sup_rows[np.isin(sup_rows, sup_distinct, assume_unique=True)]
+        if ref_consumed is not None:
+            ref_rows = ref_consumed.filter(ref_rows)
+        if sup_consumed is not None:
+            sup_rows = sup_consumed.filter(sup_rows)
+
+        if unique_ref:
+            ref_rows = self._unique_key_rows(ref_rows, ref_key, self.ref_ids)
+        if unique_sup:
+            sup_rows = self._unique_key_rows(sup_rows, sup_key, self.sup_ids)
+        self.candidate_rows = (len(ref_rows), len(sup_rows))
+        self.check_dtypes(on_cols, ref_rows, sup_rows)
+
+        return self._join_rows(ref_rows, ref_key[ref_rows], sup_rows, sup_key[sup_rows], sort)
+
+    def check_dtypes(self, on_cols: List[str], ref_rows: np.ndarray, sup_rows: np.ndarray) -> None:
+        """Raises the ValueError pd.merge would raise joining these rows on on_cols, see check_key_dtypes
+
+        Only columns of different, not both numeric, dtypes are checked on their values.
+        Subsets without the key columns (see subset) aren't checked
+        """
+        for col in self.dtype_check_cols(on_cols):
+            check_key_dtypes(self.ref_df[col].iloc[ref_rows], self.sup_df[col].iloc[sup_rows])
+
+    def dtype_check_cols(self, on_cols: List[str]) -> List[str]:
+        """Columns of on_cols whose dtypes differ on each side (and aren't both numeric), see check_dtypes"""
+        if self.ref_df is None:
+            return []
+        cols = []
+        for col in on_cols:
+            if col not in self.ref_df.columns or col not in self.sup_df.columns:
+                continue
+            ref_dtype, sup_dtype = self.ref_df[col].dtype, self.sup_df[col].dtype
+            if not is_dtype_equal(ref_dtype, sup_dtype) and \
+                    not (is_numeric_dtype(ref_dtype) and is_numeric_dtype(sup_dtype)):
+                cols.append(col)
+        return cols
+
+    def merge_on_cols(self,
+                      on_cols: List[str],
+                      ref_mask: Optional[np.ndarray] = None,
+                      sup_mask: Optional[np.ndarray] = None,
+                      **join_kwargs) -> pd.DataFrame:
+        """Matched id pairs for on_cols, with the same rows as the pandas merge path
+
+        Returns
+        -------
+        pd.DataFrame
+            unique reference/supplemental id pairs
+        """
+        ref_rows, sup_rows = self.join(on_cols, ref_mask, sup_mask, **join_kwargs)
+        return self.id_pairs(ref_rows, sup_rows)
+
+    def fuzzy_join(self,
+                   on_cols: List[str],
+                   fuzzy_col: str,
+                   max_edits: int = 1,
+                   q: int = 2,
+                   ref_consumed: Optional[ConsumedIds] = None,
+                   sup_consumed: Optional[ConsumedIds] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Join of reference and supplemental rows on on_cols, where fuzzy_col only needs to be similar
+
+        The other columns of on_cols are joined exactly and form blocks. Within a block, values of fuzzy_col
+        are paired through an inverted index of their q-grams: two strings within max_edits edits share at least
+        max(length) + q - 1 - max_edits * q padded q-grams, so only pairs of values sharing that many q-grams
+        (and at least one) are candidates, instead of every pair of values in the block.
+        Candidates are a superset of the pairs within max_edits edits, and are meant to be scored by a postprocess.
+
+        Parameters
+        ----------
+        on_cols : List[str]
+            columns to join on, including fuzzy_col
+        fuzzy_col : str
+            string column matched approximately
+        max_edits : int, optional
+            edit distance the candidates must be able to be within, by default 1
+        q : int, optional
+            length of q-grams, by default 2
+        ref_consumed : ConsumedIds, optional
+            reference ids already merged, their rows are skipped, by default None
+        sup_consumed : ConsumedIds, optional
+            supplemental ids already merged, their rows are skipped, by default None
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            candidate reference row positions and supplemental row positions, ordered by reference row
+        """
+        ref_block, sup_block = self.composite_codes([col for col in on_cols if col != fuzzy_col])
+        ref_values, sup_values = self.ref_df[fuzzy_col].to_numpy(), self.sup_df[fuzzy_col].to_numpy()
+
+        ref_rows = np.flatnonzero((ref_block >= 0) & pd.notnull(ref_values))
+        sup_rows = np.flatnonzero((sup_block >= 0) & pd.notnull(sup_values))
+        if ref_consumed is not None:
+            ref_rows = ref_consumed.filter(ref_rows)
+        if sup_consumed is not None:
+            sup_rows = sup_consumed.filter(sup_rows)
+        self.candidate_rows = (len(ref_rows), len(sup_rows))
+
+        value_codes, values = pd.factorize(np.concatenate([ref_values[ref_rows], sup_values[sup_rows]]).astype(str))
+        ref_keys = pd.DataFrame({'block': ref_block[ref_rows], 'value': value_codes[:len(ref_rows)], 'ref_row': ref_rows})
+        sup_keys = pd.DataFrame({'block': sup_block[sup_rows], 'value': value_codes[len(ref_rows):], 'sup_row': sup_rows})
+
+        # shared q-grams of each pair of distinct values in the same block
+        grams = qgram_tokens(values, q)
+        ref_grams = ref_keys[['block', 'value']].drop_duplicates().merge(grams, on='value')
+        sup_grams = sup_keys[['block', 'value']].drop_duplicates().merge(grams, on='value')
+        shared = ref_grams.merge(sup_grams, on=['block', 'gram'], suffixes=('_ref', '_sup')) \
+            .groupby(['block', 'value_ref', 'value_sup']).size().rename('shared').reset_index()
+
+        lengths = np.char.str_len(np.asarray(values, dtype=str)) if len(values) else np.zeros(0, dtype=int)
+        ref_length, sup_length = lengths[shared['value_ref']], lengths[shared['value_sup']]
+        min_shared = np.maximum(np.maximum(ref_length, sup_length) + q - 1 - max_edits * q, 1)
+        candidates = shared[(shared['shared'] >= min_shared) & (np.abs(ref_length - sup_length) <= max_edits)]
+
+        pairs = ref_keys.rename(columns={'value': 'value_ref'}) \
+            .merge(candidates[['block', 'value_ref', 'value_sup']], on=['block', 'value_ref']) \
+            .merge(sup_keys.rename(columns={'value': 'value_sup'}), on=['block', 'value_sup']) \
+            .sort_values(['ref_row', 'sup_row'])
+        return pairs['ref_row'].to_numpy(dtype=np.int64), pairs['sup_row'].to_numpy(dtype=np.int64)
+
+    def id_pairs(self, ref_rows: np.ndarray, sup_rows: np.ndarray) -> pd.DataFrame:
+        """Unique reference/supplemental id pairs of joined rows"""
+        return pd.DataFrame({self.ref_id: self.ref_df[self.ref_id].iloc[ref_rows].to_numpy(),
+                             self.sup_id: self.sup_df[self.sup_id].iloc[sup_rows].to_numpy()}) \
+            .drop_duplicates()
+
+    def pair_count(self, ref_rows: np.ndarray, sup_rows: np.ndarray) -> int:
+        """Number of unique id pairs of joined rows, same as len(id_pairs) without building the frame"""
+        pairs = self.ref_id_codes[ref_rows].astype(np.int64) * (self.sup_id_count + 1) + self.sup_id_codes[sup_rows]
+        return len(np.unique(pairs))
+
+    def _unique_key_rows(self, rows: np.ndarray, key: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Keep one row for each key that belongs to a single id, drop keys shared by several ids"""
+        pairs = pd.DataFrame({'key': key[rows], 'id': ids[rows], 'row': rows}) \
+            .drop_duplicates(['key', 'id'])
+        single_id = ~pairs['key'].duplicated(keep=False)
+        return np.sort(pairs.loc[single_id, 'row'].to_numpy())
+
+    @staticmethod
+    def _join_rows(ref_rows: np.ndarray,
+                   ref_key: np.ndarray,
+                   sup_rows: np.ndarray,
+                   sup_key: np.ndarray,
+                   sort: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        if len(ref_rows) == 0 or len(sup_rows) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+        # dense group codes, ordered by first appearance on the reference side like pandas
+        ref_group, groups = pd.factorize(ref_key, sort=sort)
+        sup_group = pd.Index(groups).get_indexer(sup_key)
+
+        in_ref = sup_group >= 0
+        sup_rows, sup_group = sup_rows[in_ref], sup_group[in_ref]
+
+        n_groups = len(groups)
+        sup_order = np.argsort(sup_group, kind='stable')
+        sup_sorted = sup_rows[sup_order]
+        sup_counts = np.bincount(sup_group, minlength=n_groups)
+        sup_starts = np.concatenate([[0], np.cumsum(sup_counts)[:-1]])
+
+        ref_order = np.argsort(ref_group, kind='stable')
+        ref_sorted, ref_group_sorted = ref_rows[ref_order], ref_group[ref_order]
+
+        repeats = sup_counts[ref_group_sorted]
+        total = repeats.sum()
+        ref_out = np.repeat(ref_sorted, repeats)
+        offsets = np.arange(total) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        sup_out = sup_sorted[np.repeat(sup_starts[ref_group_sorted], repeats) + offsets]
+
+        return ref_out, sup_out
+
+
+def qgram_tokens(values: pd.Index, q: int = 2) -> pd.DataFrame:
+    """Padded q-grams of each value, numbered by occurrence so repeated q-grams are counted as a multiset
+
+    Returns
+    -------
+    pd.DataFrame
+        value (position in values) and gram (integer code of the q-gram and its occurrence) columns
+    """
+    pad_start, pad_end = '\x00' * (q - 1), '\x01' * (q - 1)
+    padded = [pad_start + value + pad_end for value in values]
+    grams = pd.DataFrame({'value': np.repeat(np.arange(len(padded)), [max(len(value) - q + 1, 0) for value in padded]),
+                          'gram': [value[i:i + q] for value in padded for i in range(len(value) - q + 1)]})
+    occurrence = grams.groupby(['value', 'gram']).cumcount()
+    grams['gram'] = pd.factorize(grams['gram'] + occurrence.astype(str))[0]
+    return grams
+
+
+# index loaded by each worker process of MergeIndex.parallel_join, reused across its tasks
+_worker_index: Dict[str, MergeIndex] = {}
+
+
+def _join_saved_keys(directory: str, on_cols: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    if directory not in _worker_index:
+        _worker_index.clear()
+        _worker_index[directory] = MergeIndex.load_keys(directory)
+    return _worker_index[directory].join(on_cols)
@@ -0,0 +1,124 @@
+import pandas as pd
+import __main__
+import contextlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+# set to record metrics of every merge step run, without changing merge scripts
+METRICS_ENV = 'MERGE_METRICS'
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes, None where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MergeMetrics:
+    # one recorder per output file in a process, so merges of a script append to the same file
+    _recorders: Dict[str, 'MergeMetrics'] = {}
+
+    def __init__(self, path: str, script: str = '') -> None:
+        """Records timings, candidate rows, matches and memory of every join of a merge, as JSON lines
+
+        Each record is written as soon as its join finishes, so a step that fails or is stopped
+        still leaves the records of the joins it ran.
+
+        Parameters
+        ----------
+        path : str
+            jsonl file to write, overwritten
+        script : str, optional
+            name of the merge script, by default ''
+        """
+        self.path = path
+        self.script = script
+        # merge steps are run from their folder (merge/NN_foia-name)
+        self.step = os.path.basename(os.getcwd())
+        self.records: List[Dict[str, Any]] = []
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        open(path, 'w').close()
+
+    @classmethod
+    def for_script(cls, script_path: str) -> 'MergeMetrics':
+        """Recorder writing to output/<script>.merge_metrics.jsonl, next to the script's log"""
+        script = os.path.basename(script_path)[:-3]
+        path = f'output/{script}.merge_metrics.jsonl'
+        if path not in cls._recorders:
+            cls._recorders[path] = cls(path, script)
+        return cls._recorders[path]
+
+    @classmethod
+    def from_env(cls) -> Optional['MergeMetrics']:
+        """Recorder for the running script if MERGE_METRICS is set, None otherwise"""
+        if not os.environ.get(METRICS_ENV) or not hasattr(__main__, '__file__'):
+            return None
+        return cls.for_script(__main__.__file__)
+
+    @contextlib.contextmanager
+    def measure(self, **fields: Any) -> Iterator[Dict[str, Any]]:
+        """Times the block and records fields, plus any the block adds to the yielded record
+
+        Joins add ref_rows, sup_rows (candidate rows on each side) and matches
+        """
+        record = dict(fields)
+        rss = current_rss()
+        start = time.perf_counter()
+        yield record
+        record['wall_time'] = time.perf_counter() - start
+        end_rss = current_rss()
+        record['rss_delta'] = end_rss - rss if rss is not None and end_rss is not None else None
+        self.write(record)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        record = {'script': self.script, 'step': self.step, **record}
+        self.records.append(record)
+        with open(self.path, 'a') as jsonl:
+            jsonl.write(json.dumps(record, default=str) + '\n')
+
+
+def measure(metrics: Optional[MergeMetrics], **fields: Any) -> contextlib.AbstractContextManager:
+    """metrics.measure(**fields), or a context that records nothing if metrics is None"""
+    return metrics.measure(**fields) if metrics is not None else contextlib.nullcontext({})
+
+
+def read_metrics(paths: List[str]) -> pd.DataFrame:
+    """Records of several merge_metrics.jsonl files in one dataframe"""
+    records = [json.loads(line) for path in paths for line in open(path) if line.strip()]
+    return pd.DataFrame(records, columns=['script', 'step', 'merge', 'matched_on', 'engine',
+                                          'ref_rows', 'sup_rows', 'matches', 'wall_time', 'rss_delta'])
+
+
+def summarize_metrics(paths: List[str], top: int = 20, sort_by: str = 'wall_time') -> pd.DataFrame:
+    """Hottest column lists across merge steps
+
+    Parameters
+    ----------
+    paths : List[str]
+        merge_metrics.jsonl files, usually every merge/NN step's
+    top : int, optional
+        number of column lists to return, by default 20
+    sort_by : str, optional
+        wall_time (total seconds), rss_delta (largest memory increase) or candidate_rows, by default 'wall_time'
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per step, merge and column list, sorted by sort_by descending
+    """
+    metrics = read_metrics(paths)
+    metrics['candidate_rows'] = metrics['ref_rows'].fillna(0) + metrics['sup_rows'].fillna(0)
+    summary = metrics.groupby(['step', 'merge', 'matched_on'], dropna=False) \
+        .agg(joins=('wall_time', 'size'),
+             wall_time=('wall_time', 'sum'),
+             rss_delta=('rss_delta', 'max'),
+             candidate_rows=('candidate_rows', 'max'),
+             matches=('matches', 'sum')) \
+        .reset_index()
+    return summary.sort_values(sort_by, ascending=False).head(top).reset_index(drop=True)
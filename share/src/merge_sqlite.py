@@ -0,0 +1,140 @@
+import pandas as pd
+import numpy as np
+import os
+import shutil
+import sqlite3
+import tempfile
+from typing import List, Optional, Tuple
+
+
+class SqliteMergeStore:
+    def __init__(self,
+                 ref_df: pd.DataFrame,
+                 sup_df: pd.DataFrame,
+                 ref_id: str,
+                 sup_id: str,
+                 key_cols: List[str],
+                 path: Optional[str] = None,
+                 chunksize: int = 100000) -> None:
+        """Key columns of a reference and supplemental dataframe pair in a sqlite database, joined with SQL
+
+        Each key column is factorized into integer codes shared by both sides (nulls coded as -1),
+        so values compare the same way they do in a pandas merge, and loaded chunksize rows at a time.
+        Each on_list is an indexed join in sqlite, and ids merged by earlier on_lists are kept in
+        consumed tables, so only the joined rows of one on_list are held in memory at a time.
+
+        Parameters
+        ----------
+        ref_df : pd.DataFrame
+            unmerged reference dataframe
+        sup_df : pd.DataFrame
+            unmerged supplemental dataframe
+        ref_id : str
+            id column of the reference dataframe
+        sup_id : str
+            id column of the supplemental dataframe
+        key_cols : List[str]
+            columns of every on_list that will be joined
+        path : Optional[str], optional
+            database file, by default None, a temporary file removed by close, ':memory:' keeps it in memory
+        chunksize : int, optional
+            rows inserted at a time, by default 100000
+        """
+        self.ref_df = ref_df
+        self.sup_df = sup_df
+        self.ref_id = ref_id
+        self.sup_id = sup_id
+        self.key_cols = key_cols
+        # rows of each side considered by the last join, after dropping nulls and merged ids
+        self.candidate_rows: Tuple[int, int] = (0, 0)
+
+        self.directory = tempfile.mkdtemp(prefix='merge_sqlite_') if path is None else None
+        self.connection = sqlite3.connect(path or os.path.join(self.directory, 'merge.db'))
+
+        ref_id_codes, ref_ids = pd.factorize(ref_df[ref_id])
+        sup_id_codes, sup_ids = pd.factorize(sup_df[sup_id])
+        self.ref_id_count, self.sup_id_count = len(ref_ids), len(sup_ids)
+
+        ref_codes, sup_codes = [], []
+        for col in key_cols:
+            codes, _ = pd.factorize(pd.concat([ref_df[col], sup_df[col]], ignore_index=True))
+            ref_codes.append(codes[:len(ref_df)])
+            sup_codes.append(codes[len(ref_df):])
+
+        self.load('ref', ref_id_codes, ref_codes, chunksize)
+        self.load('sup', sup_id_codes, sup_codes, chunksize)
+        self.connection.executescript('CREATE TABLE ref_consumed (id INTEGER PRIMARY KEY);'
+                                      'CREATE TABLE sup_consumed (id INTEGER PRIMARY KEY);')
+
+    def column(self, col: str) -> str:
+        """Name of col in the database tables, key columns are numbered since their names can be anything"""
+        return f'k{self.key_cols.index(col)}'
+
+    def load(self, table: str, id_codes: np.ndarray, codes: List[np.ndarray], chunksize: int) -> None:
+        columns = ['id'] + [self.column(col) for col in self.key_cols]
+        self.connection.execute(f'CREATE TABLE {table} (row INTEGER PRIMARY KEY, {", ".join(columns)})')
+        insert = f'INSERT INTO {table} VALUES ({", ".join(["?"] * (len(columns) + 1))})'
+        for start in range(0, len(id_codes), chunksize):
+            stop = start + chunksize
+            chunk = np.column_stack([np.arange(start, min(stop, len(id_codes))), id_codes[start:stop]] +
+                                    [col_codes[start:stop] for col_codes in codes])
+            self.connection.executemany(insert, chunk.tolist())
+        self.connection.commit()
+
+    def candidates(self, table: str, on_cols: List[str], alias: str) -> str:
+        """Conditions on rows of table (as alias) with on_cols and an id, whose id isn't consumed"""
+        return ' AND '.join([f'{alias}.{self.column(col)} >= 0' for col in on_cols] +
+                            [f'{alias}.id >= 0', f'{alias}.id NOT IN (SELECT id FROM {table}_consumed)'])
+
+    def join(self, on_cols: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Inner join of reference and supplemental rows on on_cols, skipping consumed ids
+
+        Row order matches an inner pandas merge of the non-null frames (see MergeIndex.join):
+        keys in order of their first reference row, then reference rows, then supplemental rows.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            joined reference and supplemental row positions
+        """
+        columns = [self.column(col) for col in on_cols]
+        name = '_'.join(columns)
+        for table in ['ref', 'sup']:
+            self.connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_{name} ON {table} ({", ".join(columns)})')
+
+        self.candidate_rows = tuple(
+            self.connection.execute(f'SELECT COUNT(*) FROM {table} AS t WHERE {self.candidates(table, on_cols, "t")}')
+            .fetchone()[0]
+            for table in ['ref', 'sup'])
+
+        query = (f'SELECT r.row, s.row, MIN(r.row) OVER (PARTITION BY {", ".join(f"r.{col}" for col in columns)}) AS first '
+                 f'FROM ref AS r JOIN sup AS s ON {" AND ".join(f"r.{col} = s.{col}" for col in columns)} '
+                 f'WHERE {self.candidates("ref", on_cols, "r")} AND {self.candidates("sup", on_cols, "s")} '
+                 f'ORDER BY first, r.row, s.row')
+        rows = np.array(self.connection.execute(query).fetchall(), dtype=np.int64).reshape(-1, 3)
+        return rows[:, 0], rows[:, 1]
+
+    def id_pairs(self, ref_rows: np.ndarray, sup_rows: np.ndarray) -> pd.DataFrame:
+        """Unique reference/supplemental id pairs of joined rows"""
+        return pd.DataFrame({self.ref_id: self.ref_df[self.ref_id].iloc[ref_rows].to_numpy(),
+                             self.sup_id: self.sup_df[self.sup_id].iloc[sup_rows].to_numpy()}) \
+            .drop_duplicates()
+
+    def consume(self, table: str, rows: np.ndarray) -> None:
+        """Marks the ids of rows of table as merged, their rows are skipped by later joins"""
+        self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS merged_rows (row INTEGER)')
+        self.connection.execute('DELETE FROM merged_rows')
+        self.connection.executemany('INSERT INTO merged_rows VALUES (?)', rows.reshape(-1, 1).tolist())
+        self.connection.execute(f'INSERT OR IGNORE INTO {table}_consumed '
+                                f'SELECT {table}.id FROM merged_rows JOIN {table} ON {table}.row = merged_rows.row')
+        self.connection.commit()
+
+    def exhausted(self, table: str) -> bool:
+        """True if every id of table is consumed"""
+        consumed = self.connection.execute(f'SELECT COUNT(*) FROM {table}_consumed').fetchone()[0]
+        return consumed == (self.ref_id_count if table == 'ref' else self.sup_id_count)
+
+    def close(self) -> None:
+        self.connection.close()
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,227 @@
+import pandas as pd
+import numpy as np
+from typing import Dict, List, Mapping, Optional, Tuple
+from merge_data import Merge
+from merge_index import MergeIndex
+from merge_assignment import assign_pairs
+
+# candidate pairs agree on every column of at least one block
+DEFAULT_BLOCKS = [['last_name_NS', 'F4FN'],
+                  ['first_name_NS', 'birth_year'],
+                  ['F4LN', 'star'],
+                  ['F4LN', 'appointed_date']]
+
+
+class ProbabilisticMerge(Merge):
+    def __init__(self,
+                 name: str = "",
+                 merge_dict: Mapping[str, List[str]] = None,
+                 blocks: Optional[List[List[str]]] = None,
+                 threshold: float = 7.0,
+                 max_iterations: int = 100,
+                 tolerance: float = 1e-6,
+                 **merge_kwargs) -> None:
+        """Fellegi-Sunter merge: scores every candidate pair on all fields at once, instead of a join per on_list
+
+        Candidate pairs are rows agreeing on any of blocks. Each class of columns in merge_dict is a field
+        compared at levels, its columns in order: a pair agrees at the level of the first column equal on both sides
+        (e.g. first_name_NS, then F4FN), disagrees if none are, and is missing if they're null on either side.
+        m (matches) and u (non matches) probabilities of each level are fit by EM, and each id pair is scored by
+        the log2 odds of being a match given its best row pair. Pairs scoring at least threshold are merged one to one,
+        see merge_assignment.assign_pairs, unless merged ids aren't filtered.
+
+        Parameters
+        ----------
+        merge_dict : Mapping[str, List[str]]
+            fields to compare, each a list of columns from the strictest agreement level, '' are ignored
+        blocks : Optional[List[List[str]]], optional
+            lists of columns candidate pairs are joined on, by default DEFAULT_BLOCKS
+        threshold : float, optional
+            minimum log2 odds of a match, by default 7.0 (a match probability of about 0.99)
+        max_iterations : int, optional
+            EM iterations, by default 100
+        tolerance : float, optional
+            EM stops when no probability changes by more than this, by default 1e-6
+        merge_kwargs :
+            other Merge arguments, e.g. preprocesses and postprocess
+        """
+        super().__init__(name=name, merge_dict=merge_dict, **merge_kwargs)
+        self.blocks = blocks or DEFAULT_BLOCKS
+        self.threshold = threshold
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+        # fit per field: probability of each agreement level, last level is disagreement
+        self.m_probabilities: Dict[str, np.ndarray] = {}
+        self.u_probabilities: Dict[str, np.ndarray] = {}
+        self.match_prior = np.nan
+
+    def get_all_merges(self,
+                       ref_unmerged: pd.DataFrame,
+                       sup_unmerged: pd.DataFrame,
+                       ref_id: str,
+                       sup_id: str,
+                       cols_list: List[List[str]],
+                       index: Optional[MergeIndex] = None) -> List[pd.DataFrame]:
+        """Scored and thresholded matches of all candidate pairs, in a list like Merge.get_all_merges
+
+        Returns
+        -------
+        List[pd.DataFrame]
+            a single dataframe of id pairs, with matched_on (columns agreed on), matched_to,
+            match_weight (log2 odds of a match) and match_probability columns, highest scores first
+        """
+        index = index or MergeIndex(ref_unmerged, sup_unmerged, ref_id, sup_id)
+        shared = [col for col in ref_unmerged.columns if col in sup_unmerged.columns]
+        fields = {field: [col for col in cols if col in shared]
+                  for field, cols in self.merge_dict.items()}
+        fields = {field: cols for field, cols in fields.items() if cols}
+
+        ref_rows, sup_rows = self.candidate_pairs(index, [block for block in self.blocks
+                                                          if all(col in shared for col in block)])
+        with self.measure(['fellegi-sunter'] + list(fields)) as record:
+            levels = agreement_levels(index, list(fields.values()), ref_rows, sup_rows)
+            patterns, pattern_codes, counts = np.unique(levels, axis=0, return_inverse=True, return_counts=True)
+            level_counts = [len(cols) + 1 for cols in fields.values()]
+            m, u, prior = fit_em(patterns, counts, level_counts, self.max_iterations, self.tolerance)
+            self.m_probabilities = dict(zip(fields, m))
+            self.u_probabilities = dict(zip(fields, u))
+            self.match_prior = prior
+
+            pairs = pd.DataFrame({'ref_row': ref_rows, 'sup_row': sup_rows,
+                                  'ref_code': index.ref_id_codes[ref_rows], 'sup_code': index.sup_id_codes[sup_rows],
+                                  'pattern': pattern_codes.reshape(-1),
+                                  'match_weight': match_weights(patterns, m, u, prior)[pattern_codes.reshape(-1)]})
+            # id pairs are scored by their best row pair
+            pairs = pairs.sort_values('match_weight', ascending=False, kind='stable') \
+                .drop_duplicates(['ref_code', 'sup_code'])
+            pairs = pairs[pairs['match_weight'] >= self.threshold]
+            pairs['match_probability'] = 1 / (1 + np.exp2(-pairs['match_weight']))
+            if self.filter_reference_merges_flag or self.filter_supplemental_merges_flag:
+                pairs = pairs[assign_pairs(pairs['ref_code'], pairs['sup_code'], pairs['match_probability'])]
+
+            matched_on = np.array([agreed_columns(pattern, list(fields.values())) for pattern in patterns], dtype=object)
+            merged_df = pd.DataFrame({ref_id: index.ref_ids[pairs['ref_row']],
+                                      sup_id: index.sup_ids[pairs['sup_row']],
+                                      'matched_on': matched_on[pairs['pattern']] if len(pairs) else [],
+                                      'matched_to': sup_id,
+                                      'match_weight': pairs['match_weight'].to_numpy(),
+                                      'match_probability': pairs['match_probability'].to_numpy()})
+            record.update(ref_rows=index.ref_size, sup_rows=index.sup_size, matches=len(merged_df))
+
+        self.plan_report = (f"Fellegi-Sunter merge {self.name}: {len(merged_df)} matches of {len(ref_rows)} candidate pairs "
+                            f"with {len(patterns)} agreement patterns, match prior {prior:.4f}, fields "
+                            + ", ".join(f"{field} (m={np.round(m_field, 3).tolist()}, u={np.round(u_field, 3).tolist()})"
+                                        for field, m_field, u_field in zip(fields, m, u)))
+        print('%d Matches scored over %d candidate pairs' % (merged_df.shape[0], len(ref_rows)))
+        return [merged_df]
+
+    def candidate_pairs(self, index: MergeIndex, blocks: List[List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Unique reference and supplemental row pairs agreeing on every column of any block"""
+        ref_rows, sup_rows = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for block in blocks:
+            with self.measure(block) as record:
+                block_ref, block_sup = index.join(block)
+                record.update(ref_rows=index.candidate_rows[0], sup_rows=index.candidate_rows[1],
+                              matches=len(block_ref))
+            ref_rows.append(block_ref)
+            sup_rows.append(block_sup)
+
+        pair_keys = np.unique(np.concatenate(ref_rows) * max(index.sup_size, 1) + np.concatenate(sup_rows))
+        return pair_keys // max(index.sup_size, 1), pair_keys % max(index.sup_size, 1)
+
+
+def agreement_levels(index: MergeIndex,
+                     fields: List[List[str]],
+                     ref_rows: np.ndarray,
+                     sup_rows: np.ndarray) -> np.ndarray:
+    """Agreement level of each field for each row pair, from the shared key codes of the index
+
+    Returns
+    -------
+    np.ndarray
+        (pairs x fields) levels: position of the first column of the field equal on both sides,
+        number of columns if none are (disagreement), -1 if every column is null on a side (missing)
+    """
+    levels = np.empty((len(ref_rows), len(fields)), dtype=np.int8)
+    for field, cols in enumerate(fields):
+        level = np.full(len(ref_rows), len(cols), dtype=np.int8)
+        observed = np.zeros(len(ref_rows), dtype=bool)
+        # from the loosest column, so the strictest agreeing column sets the level
+        for position in reversed(range(len(cols))):
+            index.encode_column(cols[position])
+            ref_codes = index.ref_codes[cols[position]][ref_rows]
+            sup_codes = index.sup_codes[cols[position]][sup_rows]
+            both = (ref_codes >= 0) & (sup_codes >= 0)
+            observed |= both
+            level[both & (ref_codes == sup_codes)] = position
+        level[~observed] = -1
+        levels[:, field] = level
+    return levels
+
+
+def fit_em(patterns: np.ndarray,
+           counts: np.ndarray,
+           level_counts: List[int],
+           max_iterations: int = 100,
+           tolerance: float = 1e-6) -> Tuple[List[np.ndarray], List[np.ndarray], float]:
+    """Fits Fellegi-Sunter m and u probabilities by expectation maximization over agreement patterns
+
+    Missing fields (level -1) don't count towards either probability.
+
+    Parameters
+    ----------
+    patterns : np.ndarray
+        (patterns x fields) unique agreement levels, see agreement_levels
+    counts : np.ndarray
+        number of candidate pairs with each pattern
+    level_counts : List[int]
+        number of levels of each field, including disagreement
+
+    Returns
+    -------
+    Tuple[List[np.ndarray], List[np.ndarray], float]
+        m and u probabilities of each level of each field, and the fraction of candidate pairs that match
+    """
+    counts = counts.astype(float)
+    # candidates are mostly non matches, so u starts at the level frequencies of all candidates
+    u = [level_frequencies(patterns[:, field], counts, levels) for field, levels in enumerate(level_counts)]
+    m = [np.append(0.9, np.full(levels - 1, 0.1 / (levels - 1))) for levels in level_counts]
+    prior = 0.1
+
+    for _ in range(max_iterations):
+        weights = match_weights(patterns, m, u, prior)
+        match = 1 / (1 + np.exp2(-weights))
+        new_m = [level_frequencies(patterns[:, field], counts * match, levels) for field, levels in enumerate(level_counts)]
+        new_u = [level_frequencies(patterns[:, field], counts * (1 - match), levels) for field, levels in enumerate(level_counts)]
+        new_prior = float((counts * match).sum() / counts.sum()) if counts.sum() else prior
+
+        change = max([abs(new_prior - prior)] +
+                     [np.abs(new - old).max() for new, old in zip(new_m + new_u, m + u)])
+        m, u, prior = new_m, new_u, new_prior
+        if change < tolerance:
+            break
+
+    return m, u, prior
+
+
+def level_frequencies(levels: np.ndarray, weights: np.ndarray, level_count: int, smoothing: float = 1e-6) -> np.ndarray:
+    """Weighted frequency of each level among non missing levels, smoothed so no level has probability 0"""
+    observed = levels >= 0
+    totals = np.bincount(levels[observed], weights=weights[observed], minlength=level_count) + smoothing
+    return totals / totals.sum()
+
+
+def match_weights(patterns: np.ndarray, m: List[np.ndarray], u: List[np.ndarray], prior: float) -> np.ndarray:
+    """log2 odds of a match for each agreement pattern"""
+    prior = min(max(prior, 1e-12), 1 - 1e-12)
+    weights = np.full(len(patterns), np.log2(prior / (1 - prior)))
+    for field, (m_field, u_field) in enumerate(zip(m, u)):
+        levels = patterns[:, field]
+        observed = levels >= 0
+        weights[observed] += np.log2(m_field[levels[observed]] / u_field[levels[observed]])
+    return weights
+
+
+def agreed_columns(pattern: np.ndarray, fields: List[List[str]]) -> str:
+    """matched_on string of a pattern: the column each field agreed on, joined by '-'"""
+    return '-'.join(cols[level] for level, cols in zip(pattern, fields) if 0 <= level < len(cols))
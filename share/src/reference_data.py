@@ -1,11 +1,18 @@
 import pandas as pd
-from general_utils import reshape_data, list_diff, list_intersect, keep_duplicates
+from general_utils import reshape_data, list_diff, list_intersect, keep_duplicates, stream_link
 import logging
 from typing import List, Mapping, Any, TypedDict, Callable, Optional
 from typing_extensions import Self
 import re
 from foia_data import FoiaData
 from merge_data import Merge
+from merge_cache import MergeCache, PreparedCache
+from merge_metrics import MergeMetrics
+from reference_store import ReferenceStore
+from reference_key_index import ReferenceKeyIndex
+from merge_audit import MergeAudit, AUDIT_COLUMNS, audit_path_from_env
+from merge_index import KeyDictionary
+import merge_chain
 
 class ReferenceData:
     def __init__(self, 
@@ -13,11 +20,24 @@ class ReferenceData:
                  id: str, 
                  add_cols: List[str] = [], 
                  null_flag_cols: List[str] = ['birth_year', 'appointed_date'],
-                 log: logging.Logger = None) -> None:
-        self.reference = FoiaData(df, id=id, add_cols=add_cols, null_flag_cols=null_flag_cols, log=log)
+                 log: logging.Logger = None,
+                 metrics: Optional[MergeMetrics] = None,
+                 prepared_cache: Optional[PreparedCache] = None) -> None:
+        # prepared reference and supplemental frames are read from prepared_cache when it is given
+        self.prepared_cache = prepared_cache
+        self.reference = FoiaData(df, id=id, add_cols=add_cols, null_flag_cols=null_flag_cols, log=log,
+                                  prepared_cache=prepared_cache)
+        # appended foias are kept as partitions, reference.df is only rebuilt when read
+        self.store = ReferenceStore(self.reference.df, id)
         self.merged_df = pd.DataFrame()
         self.merges = []
+        # reference rows when loop_merge last ran, before the supplemental was appended (see write_merge_audit)
+        self.merged_reference_rows: Optional[int] = None
+        # loop_merges run so far, audits of later loops are numbered (see audit_path_from_env)
+        self.loops = 0
         self.log = log or logging.getLogger(__name__)
+        # per join metrics, written to output/<script>.merge_metrics.jsonl when MERGE_METRICS is set
+        self.metrics = metrics or MergeMetrics.from_env()
 
     @classmethod
     def from_first_file(cls,
@@ -55,26 +75,47 @@ class ReferenceData:
                      add_cols: List[str], 
                      one_to_one: bool = True,
                      from_year: int = 2017) -> Self:
+        # keys are coded from a new dictionary at each step, so keys of earlier steps aren't kept alive
+        self.reference.reset_keys(KeyDictionary())
         self.supplemental = FoiaData(sup_df, id=data_id, add_cols=add_cols, one_to_one=one_to_one,
                                      null_flag_cols=self.reference.null_flag_cols, from_year=from_year, 
-                                     log=self.log)
+                                     log=self.log, key_dictionary=self.reference.key_dictionary,
+                                     prepared_cache=self.prepared_cache)
         return self
 
-    def loop_merge(self, merges) -> Self:
+    def loop_merge(self, merges, cache: Optional[MergeCache] = None, audit_path: Optional[str] = None) -> Self:
+        """Applies each merge in order, removing merged ids before the next merge
+
+        Parameters
+        ----------
+        merges : List[Merge]
+            merges to apply, in order
+        cache : Optional[MergeCache], optional
+            cache to read merges applied to the same data before from, and write new merges to, by default None
+        audit_path : Optional[str], optional
+            path to write the audit of the merged pairs to (.npz), see write_merge_audit, by default None,
+            output/<script>.merge_audit.npz when MERGE_AUDIT is set and nothing is written otherwise
+        """
         self.merges += merges
         for idx, merge in enumerate(merges):
-            merged_df = merge.apply_merge(self.reference, self.supplemental)
+            merged_df = self.apply_merge(merge, cache)
 
-            self.supplemental.unmerged = self.supplemental.filter_merges(merged_df, self.supplemental.unmerged)
+            self.supplemental.mark_merged(merged_df[self.supplemental.id])
         
             if self.supplemental.one_to_one:
-                self.reference.unmerged = self.reference.filter_merges(merged_df, self.reference.unmerged)
+                self.reference.mark_merged(merged_df[self.reference.id])
             self.log_merge(merge, idx)
 
         self.merged_df = pd.concat([merge.merged_df for merge in merges])
 
         # do this again here after loop in case supplemental is not one_to_one and filtering never happened during each merge
-        self.reference.unmerged = self.reference.filter_merges(self.merged_df, self.reference.unmerged)
+        self.reference.mark_merged(self.merged_df[self.reference.id])
+        self.merged_reference_rows = len(self.store)
+        self.loops += 1
+
+        audit_path = audit_path or audit_path_from_env(self.loops)
+        if audit_path:
+            self.write_merge_audit(audit_path)
 
         report = f"Final Merge Report: \n{self.get_merge_report(self.merged_df)}"
         report += f"\n{self.merged_df.matched_on.value_counts()}"
@@ -82,6 +123,23 @@ class ReferenceData:
 
         return self
 
+    def apply_merge(self, merge: Merge, cache: Optional[MergeCache] = None) -> pd.DataFrame:
+        if cache is None:
+            return merge.apply_merge(self.reference, self.supplemental, metrics=self.metrics)
+
+        key = cache.key(merge, self.reference.unmerged, self.supplemental.unmerged)
+        if key is None:
+            return merge.apply_merge(self.reference, self.supplemental, metrics=self.metrics)
+        merged_df = cache.get(key)
+        if merged_df is None:
+            merged_df = merge.apply_merge(self.reference, self.supplemental, metrics=self.metrics)
+            cache.put(key, merged_df)
+        else:
+            self.log.info(f"Merge {merge.name} read from cache")
+            merge.merged_df = merged_df
+
+        return merged_df
+
     def append_to_reference(self, keep_sup_um: bool = True, drop_cols: List[str] = [], sequential_ids: bool=True) -> Self:
         id_cols = [self.reference.id, self.supplemental.id]
         # combine merged df with unmerged reference ids to get all reference ids
@@ -107,24 +165,58 @@ class ReferenceData:
                 .reset_index(drop=True)
 
         self.supplemental.df = self.supplemental.df.merge(link_df, on=self.supplemental.id)
-        
-        self.reference.df = pd.concat([self.reference.df, self.supplemental.df.drop(drop_cols, axis=1)],
-                                      ignore_index=True)
-        
+
+        sup_ref = self.supplemental.df.drop(drop_cols, axis=1)
+        sup_ref = sup_ref.assign(**{col: pd.to_numeric(sup_ref[col]) for col in id_cols})
+        self.store.append(self.supplemental.id, sup_ref)
+        self.reference.df = self.store
+
         if sequential_ids:
-            id_diff = max(self.reference.df[self.reference.id]) - min(self.reference.df[self.reference.id]) + 1 
-            assert id_diff == self.reference.df[self.reference.id].nunique(), 'Missing some uids'
+            ids = self.store.view([self.reference.id])[self.reference.id]
+            assert max(ids) - min(ids) + 1 == ids.nunique(), 'Missing some uids'
 
-        self.reference.df[id_cols] = self.reference.df[id_cols]\
-            .apply(pd.to_numeric)
-        
         return self
 
     def write_reference(self, output_path, csv_opts) -> Self:
-        self.reference.df.to_csv(output_path, **csv_opts)
+        # steps run by merge_chain hand the reference to the next step, only checkpoints are written
+        if merge_chain.hand_off(output_path, self.store):
+            self.store.to_csv(output_path, **csv_opts)
+        return self
+
+    def write_key_index(self, output_path: str, key_cols: Optional[List[str]] = None) -> Self:
+        """Writes an on disk index of the merge key columns of the reference to output_path, see ReferenceKeyIndex
+
+        Parameters
+        ----------
+        output_path : str
+            Path of output index file (sqlite)
+        key_cols : Optional[List[str]], optional
+            columns to index, by default every column used by the merges applied so far
+        """
+        if key_cols is None:
+            key_cols = [col for merge in self.merges
+                        for cols in list(merge.merge_dict.values()) + merge.custom_merges for col in cols if col]
+        ReferenceKeyIndex.build(self.store.df, self.reference.id, key_cols, output_path).close()
+        return self
+
+    def merge_audit(self, ordered_cols: Optional[List[str]] = None) -> MergeAudit:
+        """Audit of the pairs merged by the last loop_merge, see MergeAudit.build
+
+        Built when asked for, from the reference rows there were when loop_merge ran,
+        so rows appended from the supplemental since aren't compared to themselves
+        """
+        assert self.merged_reference_rows is not None, 'Nothing merged to audit, run loop_merge first'
+        ref_df = self.store.view([self.reference.id] + list(ordered_cols or AUDIT_COLUMNS))\
+            .iloc[:self.merged_reference_rows]
+        return MergeAudit.build(self.merged_df, ref_df, self.supplemental.df,
+                                self.reference.id, self.supplemental.id, ordered_cols)
+
+    def write_merge_audit(self, output_path: str, ordered_cols: Optional[List[str]] = None) -> Self:
+        """Writes the audit of the merged pairs of the last loop_merge to output_path (.npz), see MergeAudit.load to query it"""
+        self.merge_audit(ordered_cols).save(output_path)
         return self
 
-    def remerge_to_file(self, input_path, output_path, csv_opts) -> Self:
+    def remerge_to_file(self, input_path, output_path, csv_opts, chunksize: Optional[int] = None) -> Self:
         """Merges sup_df (with uids) to input_path, writes data to output_path
 
         Parameters
@@ -135,14 +227,24 @@ class ReferenceData:
             Path of output file (csv)
         csv_opts : dict
             Dictionary of pandas .to_csv options
+        chunksize : int
+            If given, input_path is read, linked and written chunksize rows at a time
+            (see general_utils.stream_link), instead of merged in memory
 
         Returns
         ----------
         self
         """
+        if chunksize:
+            rows = stream_link(input_path, output_path,
+                               self.store.view([self.reference.id, self.supplemental.id]),
+                               on=self.supplemental.id, link_col=self.reference.id,
+                               csv_opts=csv_opts, chunksize=chunksize)
+            self.log.info('Streamed %d rows to %s', rows, output_path)
+            return self
         full_df = pd.read_csv(input_path)
         rows = full_df.shape[0]
-        link_df = self.reference.df[[self.reference.id, self.supplemental.id]].drop_duplicates()
+        link_df = self.store.view([self.reference.id, self.supplemental.id]).drop_duplicates()
         full_df = full_df.merge(link_df, on=self.supplemental.id, how='left')
         assert full_df.shape[0] == rows, 'Missing rows!'
         full_df.to_csv(output_path, **csv_opts)
@@ -155,9 +257,9 @@ class ReferenceData:
         merge_report += f"{total_merged} rows merged. "
         merge_report += f"{self.reference.merged_percent(total_merged)}% of ref and "
         merge_report += f"{self.supplemental.merged_percent(total_merged)}% of sup merged.\n"
-        merge_report += f"{self.reference.unmerged[self.reference.id].nunique()} unmerged in ref. "
+        merge_report += f"{self.reference.unmerged_count()} unmerged in ref. "
         merge_report += f"{self.reference.unmerged_percent()}% unmerged.\n"
-        merge_report += f"{self.supplemental.unmerged[self.supplemental.id].nunique()} unmerged in sup. "
+        merge_report += f"{self.supplemental.unmerged_count()} unmerged in sup. "
         merge_report += f"{self.supplemental.unmerged_percent()}% unmerged."
 
         return merge_report
@@ -0,0 +1,156 @@
+import pandas as pd
+import numpy as np
+import os
+import sqlite3
+from typing import List
+from typing_extensions import Self
+
+
+def sql_values(values: pd.Series) -> list:
+    """Values as python objects sqlite can store, None for nulls, dates as iso strings"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        values = values.dt.strftime('%Y-%m-%dT%H:%M:%S')
+    return values.astype(object).where(values.notnull(), None).tolist()
+
+
+class ReferenceKeyIndex:
+    def __init__(self, path: str) -> None:
+        """On disk index of the merge key columns of an officer reference, written by build
+
+        For each key column, postings of each value to the reference rows that have it, and the id of each row,
+        in a sqlite file. Supplemental rows are matched by looking up their values in the postings, so a new FOIA
+        can be matched against the reference without reading the reference itself.
+
+        Parameters
+        ----------
+        path : str
+            index file, see build
+        """
+        self.path = path
+        self.connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        self.id, = self.connection.execute('SELECT id FROM meta').fetchone()
+        self.columns: List[str] = [col for col, in self.connection.execute('SELECT col FROM keys ORDER BY number')]
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, id: str, key_cols: List[str], path: str, chunksize: int = 100000) -> Self:
+        """Writes the index of key_cols of df to path, replacing any index already there
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            reference, with a row for every appearance of an officer
+        id : str
+            reference id column
+        key_cols : List[str]
+            merge key columns, ones df doesn't have are left out
+        path : str
+            index file, written to a temporary file first so readers never see a partial index
+        chunksize : int, optional
+            rows inserted at a time, by default 100000
+
+        Returns
+        -------
+        ReferenceKeyIndex
+            index opened from path
+        """
+        key_cols = [col for col in dict.fromkeys(key_cols) if col in df.columns and col != id]
+        partial = f'{path}.partial'
+        if os.path.exists(partial):
+            os.remove(partial)
+
+        connection = sqlite3.connect(partial)
+        connection.execute('CREATE TABLE meta (id)')
+        connection.execute('INSERT INTO meta VALUES (?)', [id])
+        connection.execute('CREATE TABLE keys (number INTEGER PRIMARY KEY, col TEXT)')
+        connection.executemany('INSERT INTO keys VALUES (?, ?)', list(enumerate(key_cols)))
+
+        connection.execute('CREATE TABLE rows (row INTEGER PRIMARY KEY, id)')
+        for number in range(len(key_cols)):
+            # rows are stored in value order, so each lookup reads one contiguous range
+            connection.execute(f'CREATE TABLE postings_{number} (value, row INTEGER, PRIMARY KEY (value, row)) WITHOUT ROWID')
+
+        for start in range(0, df.shape[0], chunksize):
+            chunk = df.iloc[start:start + chunksize]
+            rows = np.arange(start, start + chunk.shape[0]).tolist()
+            connection.executemany('INSERT INTO rows VALUES (?, ?)', zip(rows, sql_values(chunk[id])))
+            for number, col in enumerate(key_cols):
+                connection.executemany(f'INSERT INTO postings_{number} VALUES (?, ?)',
+                                       [(value, row) for value, row in zip(sql_values(chunk[col]), rows)
+                                        if value is not None])
+        connection.commit()
+        connection.close()
+
+        os.replace(partial, path)
+        return cls(path)
+
+    def lookup(self, sup_df: pd.DataFrame, sup_id: str, on_cols: List[str]) -> pd.DataFrame:
+        """Reference ids of the rows that have the same values of on_cols as each supplemental row
+
+        Parameters
+        ----------
+        sup_df : pd.DataFrame
+            supplemental data, with every column of on_cols
+        sup_id : str
+            supplemental id column
+        on_cols : List[str]
+            columns to match on, all in the index
+
+        Returns
+        -------
+        pd.DataFrame
+            unique reference/supplemental id pairs, like a pandas merge on on_cols of the reference and sup_df
+        """
+        missing = [col for col in on_cols if col not in self.columns]
+        assert not missing, f'{missing} not in the key index'
+        assert on_cols, 'Nothing to match on'
+
+        sup_keys = sup_df[[sup_id] + on_cols].dropna(how='any')
+        self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS sup (number INTEGER PRIMARY KEY, id)')
+        self.connection.execute('DELETE FROM sup')
+        self.connection.executemany('INSERT INTO sup VALUES (?, ?)', enumerate(sql_values(sup_keys[sup_id])))
+        for position, col in enumerate(on_cols):
+            self.connection.execute(f'CREATE TEMP TABLE IF NOT EXISTS sup_{position} (number INTEGER PRIMARY KEY, value)')
+            self.connection.execute(f'DELETE FROM sup_{position}')
+            self.connection.executemany(f'INSERT INTO sup_{position} VALUES (?, ?)', enumerate(sql_values(sup_keys[col])))
+
+        # the first column finds candidate rows, each other column is a point lookup of (value, row)
+        numbers = [self.columns.index(col) for col in on_cols]
+        joins = ' '.join(f'JOIN sup_{position} AS s{position} ON s{position}.number = sup.number '
+                         f'JOIN postings_{number} AS p{position} ON p{position}.value = s{position}.value'
+                         + (f' AND p{position}.row = p0.row' if position else '')
+                         for position, number in enumerate(numbers))
+        pairs = self.connection.execute(f'SELECT DISTINCT rows.id, sup.id FROM sup {joins} '
+                                        f'JOIN rows ON rows.row = p0.row ORDER BY sup.number, rows.row').fetchall()
+
+        return pd.DataFrame(pairs, columns=[self.id, sup_id])
+
+    def match(self, sup_df: pd.DataFrame, sup_id: str, cols_list: List[List[str]]) -> pd.DataFrame:
+        """Matches on each on_list of cols_list in order, ids matched by one on_list aren't matched again
+
+        Like the greedy column list loop of Merge, with matched_on and matched_to columns, but without
+        any pre or post processing, so it is a quick first look at how a new file matches the reference.
+        On_lists with columns missing from the index or sup_df are skipped.
+        """
+        ref_matched, sup_matched = set(), set()
+        all_merges = [pd.DataFrame(columns=[self.id, sup_id, 'matched_on', 'matched_to'])]
+        for on_cols in cols_list:
+            if not on_cols or any(col not in self.columns or col not in sup_df.columns for col in on_cols):
+                continue
+            merged_df = self.lookup(sup_df[~sup_df[sup_id].isin(sup_matched)], sup_id, on_cols)
+            merged_df = merged_df[~merged_df[self.id].isin(ref_matched)]
+            ref_matched.update(merged_df[self.id])
+            sup_matched.update(merged_df[sup_id])
+            all_merges.append(merged_df.assign(matched_on='-'.join(on_cols), matched_to=sup_id))
+
+        return pd.concat(all_merges, ignore_index=True)
+
+    def match_merges(self, sup_df: pd.DataFrame, sup_id: str, merges: list) -> pd.DataFrame:
+        """match on the on_lists of each of merges in order, generated from the columns of the index and sup_df"""
+        common_columns = [col for col in self.columns if col in sup_df.columns and col != sup_id]
+        return self.match(sup_df, sup_id, [on_cols for merge in merges
+                                           for on_cols in merge.generate_on_lists(merge.merge_dict, common_columns,
+                                                                                  merge.custom_merges)])
+
+    def close(self) -> None:
+        self.connection.close()
+
@@ -0,0 +1,98 @@
+import pandas as pd
+from typing import Dict, List, Optional
+from typing_extensions import Self
+from general_utils import open_output
+
+
+class ReferenceStore:
+    def __init__(self, df: pd.DataFrame, id: str, name: Optional[str] = None) -> None:
+        """Officer reference stored as one partition per appended FOIA, with a lazy unified view
+
+        Appending a FOIA only stores its rows (already linked to reference ids), so appending costs
+        the size of that FOIA instead of a copy of the whole growing reference. Id checks (view of a
+        few columns), len, columns and to_csv read the partitions without building the unified view.
+
+        Merging against the reference still needs every row, so reading the full view (df) concatenates
+        the partitions, once per append: the result is kept as the only partition, so changes made to it
+        are kept by later appends and views.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            reference data to start from
+        id : str
+            reference id column, every partition must have it
+        name : Optional[str], optional
+            name of the first partition, by default id
+        """
+        self.id = id
+        # partitions by the order they were appended in, names can repeat (e.g. a FOIA appended a year at a time)
+        self.partitions: Dict[int, pd.DataFrame] = {0: df}
+        # names of every partition, including those already concatenated into the full view
+        self.names: List[str] = [name or id]
+
+    def append(self, name: str, df: pd.DataFrame) -> Self:
+        """Stores df as a new partition named name, usually the id column of the FOIA it came from"""
+        assert self.id in df.columns, f'{name} partition has no {self.id} column'
+        self.partitions[len(self.names)] = df
+        self.names.append(name)
+        return self
+
+    @property
+    def columns(self) -> List[str]:
+        """Columns of the unified view, in the order partitions were appended"""
+        return list(dict.fromkeys(col for df in self.partitions.values() for col in df.columns))
+
+    def __len__(self) -> int:
+        return sum(df.shape[0] for df in self.partitions.values())
+
+    def view(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Partitions concatenated into one frame, like a single reference appended to at each step
+
+        Parameters
+        ----------
+        columns : Optional[List[str]], optional
+            columns to project each partition to before concatenating, by default all (see df)
+
+        Returns
+        -------
+        pd.DataFrame
+            rows of every partition in order, a new frame even if it is a single partition
+        """
+        if columns is None:
+            return self.df
+        # only columns in some partition, a column missing from one partition is NaN in its rows
+        columns = [col for col in columns if col in self.columns]
+        if len(self.partitions) == 1:
+            return next(iter(self.partitions.values()))[columns]
+        return pd.concat([df[[col for col in columns if col in df.columns]]
+                          for df in self.partitions.values()],
+                         ignore_index=True)[columns]
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """Full unified view, stored as the only partition so it is built once"""
+        if len(self.partitions) > 1:
+            name = next(iter(self.partitions))
+            self.partitions = {name: pd.concat(list(self.partitions.values()), ignore_index=True)}
+        return next(iter(self.partitions.values()))
+
+    def to_csv(self, output_path: str, **csv_opts) -> Self:
+        """Writes the flat reference, same as writing df, one partition at a time without building df"""
+        compression = csv_opts.pop('compression', 'infer')
+        if len(self.partitions) == 1 or compression not in ['infer', 'gzip', None]:
+            self.df.to_csv(output_path, compression=compression, **csv_opts)
+            return self
+
+        # dtypes of the unified view only depend on the dtypes (and missing columns) of each partition
+        dtypes = pd.concat([df.head(1) for df in self.partitions.values()], ignore_index=True).dtypes
+        header = csv_opts.pop('header', True)
+        start = 0
+        with open_output(output_path, compression) as output:
+            for number, df in enumerate(self.partitions.values()):
+                df.reindex(columns=dtypes.index)\
+                    .astype(dtypes)\
+                    .set_axis(pd.RangeIndex(start, start + df.shape[0]))\
+                    .to_csv(output, header=header if number == 0 else False, **csv_opts)
+                start += df.shape[0]
+        return self
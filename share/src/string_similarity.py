@@ -0,0 +1,183 @@
+import pandas as pd
+import numpy as np
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Tuple
+
+# scores of pairs of strings, computed on unique pairs only
+PairScorer = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+
+def score_pairs(left: pd.Series, right: pd.Series, scorer: PairScorer, null_score=0) -> np.ndarray:
+    """Scores each (left, right) pair of values, computing the score of each unique pair once
+
+    Merged data repeats the same names many times (every row of an officer, every officer named JOHN),
+    so the pairs are factorized and the scores of unique pairs are broadcast back to every row.
+
+    Parameters
+    ----------
+    left : pd.Series
+        values of the reference column
+    right : pd.Series
+        values of the supplemental column, aligned by position with left
+    scorer : PairScorer
+        function scoring arrays of unique non-null left and right strings
+    null_score : optional
+        score of pairs where either value is null, by default 0
+
+    Returns
+    -------
+    np.ndarray
+        score of each pair, in the order of left and right
+    """
+    left_codes, left_values = pd.factorize(left)
+    right_codes, right_values = pd.factorize(right)
+    valid = (left_codes >= 0) & (right_codes >= 0)
+
+    pair_codes, unique_pairs = pd.factorize(
+        left_codes[valid].astype(np.int64) * max(len(right_values), 1) + right_codes[valid])
+    unique_left = np.asarray(left_values)[unique_pairs // max(len(right_values), 1)]
+    unique_right = np.asarray(right_values)[unique_pairs % max(len(right_values), 1)]
+    unique_scores = np.asarray(scorer(unique_left.astype(str), unique_right.astype(str)))
+
+    scores = np.full(len(left), null_score, dtype=np.result_type(unique_scores, type(null_score)))
+    scores[valid] = unique_scores[pair_codes]
+    return scores
+
+
+def char_codes(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Unicode code points of values padded with 0 to the longest value, and the length of each value"""
+    lengths = np.char.str_len(values).astype(np.int64) if len(values) else np.zeros(0, dtype=np.int64)
+    width = max(int(lengths.max()) if len(values) else 0, 1)
+    codes = np.ascontiguousarray(values.astype(f'<U{width}')).view(np.uint32).reshape(len(values), width)
+    return codes, lengths
+
+
+def jaro_winkler(left: np.ndarray, right: np.ndarray, prefix_weight: float = 0.1) -> np.ndarray:
+    """Jaro-Winkler similarity of each pair of strings, same as textdistance.jaro_winkler
+
+    The greedy character matching loops over positions of the left strings only,
+    every other step is done over all pairs at once.
+
+    Parameters
+    ----------
+    left : np.ndarray
+        strings
+    right : np.ndarray
+        strings, same length as left
+    prefix_weight : float, optional
+        weight of each common prefix character, by default 0.1
+
+    Returns
+    -------
+    np.ndarray
+        similarities between 0 and 1
+    """
+    left_codes, left_len = char_codes(np.asarray(left, dtype=str))
+    right_codes, right_len = char_codes(np.asarray(right, dtype=str))
+    rows = np.arange(len(left_len))
+    right_pos = np.arange(right_codes.shape[1])
+
+    search_range = np.maximum(np.maximum(left_len, right_len) // 2 - 1, 0)
+    left_flags = np.zeros(left_codes.shape, dtype=bool)
+    right_flags = np.zeros(right_codes.shape, dtype=bool)
+
+    # flag the first unmatched equal character of right within search range of each left character
+    for i in range(left_codes.shape[1]):
+        candidates = (right_codes == left_codes[:, [i]]) & ~right_flags \
+            & (np.abs(right_pos - i) <= search_range[:, None]) \
+            & (right_pos < right_len[:, None]) & (i < left_len)[:, None]
+        found = candidates.any(axis=1)
+        first = candidates.argmax(axis=1)
+        left_flags[found, i] = True
+        right_flags[rows[found], first[found]] = True
+
+    common = left_flags.sum(axis=1)
+
+    # matched characters in order, compared position by position for transpositions
+    def matched_chars(codes, flags):
+        order = np.argsort(~flags, axis=1, kind='stable')
+        return np.take_along_axis(codes, order, axis=1)
+
+    width = min(left_codes.shape[1], right_codes.shape[1])
+    transposed = (matched_chars(left_codes, left_flags)[:, :width] != matched_chars(right_codes, right_flags)[:, :width]) \
+        & (np.arange(width) < common[:, None])
+    transpositions = transposed.sum(axis=1) // 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = (common / left_len + common / right_len + (common - transpositions) / common) / 3
+    weight = np.where(common > 0, weight, 0.0)
+
+    # winkler modification, for up to 4 common prefix characters of similar strings
+    prefix_len = np.minimum(np.minimum(left_len, right_len), 4)
+    prefix_width = min(width, 4)
+    prefix_match = np.cumprod(left_codes[:, :prefix_width] == right_codes[:, :prefix_width], axis=1)
+    prefix = (prefix_match & (np.arange(prefix_width) < prefix_len[:, None])).sum(axis=1)
+    weight = np.where(weight > 0.7, weight + prefix * prefix_weight * (1.0 - weight), weight)
+
+    # identical strings are always 1, even when empty
+    return np.where(np.asarray(left, dtype=str) == np.asarray(right, dtype=str), 1.0, weight)
+
+
+def is_substring(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """Whether either string of each pair is contained in the other"""
+    left, right = np.asarray(left, dtype=str), np.asarray(right, dtype=str)
+    if not len(left):
+        return np.zeros(0, dtype=bool)
+    return (np.char.find(right, left) >= 0) | (np.char.find(left, right) >= 0)
+
+
+@lru_cache(maxsize=None)
+def nicknamer():
+    """NickNamer, whose nickname tables are read from its csv once per process"""
+    from nicknames import NickNamer
+    return NickNamer()
+
+
+@lru_cache(maxsize=None)
+def nicknames_of(name: str) -> FrozenSet[str]:
+    # NOTE: nicknames always returns lowercase
+    return frozenset(nicknamer().nicknames_of(name))
+
+
+@lru_cache(maxsize=None)
+def metaphone_codes(name: str) -> Tuple[str, str]:
+    from metaphone import doublemetaphone
+    return doublemetaphone(name)
+
+
+@lru_cache(maxsize=None)
+def nickname_classes() -> Dict[str, str]:
+    """Equivalence table of first names (lowercase) to the name of their nickname class, built once per process
+
+    NickNamer relates names to nicknames many to many (kathy is a nickname of katherine and kathleen),
+    so classes are a partition of it: canonical names with the most nicknames claim themselves and
+    their nicknames first, so a name belongs to the class of its most common canonical name.
+    """
+    lookup = nicknamer().nickname_lookup
+    classes: Dict[str, str] = {}
+    for canonical in sorted(lookup, key=lambda name: (-len(lookup[name]), name)):
+        name_class = classes.setdefault(canonical, canonical)
+        for nickname in sorted(lookup[canonical]):
+            classes.setdefault(nickname, name_class)
+    return classes
+
+
+def nickname_class(name: str) -> str:
+    """Uppercase name of the nickname class of name, the name itself if it has no nicknames"""
+    return nickname_classes().get(name.lower(), name.lower()).upper()
+
+
+def is_nickname(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """Whether either name of each pair is a nickname of the other"""
+    return np.array([(left_name.lower() in nicknames_of(right_name)) or (right_name.lower() in nicknames_of(left_name))
+                     for left_name, right_name in zip(left, right)], dtype=bool)
+
+
+def metaphone_match(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """Whether the primary, or the secondary, double metaphone codes of each pair of names are equal
+
+    Same as filters.phonetic_metaphone, so names that both have no secondary code (e.g. BOB and ROB) match
+    """
+    left_codes = np.array([metaphone_codes(name) for name in left], dtype=str).reshape(len(left), 2)
+    right_codes = np.array([metaphone_codes(name) for name in right], dtype=str).reshape(len(right), 2)
+    return (left_codes[:, 0] == right_codes[:, 0]) | (left_codes[:, 1] == right_codes[:, 1])
@@ -0,0 +1 @@
+../src/default_merges.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/filters.py
\ No newline at end of file
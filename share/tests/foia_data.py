@@ -0,0 +1 @@
+../src/foia_data.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/merge_assignment.py
\ No newline at end of file
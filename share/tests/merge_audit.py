@@ -0,0 +1 @@
+../src/merge_audit.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/merge_cache.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/merge_chain.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/merge_data.py
\ No newline at end of file
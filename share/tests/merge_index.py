@@ -0,0 +1 @@
+../src/merge_index.py
\ No newline at end of file
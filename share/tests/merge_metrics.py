@@ -0,0 +1 @@
+../src/merge_metrics.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/merge_sqlite.py
\ No newline at end of file
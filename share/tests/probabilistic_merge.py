@@ -0,0 +1 @@
+../src/probabilistic_merge.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/reference_data.py
\ No newline at end of file
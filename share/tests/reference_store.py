@@ -0,0 +1 @@
+../src/reference_store.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/string_similarity.py
\ No newline at end of file
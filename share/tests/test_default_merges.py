@@ -0,0 +1,53 @@
+#! usr/bin/env python3
+#
+# Author:   Ashwin Sharma (Invisible Institute)
+
+'''pytest functions for default_merges'''
+
+import pandas as pd
+from default_merges import multirow_merge_process
+
+
+def explode_multirow_merge_process(ref_unmerged, sup_unmerged, ref_id, sup_id, merged_df, required_cols):
+    '''multirow_merge_process as it was before bitmasks, exploding and joining matched_on strings'''
+    required_cols = [col for col in required_cols if (col in sup_unmerged) and (col in ref_unmerged)]
+    if merged_df.empty:
+        return pd.DataFrame(columns=[ref_id, sup_id, 'matched_on'])
+    all_matched_columns = merged_df.assign(matched_on=merged_df.matched_on.str.split("-")) \
+        .explode('matched_on') \
+        .drop_duplicates() \
+        .groupby([ref_id, sup_id]) \
+        .agg(matched_on=('matched_on', '-'.join))
+
+    mask = pd.Series([True] * len(all_matched_columns), index=all_matched_columns.index)
+    for col in required_cols:
+        mask = mask & all_matched_columns.matched_on.str.contains(col)
+    return all_matched_columns[mask].reset_index()
+
+
+def test_multirow_merge_same_as_explode():
+    '''pairs kept and their matched_on (in the order each pair matched on its columns) are the same as exploding'''
+    ref_df = pd.DataFrame({'UID': [1, 2, 3], 'first_name_NS': ['BOB', 'KATHY', 'ELLEN'],
+                           'last_name_NS': ['JONES', 'PARK', 'KIM'], 'star': [1, 2, 3],
+                           'appointed_date': ['2000-01-01', '2001-01-01', '2002-01-01']})
+    sup_df = ref_df.rename(columns={'UID': 'sup_ID'})
+    merged_df = pd.DataFrame({'UID': [3, 1, 1, 2, 2, 3, 1],
+                              'sup_ID': [3, 1, 1, 2, 2, 3, 2],
+                              'matched_on': ['first_name_NS-appointed_date',
+                                             'last_name_NS-star',
+                                             'first_name_NS-appointed_date',
+                                             'first_name_NS-last_name_NS-appointed_date',
+                                             'star',
+                                             'last_name_NS',
+                                             'first_name_NS']})
+    args = (ref_df, sup_df, 'UID', 'sup_ID', merged_df, ['first_name_NS', 'last_name_NS', 'appointed_date'])
+
+    expected = explode_multirow_merge_process(*args)
+    results = multirow_merge_process(*args)
+
+    assert results.equals(expected)
+    assert results['matched_on'].tolist() == ['last_name_NS-star-first_name_NS-appointed_date',
+                                              'first_name_NS-last_name_NS-appointed_date-star',
+                                              'first_name_NS-appointed_date-last_name_NS']
+    assert multirow_merge_process(*args[:-1], ['first_name_NS', 'middle_initial']).equals(
+        explode_multirow_merge_process(*args[:-1], ['first_name_NS', 'middle_initial']))
@@ -207,3 +207,25 @@ def test_expand_data():
     assert results.equals(output_full_df)
     assert orig_input_collapsed_df.equals(input_collapsed_df)
     assert orig_input_stored_df.equals(input_stored_df)
+
+def test_stream_link(tmp_path):
+    '''test stream_link gives the same data as merging the full file'''
+    input_df = pd.DataFrame({
+        'sub_ID': [1, 2, 3, 4, 5, 6, 2, 7],
+        'event': ['A', 'B', np.nan, 'D', 'E', 'F', 'G', 'H']})
+    link_df = pd.DataFrame({
+        'UID': [10, 20, 30, 40, 50, 50],
+        'sub_ID': [1, 2, 3, 4, 5, 5]})
+    input_path = str(tmp_path / 'input.csv')
+    output_path = str(tmp_path / 'output.csv.gz')
+    input_df.to_csv(input_path, index=False)
+
+    rows = general_utils.stream_link(input_path, output_path, link_df, 'sub_ID', 'UID',
+                                     {'index': False, 'compression': 'gzip'}, chunksize=3)
+    expected_df = pd.read_csv(input_path).merge(link_df.drop_duplicates(), on='sub_ID', how='left')
+    assert rows == input_df.shape[0]
+    assert pd.read_csv(output_path).equals(expected_df)
+
+    with pytest.raises(AssertionError):
+        general_utils.stream_link(input_path, output_path, link_df.assign(UID=[10, 20, 30, 40, 50, 60]),
+                                  'sub_ID', 'UID', {'index': False}, chunksize=3)
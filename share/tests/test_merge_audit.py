@@ -0,0 +1,109 @@
+#! usr/bin/env python3
+#
+# Author:   Ashwin Sharma (Invisible Institute)
+
+'''pytest functions for merge_audit'''
+
+import pytest
+import logging
+import pandas as pd
+import numpy as np
+import __main__
+from merge_audit import MergeAudit, AUDIT_ENV
+from merge_data import Merge
+from reference_data import ReferenceData
+
+reference_df = pd.DataFrame({'UID': [1, 1, 2, 3, 4],
+                             'first_name_NS': ['BOB', 'BOB', 'KATHY', 'ELLEN', 'BOB'],
+                             'last_name_NS': ['JONES', 'SMITH', 'PARK', 'KIM', 'SMITH'],
+                             'birth_year': [1970., 1970., np.nan, 1965., 1980.],
+                             'star': [123., 456., 789., np.nan, 111.]})
+sup_df = pd.DataFrame({'sup_ID': [10, 11, 12, 13],
+                       'first_name_NS': ['BOB', 'KATHY', 'ELLEN', 'BOB'],
+                       'last_name_NS': ['SMITH', 'PARK', 'KIM', 'SMITH'],
+                       'birth_year': [1970, 1985, 1960, 1980],
+                       'star': [456., 789., 222., 999.]})
+merged_df = pd.DataFrame({'UID': [1, 2, 3, 4],
+                          'sup_ID': [10, 11, 12, 13],
+                          'matched_on': ['first_name_NS-last_name_NS-star', 'first_name_NS-last_name_NS-star',
+                                         'first_name_NS-last_name_NS', 'first_name_NS-last_name_NS-birth_year'],
+                          'merge_name': ['base', 'base', 'base', 'loose']})
+
+
+def test_build_and_select():
+    '''values of each side are joined per id, pairs are selected by id, merge, columns matched on and disagreements'''
+    audit = MergeAudit.build(merged_df, reference_df, sup_df, 'UID', 'sup_ID')
+
+    assert audit.table['ref_last_name_NS'].tolist() == ['JONES, SMITH', 'PARK', 'KIM', 'SMITH']
+    assert audit.table['ref_star'].tolist() == ['123.0, 456.0', '789.0', np.nan, '111.0']
+    assert audit.select(ref_ids=[1, 3])['sup_ID'].tolist() == [10, 12]
+    assert audit.select(merge_names=['loose'])['UID'].tolist() == [4]
+    assert audit.select(matched_on=['star'])['UID'].tolist() == [1, 2]
+    # UID 2 has no birth_year and UID 3 no star, so neither disagrees on them
+    assert audit.select(disagree_on=['birth_year'])['UID'].tolist() == [3]
+    assert audit.select(disagree_on=['star'])['UID'].tolist() == [4]
+    assert audit.select(merge_names=['base'], disagree_on=['birth_year', 'star'])['UID'].tolist() == [3]
+    assert audit.disagreements()[('base', 'birth_year')] == 1
+    assert audit.disagreements()[('loose', 'star')] == 1
+
+    report = audit.report()
+    assert report.loc[(4, 13), ('match', 'birth_year')] == 1
+    assert report.loc[(4, 13), ('sup', 'star')] == '999.0'
+
+
+def test_save_load_roundtrip(tmp_path):
+    '''a saved audit loads with the same values and answers the same queries'''
+    audit = MergeAudit.build(merged_df, reference_df, sup_df, 'UID', 'sup_ID')
+    path = str(tmp_path / 'merge_audit.npz')
+    audit.save(path)
+    loaded = MergeAudit.load(path)
+    with pytest.raises(AssertionError):
+        audit.save(str(tmp_path / 'merge_report.xlsx'))
+
+    assert loaded.columns == audit.columns
+    assert (loaded.table.astype(object).fillna('') == audit.table.astype(object).fillna('')).all().all()
+    assert loaded.select(disagree_on=['birth_year'])['UID'].tolist() == [3]
+
+
+def test_reference_data_audit_before_append(tmp_path):
+    '''the audit of a loop_merge compares with the reference as it was merged, even after appending to it'''
+    step_ref = pd.DataFrame({'UID': [1, 2], 'first_name_NS': ['BOB', 'KATHY'], 'last_name_NS': ['JONES', 'PARK'],
+                             'birth_year': [1970., 1980.]})
+    step_sup = pd.DataFrame({'sup_ID': [10, 11], 'first_name_NS': ['BOB', 'KATHY'], 'last_name_NS': ['JONES', 'PARK'],
+                             'birth_year': [1971., np.nan]})
+    rd = ReferenceData(step_ref, id='UID', null_flag_cols=[], log=logging.getLogger(__name__))\
+        .add_sup_data(step_sup, data_id='sup_ID', add_cols=[])\
+        .loop_merge([Merge(name='names', merge_dict={'first_name_NS': ['first_name_NS'],
+                                                    'last_name_NS': ['last_name_NS']})])\
+        .append_to_reference()
+    audit = rd.merge_audit()
+
+    assert audit.select(sup_ids=[10])['ref_birth_year'].tolist() == ['1970.0']
+    assert audit.select(disagree_on=['birth_year'])['sup_ID'].tolist() == [10]
+    rd.write_merge_audit(str(tmp_path / 'merge_audit.npz'))
+    assert MergeAudit.load(str(tmp_path / 'merge_audit.npz')).table.shape == audit.table.shape
+
+
+def test_loop_merge_writes_audit(tmp_path, monkeypatch):
+    '''loop_merge writes the audit to audit_path, or next to the script output when MERGE_AUDIT is set'''
+    step_ref = pd.DataFrame({'UID': [1, 2], 'first_name_NS': ['BOB', 'KATHY'], 'last_name_NS': ['JONES', 'PARK']})
+    step_sup = pd.DataFrame({'sup_ID': [10, 11], 'first_name_NS': ['BOB', 'KATHY'], 'last_name_NS': ['JONES', 'PARK']})
+    merges = [Merge(name='names', merge_dict={'first_name_NS': ['first_name_NS'], 'last_name_NS': ['last_name_NS']})]
+
+    def loop_merge(audit_path=None):
+        return ReferenceData(step_ref, id='UID', null_flag_cols=[], log=logging.getLogger(__name__))\
+            .add_sup_data(step_sup, data_id='sup_ID', add_cols=[])\
+            .loop_merge(merges, audit_path=audit_path)
+
+    loop_merge(str(tmp_path / 'names.npz'))
+    assert MergeAudit.load(str(tmp_path / 'names.npz')).table['sup_ID'].tolist() == [10, 11]
+
+    (tmp_path / 'output').mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(__main__, '__file__', 'src/merge.py', raising=False)
+    loop_merge()
+    assert not list((tmp_path / 'output').iterdir())
+
+    monkeypatch.setenv(AUDIT_ENV, '1')
+    loop_merge()
+    assert MergeAudit.load('output/merge.merge_audit.npz').table['UID'].tolist() == [1, 2]
@@ -0,0 +1,82 @@
+#! usr/bin/env python3
+#
+# Author:   Ashwin Sharma (Invisible Institute)
+
+'''pytest functions for merge_chain'''
+
+import os
+import textwrap
+import pandas as pd
+import merge_chain
+from merge_chain import get_merge_steps, run_merge_chain, REFERENCE_FILE
+
+FIRST_STEP = '''
+import pandas as pd
+from reference_data import ReferenceData
+
+ref_df = pd.DataFrame({'UID': [1, 2], 'first_name_NS': ['BOB', 'KATHY']})
+ReferenceData(ref_df, id='UID', null_flag_cols=[])\\
+    .write_reference('output/officer-reference.csv.gz', {'index': False})
+'''
+
+NEXT_STEP = '''
+import pandas as pd
+from reference_data import ReferenceData
+from merge_data import Merge
+from merge_chain import read_reference
+
+ref_df = read_reference('input/officer-reference.csv.gz')
+sup_df = pd.DataFrame({'sup_ID': [NUMBER], 'first_name_NS': ['STEP%d' % NUMBER]})
+ReferenceData(ref_df, id='UID', null_flag_cols=[])\\
+    .add_sup_data(sup_df, data_id='sup_ID', add_cols=[])\\
+    .loop_merge([Merge(name='names', merge_dict={'first_name_NS': ['first_name_NS']})])\\
+    .append_to_reference()\\
+    .write_reference('output/officer-reference.csv.gz', {'index': False})
+'''
+
+
+def make_steps(merge_path, count):
+    '''merge steps 01..count, each reading the officer-reference of the step before it through input/'''
+    for number in range(1, count + 1):
+        step_path = merge_path / ('%02d_step' % number)
+        for folder in ['src', 'input', 'output']:
+            (step_path / folder).mkdir(parents=True)
+        script = FIRST_STEP if number == 1 else NEXT_STEP.replace('NUMBER', str(number))
+        (step_path / 'src' / 'merge.py').write_text(textwrap.dedent(script))
+        if number > 1:
+            os.symlink(os.path.join('..', '..', '%02d_step' % (number - 1), 'output', REFERENCE_FILE),
+                       step_path / 'input' / REFERENCE_FILE)
+
+
+def test_only_checkpoints_written(tmp_path):
+    '''the officer-reference is passed between steps in memory, only checkpoints and the last step are written'''
+    make_steps(tmp_path, 3)
+    run_merge_chain(str(tmp_path), checkpoints=[1])
+
+    written = sorted(path.parent.parent.name for path in tmp_path.glob('*/output/' + REFERENCE_FILE))
+    assert written == ['01_step', '03_step']
+    reference = pd.read_csv(tmp_path / '03_step' / 'output' / REFERENCE_FILE)
+    assert reference['first_name_NS'].tolist() == ['BOB', 'KATHY', 'STEP2', 'STEP3']
+    assert reference['UID'].tolist() == [1, 2, 3, 4]
+
+
+def test_get_merge_steps(tmp_path):
+    '''steps are ordered by number, not name, and only folders starting with a number are steps'''
+    for folder in ['10_roster', '02_awards', '01_roster', 'crosswalk']:
+        (tmp_path / folder).mkdir()
+
+    assert get_merge_steps(str(tmp_path)) == [str(tmp_path / folder) for folder in ['01_roster', '02_awards', '10_roster']]
+    assert get_merge_steps(str(tmp_path), start=2, end=9) == [str(tmp_path / '02_awards')]
+
+
+def test_chain_from_written_reference(tmp_path):
+    '''a chain starting after the first step reads the reference written to disk by the step before'''
+    make_steps(tmp_path, 3)
+    run_merge_chain(str(tmp_path), end=1)
+    steps = run_merge_chain(str(tmp_path), start=2)
+
+    assert steps == [str(tmp_path / '02_step'), str(tmp_path / '03_step')]
+    assert not (tmp_path / '02_step' / 'output' / REFERENCE_FILE).exists()
+    reference = pd.read_csv(tmp_path / '03_step' / 'output' / REFERENCE_FILE)
+    assert reference['first_name_NS'].tolist() == ['BOB', 'KATHY', 'STEP2', 'STEP3']
+    assert merge_chain.handoff is None
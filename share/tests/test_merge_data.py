@@ -0,0 +1,466 @@
+#! usr/bin/env python3
+#
+# Author:   Ashwin Sharma (Invisible Institute)
+
+'''pytest functions for merge_data and merge_index'''
+
+import pytest
+import pandas as pd
+import numpy as np
+import logging
+import json
+import os
+import subprocess
+import sys
+import textwrap
+from foia_data import FoiaData
+from merge_data import Merge
+from merge_index import MergeIndex
+from merge_assignment import assign_pairs, greedy_component
+from merge_cache import MergeCache, PreparedCache, callable_fingerprint
+from merge_metrics import MergeMetrics, summarize_metrics
+from reference_data import ReferenceData
+
+log = logging.getLogger('test')
+
+base_merge_dict = {'star': ['star', ''],
+                   'first_name': ['first_name_NS', 'F4FN'],
+                   'last_name': ['last_name_NS', 'F4LN'],
+                   'birth_year': ['birth_year', ''],
+                   'gender': ['gender', '']}
+
+
+def get_foia_data():
+    '''reference and supplemental FoiaData with overlapping, ambiguous and null keys'''
+    ref_df = pd.DataFrame(
+        {'UID': [1, 1, 2, 3, 4, 5, 6],
+         'first_name_NS': ['BOB', 'BOB', 'KATHLEEN', 'KEVIN', 'ELLEN', 'ROBERT', 'KATHLEEN'],
+         'last_name_NS': ['JONES', 'JONES', 'SMITH', 'PARK', 'ORIELY', 'JONES', 'SMITH'],
+         'star': [10, 20, 30, np.nan, 50, 60, np.nan],
+         'birth_year': [1970, 1970, 1985, 1965, np.nan, 1970, 1986],
+         'gender': ['MALE', 'MALE', 'FEMALE', 'MALE', 'FEMALE', 'MALE', 'FEMALE']})
+    sup_df = pd.DataFrame(
+        {'sup_ID': [1, 2, 3, 4, 5, 6],
+         'first_name_NS': ['BOB', 'KATHY', 'KEVIN', 'ELLEN', 'ROBERTO', 'KATHLEEN'],
+         'last_name_NS': ['JONES', 'SMITH', 'PARK', 'ORIELY', 'JONES', 'SMITH'],
+         'star': [20, 30, 40, np.nan, 60, np.nan],
+         'birth_year': [1970, 1985, 1965, 1961, 1970, np.nan],
+         'gender': ['MALE', 'FEMALE', 'MALE', 'FEMALE', 'MALE', 'FEMALE']})
+
+    reference = FoiaData(ref_df, id='UID', add_cols=['F4FN', 'F4LN'], log=log)
+    supplemental = FoiaData(sup_df, id='sup_ID', add_cols=['F4FN', 'F4LN'], log=log)
+    return reference, supplemental
+
+
+def test_merge_index_join_matches_pandas_order():
+    '''index join returns the same rows, in the same order, as an inner pandas merge'''
+    rng = np.random.default_rng(0)
+    ref_df = pd.DataFrame({'ref_id': range(200),
+                           'a': rng.choice(['X', 'Y', 'Z', None], 200),
+                           'b': rng.choice([1.0, 2.0, np.nan], 200)})
+    sup_df = pd.DataFrame({'sup_id': range(150),
+                           'a': rng.choice(['X', 'Y', 'W', None], 150),
+                           'b': rng.choice([1.0, 2.0, 3.0], 150)})
+
+    expected = ref_df.dropna().merge(sup_df.dropna(), on=['a', 'b'])[['ref_id', 'sup_id']] \
+        .drop_duplicates()
+    results = MergeIndex(ref_df, sup_df, 'ref_id', 'sup_id').merge_on_cols(['a', 'b'])
+
+    assert results.reset_index(drop=True).equals(expected.reset_index(drop=True))
+
+
+def test_index_engine_same_as_pandas_engine():
+    '''index and pandas engines give the same merged_df'''
+    results = {}
+    for engine in ['pandas', 'index']:
+        reference, supplemental = get_foia_data()
+        merge = Merge(name='base', merge_dict=base_merge_dict, engine=engine)
+        results[engine] = merge.apply_merge(reference, supplemental)
+
+    assert not results['index'].empty
+    assert results['index'].equals(results['pandas'])
+
+
+def test_index_engine_raises_like_pandas():
+    '''joining strings against floats raises the ValueError of pd.merge, not only when the pandas engine is used'''
+    for engine in ['pandas', 'index']:
+        reference, supplemental = get_foia_data()
+        supplemental.unmerged['gender'] = supplemental.unmerged['birth_year']
+        with pytest.raises(ValueError, match='You are trying to merge on object and float64 columns'):
+            Merge(name='mixed', custom_merges=[['gender']], engine=engine, plan=False).apply_merge(reference, supplemental)
+
+
+def test_index_engine_no_filter_flags():
+    '''without filtering, ids can match on every on_list, same as the pandas engine'''
+    results = {}
+    for engine in ['pandas', 'index']:
+        reference, supplemental = get_foia_data()
+        merge = Merge(name='no filter', merge_dict=base_merge_dict, engine=engine,
+                      filter_reference_merges_flag=False,
+                      filter_supplemental_merges_flag=False,
+                      check_duplicates=False)
+        results[engine] = merge.apply_merge(reference, supplemental)
+
+    assert results['index'].equals(results['pandas'])
+
+
+@pytest.mark.parametrize('filter_flag', [True, False])
+def test_sqlite_engine_same_as_pandas_engine(filter_flag):
+    '''sqlite and pandas engines give the same merged_df, with and without filtering merged ids'''
+    results = {}
+    for engine in ['pandas', 'sqlite']:
+        reference, supplemental = get_foia_data()
+        merge = Merge(name='base', merge_dict=base_merge_dict, engine=engine,
+                      filter_reference_merges_flag=filter_flag,
+                      filter_supplemental_merges_flag=filter_flag,
+                      check_duplicates=filter_flag)
+        results[engine] = merge.apply_merge(reference, supplemental)
+
+    assert not results['sqlite'].empty
+    assert results['sqlite'].equals(results['pandas'])
+
+def test_merge_plan_same_results():
+    '''pruning on_lists with the merge plan doesn't change merged_df'''
+    results = {}
+    for plan in [False, True]:
+        reference, supplemental = get_foia_data()
+        # null strings, a float column of nulls can't be merged with strings
+        supplemental.unmerged['gender'] = None
+        merge = Merge(name='plan', merge_dict=base_merge_dict, plan=plan)
+        results[plan] = merge.apply_merge(reference, supplemental)
+
+    assert len(merge.cols_list) > 0
+    assert 'running 16 of 32' in merge.plan_report
+    assert results[True].equals(results[False])
+
+
+def test_distinct_rows_same_as_drop_duplicates():
+    '''projections narrowed from a wider projection are the rows drop_duplicates keeps, joins find the same id pairs'''
+    reference, supplemental = get_foia_data()
+    ref_df = pd.concat([reference.unmerged, reference.unmerged.iloc[::-1]], ignore_index=True)
+    index = MergeIndex(ref_df, supplemental.unmerged, 'UID', 'sup_ID')
+    index.distinct_rows(['first_name_NS', 'last_name_NS', 'star', 'birth_year', 'gender'])
+
+    for on_cols in [['first_name_NS', 'last_name_NS', 'star'], ['last_name_NS'], ['birth_year', 'gender']]:
+        ref_rows, _ = index.distinct_rows(on_cols)
+        assert ref_rows.tolist() == np.flatnonzero(~ref_df[['UID'] + on_cols].duplicated()).tolist()
+        assert index.id_pairs(*index.join(on_cols, distinct=True)).reset_index(drop=True)\
+            .equals(index.id_pairs(*index.join(on_cols)).reset_index(drop=True))
+    assert len(index.projections) == 4
+
+def test_key_dictionary_codes_shared():
+    '''codes are stable as values are added, and join the same values across data'''
+    reference, supplemental = get_foia_data()
+    ref_codes = reference.encode_keys(reference.unmerged, ['first_name_NS', 'F4FN', 'star'])
+    sup_codes = supplemental.encode_keys(supplemental.unmerged.iloc[::-1], ['first_name_NS', 'star', 'missing'])
+
+    assert list(sup_codes) == ['first_name_NS', 'star']
+    assert ref_codes['first_name_NS'].dtype == np.int32
+    first_names = reference.key_dictionary.values['first_name_NS']
+    assert first_names.take(sup_codes['first_name_NS']).tolist() == \
+        supplemental.unmerged['first_name_NS'].iloc[::-1].tolist()
+    assert (ref_codes['star'] == -1).tolist() == reference.unmerged['star'].isnull().tolist()
+
+
+def test_mark_merged_same_as_filter_merges():
+    '''unmerged from the merged id bitset is the same as filtering unmerged with isin'''
+    reference, supplemental = get_foia_data()
+    merged_df = Merge(name='base', merge_dict=base_merge_dict).apply_merge(reference, supplemental)
+    expected = reference.filter_merges(merged_df, reference.unmerged)
+
+    reference.mark_merged(merged_df[reference.id])
+
+    assert reference.unmerged.equals(expected)
+    assert reference.unmerged_count() == expected[reference.id].nunique()
+
+
+def test_unmerged_changes_not_in_df():
+    '''changing unmerged in place, before or after marking merged ids, leaves df as it was'''
+    reference, _ = get_foia_data()
+    expected = reference.df.copy()
+
+    reference.unmerged.loc[:, 'first_name_NS'] = 'CHANGED'
+    reference.mark_merged(pd.Series([1]))
+    reference.unmerged.loc[:, 'last_name_NS'] = 'CHANGED'
+
+    assert reference.df.equals(expected)
+
+
+def test_parallel_join_same_results():
+    '''joining on_lists over worker processes gives the same merged_df when ids aren't filtered'''
+    results = {}
+    for workers in [1, 2]:
+        reference, supplemental = get_foia_data()
+        merge = Merge(name='no filter', merge_dict=base_merge_dict, workers=workers,
+                      filter_reference_merges_flag=False,
+                      filter_supplemental_merges_flag=False,
+                      check_duplicates=False)
+        results[workers] = merge.apply_merge(reference, supplemental)
+
+    assert not results[2].empty
+    assert results[2].equals(results[1])
+
+
+def test_sharded_merge_same_results():
+    '''merging shards split by last name in worker processes gives the same merged_df as merging all rows'''
+    rng = np.random.default_rng(0)
+    last_names = rng.choice(['JONES', 'SMITH', 'PARK', 'ORIELY', 'KIM', 'WALSH', 'BROWN', 'LOPEZ'], 200)
+    ref_df = pd.DataFrame({'UID': np.repeat(np.arange(200), 2),
+                           'first_name_NS': rng.choice(['BOB', 'KATHLEEN', 'KEVIN', 'ELLEN'], 400),
+                           'last_name_NS': np.repeat(last_names, 2),
+                           'star': rng.choice([10., 20., 30., np.nan], 400),
+                           'birth_year': rng.choice([1960., 1970., 1980.], 400),
+                           'gender': rng.choice(['MALE', 'FEMALE'], 400)})
+    # an officer with rows under two last names keeps both in one shard
+    ref_df.loc[[0, 2], 'last_name_NS'] = 'KIM'
+    sup_df = ref_df.sample(250, random_state=0).rename(columns={'UID': 'sup_ID'})
+    sup_df['last_name_NS'] = sup_df['last_name_NS'].mask(rng.random(250) < 0.1)
+
+    index = MergeIndex(ref_df, sup_df, 'UID', 'sup_ID')
+    ref_shards, sup_shards = index.shard_rows('last_name_NS', 3)
+    assert (pd.Series(ref_shards).groupby(ref_df['UID'].to_numpy()).nunique() == 1).all()
+    assert set(ref_shards) == {0, 1, 2}
+    assert (sup_shards[sup_df['last_name_NS'].isnull().to_numpy()] == -1).all()
+    merge_dict = {**base_merge_dict, 'last_name': ['last_name_NS']}
+
+    results = {}
+    for workers in [1, 3]:
+        reference = FoiaData(ref_df, id='UID', add_cols=['F4FN'], log=log)
+        supplemental = FoiaData(sup_df, id='sup_ID', add_cols=['F4FN'], log=log)
+        merge = Merge(name='sharded', merge_dict=merge_dict, workers=workers, shard_on='last_name_NS',
+                      check_duplicates=False)
+        results[workers] = merge.apply_merge(reference, supplemental)
+
+    assert not results[3].empty
+    assert results[3].reset_index(drop=True).equals(results[1].reset_index(drop=True))
+    with pytest.raises(AssertionError):
+        Merge(name='fuzzy shards', merge_dict=merge_dict, shard_on='last_name_NS', fuzzy_cols=['last_name_NS'])
+
+def test_dry_run_estimates_joins():
+    '''dry run counts the candidate pairs of every column list without merging'''
+    reference, supplemental = get_foia_data()
+    merge = Merge(name='dry run', merge_dict=base_merge_dict)
+    estimates = merge.apply_merge(reference, supplemental, dry_run=True)
+
+    assert merge.merged_df.empty
+    assert 'Hot spots' in merge.estimate_report
+    index = MergeIndex(reference.unmerged, supplemental.unmerged, 'UID', 'sup_ID')
+    for row in estimates.itertuples():
+        ref_rows, sup_rows = index.join(row.matched_on.split('-'))
+        assert row.candidate_pairs == len(ref_rows)
+        assert row.ref_ids == len(set(index.ref_ids[ref_rows]))
+        assert row.sup_ids == len(set(index.sup_ids[sup_rows]))
+    assert estimates['candidate_pairs'].sum() > 0
+
+def test_merge_cache(tmp_path):
+    '''merges applied to the same data are read back from the cache, changed merges are recomputed'''
+    cache = MergeCache(str(tmp_path), log=log)
+
+    def run(merges):
+        reference, supplemental = get_foia_data()
+        rd = ReferenceData(reference.df, id='UID', null_flag_cols=['birth_year'], log=log)
+        rd.supplemental = supplemental
+        return rd.loop_merge(merges, cache=cache).merged_df
+
+    first = run([Merge(name='base', merge_dict=base_merge_dict)])
+    assert len(list(tmp_path.iterdir())) == 1
+
+    second = run([Merge(name='base', merge_dict=base_merge_dict)])
+    assert second.equals(first)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    run([Merge(name='base', merge_dict=base_merge_dict, query='gender == "MALE"')])
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_merge_cache_hits_in_new_process(tmp_path):
+    '''merges with a bound method preprocess are read back by a rerun in another process,
+    merges referring to values that change between processes aren't cached'''
+    script = tmp_path / 'rerun.py'
+    script.write_text(textwrap.dedent("""
+        import sys
+        import json
+        import logging
+        import pandas as pd
+        from merge_cache import MergeCache
+        from merge_data import Merge
+
+        class Renamer:
+            def __init__(self, names):
+                self.names = names
+                self.log = logging.getLogger('renamer')
+
+            def rename(self, df):
+                return df.replace(self.names)
+
+        lock = object()
+        merges = [Merge(name='method', merge_dict={'first_name': ['first_name_NS']},
+                        reference_preprocess=Renamer({'BOB': 'ROBERT'}).rename),
+                  Merge(name='unstable', merge_dict={'first_name': ['first_name_NS']},
+                        reference_preprocess=lambda df: df if lock else df)]
+        df = pd.DataFrame({'UID': [1], 'first_name_NS': ['BOB']})
+        print(json.dumps([MergeCache(sys.argv[1]).key(merge, df, df) for merge in merges]))
+    """))
+
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    keys = [subprocess.run([sys.executable, str(script), str(tmp_path / 'cache')], capture_output=True, text=True,
+                           check=True, env=env).stdout
+            for _ in range(2)]
+    assert keys[0] == keys[1]
+    assert json.loads(keys[0])[0] is not None and json.loads(keys[0])[1] is None
+
+
+def test_fingerprint_follows_nested_globals():
+    '''functions used only in a comprehension are part of the fingerprint, so changing them changes the cache key'''
+    namespace = {}
+    exec(textwrap.dedent("""
+        def helper(value):
+            return value
+
+        def post(df):
+            return [helper(value) for value in df]
+    """), namespace)
+    before = callable_fingerprint(namespace['post'])
+    exec(textwrap.dedent("""
+        def helper(value):
+            return value + 1
+    """), namespace)
+
+    assert callable_fingerprint(namespace['post']) != before
+
+
+def test_assignment_resolves_duplicates():
+    '''assignment keeps the best unambiguous pairs one to one, where greedy merging raises on duplicate ids'''
+    ref_df = pd.DataFrame({'UID': [1, 1, 2, 3],
+                           'first_name_NS': ['BOB', 'BOB', 'KEVIN', 'ELLEN'],
+                           'last_name_NS': ['JONES', 'JONES', 'PARK', 'ORIELY'],
+                           'star': [10, 20, 30, 40],
+                           'birth_year': [1970, 1970, 1965, 1961]})
+    sup_df = pd.DataFrame({'sup_ID': [1, 2, 3, 4, 5],
+                           'first_name_NS': ['BOB', 'BOB', 'KEVIN', 'KEVIN', 'ELLEN'],
+                           'last_name_NS': ['JONES', 'JONES', 'PARK', 'PARK', 'ORIELY'],
+                           'star': [10, 20, 30, 31, np.nan],
+                           'birth_year': [1970, 1970, 1965, 1965, 1961]})
+    cols_list = [['first_name_NS', 'last_name_NS', 'star', 'birth_year'],
+                 ['first_name_NS', 'last_name_NS', 'birth_year']]
+
+    def get_data():
+        return (FoiaData(ref_df, id='UID', log=log, null_flag_cols=[]),
+                FoiaData(sup_df, id='sup_ID', log=log, null_flag_cols=[]))
+
+    with pytest.raises(AssertionError):
+        Merge(name='greedy', custom_merges=cols_list).apply_merge(*get_data())
+
+    merged_df = Merge(name='assignment', custom_merges=cols_list, resolve='assignment').apply_merge(*get_data())
+    # UID 1 matches sup_ID 1 and 2 equally well, KEVIN matches sup_ID 3 by star before sup_ID 4 by name
+    assert merged_df[['UID', 'sup_ID']].values.tolist() == [[2, 3], [3, 5]]
+    assert merged_df['matched_on'].tolist() == ['-'.join(cols_list[0]), '-'.join(cols_list[1])]
+
+
+def test_assignment_large_components_greedy():
+    '''components over the size cap are resolved greedily, keeping the same unambiguous pairs and leaving ties out'''
+    # a chain component: ref 0 ties between sup 0 and 1, ref 1 and 2 have a unique best each
+    ref_codes = np.array([0, 0, 1, 1, 2, 2])
+    sup_codes = np.array([0, 1, 1, 2, 2, 3])
+    weights = np.array([3., 3., 2., 4., 1., 5.])
+
+    exact = assign_pairs(ref_codes, sup_codes, weights)
+    greedy = assign_pairs(ref_codes, sup_codes, weights, max_component_ids=2)
+
+    assert exact.tolist() == greedy.tolist() == [False, False, False, True, False, True]
+    assert (greedy_component(ref_codes, sup_codes, weights) == greedy).all()
+
+
+def test_prepared_cache(tmp_path):
+    '''prepared frames are read back from the cache, the same data prepared differently is prepared again'''
+    cache = PreparedCache(str(tmp_path), log=log)
+    ref_df = pd.DataFrame({'UID': [1, 2, 3],
+                           'first_name_NS': ['BOB', 'ROBERT', 'KATHLEEN'],
+                           'star1': [10, 20, 30], 'star2': [np.nan, 40, np.nan],
+                           'birth_year': [1970, np.nan, np.nan]})
+
+    prepared = FoiaData(ref_df.copy(), id='UID', add_cols=['F4FN'], log=log).df
+    first = FoiaData(ref_df.copy(), id='UID', add_cols=['F4FN'], log=log, prepared_cache=cache).df
+    second = FoiaData(ref_df.copy(), id='UID', add_cols=['F4FN'], log=log, prepared_cache=cache).df
+    assert first.equals(prepared) and second.equals(prepared)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    FoiaData(ref_df.copy(), id='UID', add_cols=['F4FN', 'L4FN'], log=log, prepared_cache=cache)
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_fuzzy_join_candidates():
+    '''fuzzy join candidates include every pair within max_edits in the same block, and not every pair'''
+    ref_df = pd.DataFrame({'UID': range(6),
+                           'last_name_NS': ['JONES', 'JONSE', 'SMITH', 'ORIELY', 'PARK', np.nan],
+                           'birth_year': [1970, 1970, 1970, 1965, 1970, 1970]})
+    sup_df = pd.DataFrame({'sup_ID': range(5),
+                           'last_name_NS': ['JONES', 'SMYTH', 'OREILY', 'ORIELY', 'PARKER'],
+                           'birth_year': [1970, 1970, 1965, 1970, 1970]})
+    index = MergeIndex(ref_df, sup_df, 'UID', 'sup_ID')
+
+    ref_rows, sup_rows = index.fuzzy_join(['last_name_NS', 'birth_year'], 'last_name_NS', max_edits=1)
+    pairs = set(zip(ref_rows, sup_rows))
+
+    assert {(0, 0), (2, 1)} <= pairs
+    assert (3, 3) not in pairs and (4, 4) not in pairs and (5, 0) not in pairs
+    assert len(pairs) < len(ref_df) * len(sup_df) / 3
+
+
+def test_fuzzy_merge_same_for_engines():
+    '''fuzzy merges match names with typos, the same on both engines'''
+    results = {}
+    for engine in ['pandas', 'index']:
+        reference, supplemental = get_foia_data()
+        merge = Merge(name='fuzzy', merge_dict={**base_merge_dict, 'first_name': ['first_name_NS']},
+                      fuzzy_cols=['first_name_NS'], max_edits=2, engine=engine)
+        results[engine] = merge.apply_merge(reference, supplemental)
+
+    assert ((results['index']['UID'] == 5) & (results['index']['sup_ID'] == 5)).any()
+    assert results['index'].equals(results['pandas'])
+
+
+def test_phonetic_and_nickname_columns():
+    '''metaphone and nickname class columns join names that are spelled differently'''
+    df = pd.DataFrame({'UID': [1, 2, 3, 4],
+                       'first_name_NS': ['BOB', 'ROBERT', 'ZYGMUNT', np.nan],
+                       'last_name_NS': ['SMITH', 'SMYTH', 'PARK', 'JONES'],
+                       'birth_year': [1970, 1970, 1980, 1990]})
+    results = FoiaData(df, id='UID', add_cols=['MPFN', 'MPLN', 'MSLN', 'NNFN'], log=log).df
+
+    assert results['NNFN'].tolist()[:3] == ['ROBERT', 'ROBERT', 'ZYGMUNT']
+    assert results['MPLN'][0] == results['MPLN'][1]
+    assert results['MSLN'][0] == results['MSLN'][1]
+    assert results['MPFN'].isnull().tolist() == [False, False, False, True]
+
+
+def test_merge_metrics(tmp_path):
+    '''every join of a merge is recorded with its candidate rows and matches, and summarized'''
+    path = str(tmp_path / 'output' / 'merge.merge_metrics.jsonl')
+    metrics = MergeMetrics(path, 'merge')
+    reference, supplemental = get_foia_data()
+    merge = Merge(name='base', merge_dict=base_merge_dict)
+    merged_df = merge.apply_merge(reference, supplemental, metrics=metrics)
+
+    records = pd.read_json(path, lines=True)
+    assert len(records) == len(metrics.records) > 0
+    assert records['matches'].sum() == len(merged_df)
+    assert (records['ref_rows'] <= len(reference.df)).all() and (records['wall_time'] >= 0).all()
+
+    summary = summarize_metrics([path], top=3)
+    assert len(summary) == 3
+    assert summary['wall_time'].is_monotonic_decreasing
+
+
+def test_key_codes_follow_changed_values():
+    '''columns assigned to after their codes were cached are encoded again, in unmerged or df'''
+    reference, supplemental = get_foia_data()
+    supplemental.encode_keys(supplemental.unmerged, ['first_name_NS', 'last_name_NS'])
+    supplemental.unmerged['first_name_NS'] = 'KATHY'
+    supplemental.df['last_name_NS'] = 'SMITH'
+    sup_codes = supplemental.encode_keys(supplemental.unmerged, ['first_name_NS', 'last_name_NS'])
+    first_names = supplemental.key_dictionary.values['first_name_NS']
+
+    assert set(first_names.take(sup_codes['first_name_NS'])) == {'KATHY'}
+    assert set(supplemental.key_dictionary.values['last_name_NS'].take(
+        supplemental.encode_keys(supplemental.df, ['last_name_NS'])['last_name_NS'])) == {'SMITH'}
@@ -622,6 +622,83 @@ def test_fill_data():
     test_append_to_reference_ref_df()
 
 
+def test_link_slices():
+    '''tests linking slices in one pass gives the same ref_df as appending them one at a time'''
+    rng = np.random.default_rng(0)
+    names = list(itertools.product(['BOB', 'KATHLEEN', 'KEVIN', 'ELLEN', 'ROBERT', 'JOHN', 'MARY', 'PETER'],
+                                   ['JONES', 'SMITH', 'PARK', 'ORIELY', 'BROWN']))
+    people = pd.DataFrame(
+        {'first_name_NS': [first for first, last in names],
+         'last_name_NS': [last for first, last in names],
+         'age_at_hire': rng.choice([20., 25., np.nan], len(names)),
+         'gender': rng.choice(['MALE', 'FEMALE'], len(names)),
+         'start_date': rng.choice(['2000-01-01', '2001-01-01', '2002-05-05'], len(names))})
+    custom_merges = [
+        ['first_name_NS', 'last_name_NS', 'age_at_hire', 'start_date', 'gender'],
+        ['first_name_NS', 'last_name_NS', 'start_date'],
+        {'cols': ['F4FN', 'last_name_NS', 'gender'], 'query': 'gender == "MALE"'},
+        # only split when both ref_query and sup_query are given, query applies to both sides here
+        {'cols': ['F4FN', 'F4LN', 'gender'], 'query': 'gender == "FEMALE"', 'sup_query': 'age_at_hire > 21'},
+        ['first_name_NS', 'last_name_NS'],
+        ['F4FN', 'F4LN']]
+
+    slices = []
+    for year in range(2002, 2007):
+        year_df = people.sample(30, random_state=year).reset_index(drop=True)
+        year_df.loc[:2, 'age_at_hire'] = 30.
+        year_df.loc[3:4, 'first_name_NS'] += 'S'
+        year_id = 'salary-%d_2002-2017_2017-09_ID' % year
+        year_df[year_id] = year_df.index + 1
+        slices.append((year_id, year_df))
+    # a slice of new people only, nothing matched
+    new_df = people.head(5).assign(first_name_NS=['ZED', 'YUSUF', 'XAVIER', 'WANDA', 'VERA'],
+                                   last_name_NS='NEWMAN')
+    new_df['salary-2007_2002-2017_2017-09_ID'] = new_df.index + 1
+    slices.append(('salary-2007_2002-2017_2017-09_ID', new_df))
+
+    RD = ReferenceData(slices[0][1].copy(), 'UID', log, data_id=slices[0][0])
+    for year_id, year_df in slices[1:]:
+        RD = RD.add_sup_data(year_df.copy(), add_cols=['F4FN', 'F4LN'], base_OD=[])\
+            .loop_merge(custom_merges=custom_merges, verbose=False)\
+            .append_to_reference()
+
+    results = ReferenceData.link_slices(slices, 'UID', log, custom_merges,
+                                        add_cols=['F4FN', 'F4LN']).ref_df
+    assert results['matched_on'].nunique() > 2
+    assert results['salary-2007_2002-2017_2017-09_ID'].notnull().sum() == 5
+    assert results.equals(RD.ref_df)
+
+
+def test_merge_columns():
+    '''tests only merge columns are prepared for loop_merge, with the same merges as all columns'''
+    ref_df = pd.DataFrame(
+        {'UID': [1, 2, 3, 4],
+         'first_name_NS': ['BOB', 'KATHLEEN', 'KEVIN', 'ELLEN'],
+         'last_name_NS': ['JONES', 'SMITH', 'PARK', 'ORIELY'],
+         'star': [10, 20, 30, 40],
+         'birth_year': [1970, 1985, np.nan, 1961],
+         'incident_notes': ['A', 'B', 'C', 'D']})
+    sup_df = pd.DataFrame(
+        {'sub-2016_2016_2016_ID': [1, 2, 3],
+         'first_name_NS': ['BOB', 'KATHY', 'KEVIN'],
+         'last_name_NS': ['JONES', 'SMITH', 'PARK'],
+         'birth_year': [1970, 1985, 1965],
+         'event': [1, 0, 1]})
+    custom_merges = [['first_name_NS', 'last_name_NS', 'birth_year'], ['F4FN', 'last_name_NS']]
+
+    RD = ReferenceData(ref_df, 'UID', log)\
+        .add_sup_data(sup_df, add_cols=['F4FN'], base_OD=[])
+    assert RD.ref_um.columns.tolist() == ['UID', 'first_name_NS', 'last_name_NS', 'birth_year', 'F4FN']
+    assert RD.sup_um.columns.tolist() == ['sub-2016_2016_2016_ID', 'first_name_NS', 'last_name_NS',
+                                          'birth_year', 'F4FN']
+    results = RD.loop_merge(custom_merges=custom_merges, verbose=False).merged_df
+
+    RD = ReferenceData(ref_df.drop('incident_notes', axis=1), 'UID', log)\
+        .add_sup_data(sup_df.drop('event', axis=1), add_cols=['F4FN'], base_OD=[])
+    assert results.equals(RD.loop_merge(custom_merges=custom_merges, verbose=False).merged_df)
+    assert results.shape[0] == 3
+
+
 def test_final_profiles():
     '''test final profiles creation'''
     input_df = pd.DataFrame({
@@ -0,0 +1,71 @@
+#! usr/bin/env python3
+#
+# Author:   Ashwin Sharma (Invisible Institute)
+
+'''pytest functions for probabilistic_merge'''
+
+import pytest
+import pandas as pd
+import numpy as np
+import logging
+from foia_data import FoiaData
+from probabilistic_merge import ProbabilisticMerge, fit_em
+
+log = logging.getLogger('test')
+
+merge_dict = {'star': ['star', ''],
+              'first_name': ['first_name_NS', 'F4FN'],
+              'last_name': ['last_name_NS', 'F4LN'],
+              'birth_year': ['birth_year', ''],
+              'middle_initial': ['middle_initial', ''],
+              'gender': ['gender', '']}
+
+
+def get_officers(rng, size):
+    '''random officers, with first and last names from small pools so many officers share them'''
+    first_names = np.array(['BOB', 'ROBERT', 'KATHLEEN', 'KEVIN', 'ELLEN', 'JOHN', 'MARY', 'PETER', 'JAMES', 'LINDA'])
+    last_names = np.array(['JONES', 'SMITH', 'PARK', 'ORIELY', 'BROWN', 'GARCIA', 'NOWAK', 'KIM', 'WALSH', 'LOPEZ',
+                           'MURPHY', 'COLLINS'])
+    return pd.DataFrame({'first_name_NS': rng.choice(first_names, size),
+                         'last_name_NS': rng.choice(last_names, size),
+                         'middle_initial': rng.choice(list('ABCDEJKLMR'), size),
+                         'birth_year': rng.integers(1940, 1990, size).astype(float),
+                         'star': rng.choice(np.arange(1000, 20000), size, replace=False).astype(float),
+                         'gender': rng.choice(['MALE', 'FEMALE'], size)})
+
+
+def test_probabilistic_merge_finds_noisy_matches():
+    '''matches are found one to one despite missing and changed fields, without matching different officers'''
+    rng = np.random.default_rng(0)
+    ref_df = get_officers(rng, 400).assign(UID=np.arange(400))
+    sup_df = ref_df.sample(300, random_state=1).reset_index(drop=True)
+    sup_df['sup_ID'] = np.arange(300)
+    # a new star for some officers, missing birth years or middle initials for others
+    sup_df.loc[:59, 'star'] = rng.choice(np.arange(30000, 40000), 60, replace=False)
+    sup_df.loc[60:119, 'birth_year'] = np.nan
+    sup_df.loc[120:179, 'middle_initial'] = np.nan
+    truth = dict(zip(sup_df['sup_ID'], sup_df.pop('UID')))
+    sup_df = pd.concat([sup_df, get_officers(rng, 100).assign(sup_ID=np.arange(300, 400))], ignore_index=True)
+
+    reference = FoiaData(ref_df, id='UID', add_cols=['F4FN', 'F4LN'], log=log)
+    supplemental = FoiaData(sup_df, id='sup_ID', add_cols=['F4FN', 'F4LN'], log=log)
+    merge = ProbabilisticMerge(name='probabilistic', merge_dict=merge_dict, threshold=0)
+    merged_df = merge.apply_merge(reference, supplemental)
+
+    correct = merged_df['UID'] == merged_df['sup_ID'].map(truth)
+    assert merged_df['UID'].is_unique and merged_df['sup_ID'].is_unique
+    assert correct.mean() > 0.99
+    assert len(merged_df) > 0.95 * len(truth)
+    assert (merged_df['match_probability'] > 0.5).all()
+    # agreeing on a birth year is much more likely for matches than for non matches
+    assert merge.m_probabilities['birth_year'][0] > 3 * merge.u_probabilities['birth_year'][0]
+
+
+def test_fit_em_separates_matches():
+    '''EM recovers the fraction of matches of patterns of two clear groups'''
+    patterns = np.array([[0, 0, 0], [1, 1, 1], [0, 1, 1], [1, 1, 0]])
+    counts = np.array([100, 900, 5, 5])
+    m, u, prior = fit_em(patterns, counts, [2, 2, 2])
+
+    assert prior == pytest.approx(0.1, abs=0.01)
+    assert all(m_field[0] > 0.9 and u_field[0] < 0.1 for m_field, u_field in zip(m, u))
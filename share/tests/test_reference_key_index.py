@@ -0,0 +1,49 @@
+#! usr/bin/env python3
+#
+# Author:   Ashwin Sharma (Invisible Institute)
+
+'''pytest functions for reference_key_index'''
+
+import pytest
+import pandas as pd
+import numpy as np
+from reference_key_index import ReferenceKeyIndex
+
+reference_df = pd.DataFrame({'UID': [1, 1, 2, 3, 4],
+                             'first_name_NS': ['BOB', 'BOB', 'KATHY', 'ELLEN', 'BOB'],
+                             'last_name_NS': ['JONES', 'SMITH', 'PARK', 'KIM', 'SMITH'],
+                             'birth_year': [1970., 1970., np.nan, 1965., 1980.],
+                             'appointed_date': pd.to_datetime(['1995-01-02', '1995-01-02', '2001-05-06', None, '2003-01-01'])})
+sup_df = pd.DataFrame({'sup_ID': [10, 11, 12, 13],
+                       'first_name_NS': ['BOB', 'KATHY', 'ELLEN', 'BOB'],
+                       'last_name_NS': ['SMITH', 'PARK', 'KIM', 'JONES'],
+                       'birth_year': [1970, 1985, 1965, 1980],
+                       'appointed_date': pd.to_datetime(['2003-01-01', '2001-05-06', None, '1995-01-02'])})
+
+
+def test_lookup_same_as_merge(tmp_path):
+    '''looking up supplemental rows finds the same id pairs as merging with the reference, values of a row together'''
+    index = ReferenceKeyIndex.build(reference_df, 'UID', ['first_name_NS', 'last_name_NS', 'birth_year', 'appointed_date',
+                                                          'missing'], str(tmp_path / 'keys.sqlite'))
+
+    assert index.columns == ['first_name_NS', 'last_name_NS', 'birth_year', 'appointed_date']
+    for on_cols in [['first_name_NS'], ['first_name_NS', 'last_name_NS'], ['last_name_NS', 'birth_year'],
+                    ['first_name_NS', 'appointed_date']]:
+        expected = reference_df.dropna(subset=on_cols).merge(sup_df.dropna(subset=on_cols), on=on_cols)[['UID', 'sup_ID']]
+        results = index.lookup(sup_df, 'sup_ID', on_cols)
+        assert sorted(map(tuple, results.values.tolist())) == sorted(set(map(tuple, expected.values.tolist())))
+
+
+def test_match_greedy(tmp_path):
+    '''ids matched by an earlier on_list aren't matched again, on_lists with unindexed columns are skipped'''
+    index = ReferenceKeyIndex.build(reference_df, 'UID', ['first_name_NS', 'last_name_NS', 'birth_year'],
+                                    str(tmp_path / 'keys.sqlite'))
+    merged_df = index.match(sup_df, 'sup_ID', [['first_name_NS', 'last_name_NS', 'birth_year'],
+                                               ['first_name_NS', 'appointed_date'],
+                                               ['first_name_NS', 'last_name_NS']])
+
+    assert merged_df[['UID', 'sup_ID']].values.tolist() == [[1, 10], [3, 12], [2, 11]]
+    assert merged_df['matched_on'].tolist() == ['first_name_NS-last_name_NS-birth_year'] * 2 + \
+        ['first_name_NS-last_name_NS']
+    with pytest.raises(AssertionError):
+        index.lookup(sup_df, 'sup_ID', ['appointed_date'])
@@ -0,0 +1,68 @@
+#! usr/bin/env python3
+#
+# Author:   Ashwin Sharma (Invisible Institute)
+
+'''pytest functions for reference_store'''
+
+import pytest
+import pandas as pd
+import numpy as np
+from reference_store import ReferenceStore
+
+reference_df = pd.DataFrame({'UID': [1, 2, 3], 'first_name_NS': ['BOB', 'KATHY', 'ELLEN'], 'roster_ID': [1, 2, 3]})
+salary_df = pd.DataFrame({'UID': [1, 4], 'first_name_NS': ['BOB', 'JENNA'], 'salary': [100, 200], 'salary_ID': [1, 2]})
+awards_df = pd.DataFrame({'UID': [2], 'award_type': ['MEDAL'], 'awards_ID': [1]})
+
+
+def test_view_same_as_concat():
+    '''the unified view is the reference appended to one foia at a time, projections only build given columns'''
+    store = ReferenceStore(reference_df, 'UID')\
+        .append('salary_ID', salary_df)\
+        .append('awards_ID', awards_df)
+    expected = pd.concat([pd.concat([reference_df, salary_df], ignore_index=True), awards_df], ignore_index=True)
+
+    assert store.columns == expected.columns.tolist()
+    assert len(store) == expected.shape[0]
+    assert store.view(['UID', 'salary_ID', 'missing']).equals(expected[['UID', 'salary_ID']])
+    assert store.df.equals(expected)
+    assert len(store.partitions) == 1
+
+
+def test_changes_to_view_kept():
+    '''changes to the full view are kept after appending'''
+    store = ReferenceStore(reference_df.copy(), 'UID')
+    store.append('salary_ID', salary_df)
+    store.df.loc[store.df['UID'] == 4, 'first_name_NS'] = 'JENNIFER'
+    store.append('awards_ID', awards_df)
+
+    assert store.df['first_name_NS'].tolist() == ['BOB', 'KATHY', 'ELLEN', 'BOB', 'JENNIFER', np.nan]
+    with pytest.raises(AssertionError):
+        store.append('awards_ID', awards_df.drop('UID', axis=1))
+
+
+def test_append_same_name_twice():
+    '''a foia appended in several parts (e.g. a year at a time) under the same id keeps every part'''
+    store = ReferenceStore(reference_df, 'UID')\
+        .append('salary_ID', salary_df.iloc[:1])\
+        .append('salary_ID', salary_df.iloc[1:])
+
+    assert store.names == ['UID', 'salary_ID', 'salary_ID']
+    assert store.view(['UID', 'salary_ID']).equals(
+        pd.concat([reference_df, salary_df], ignore_index=True)[['UID', 'salary_ID']])
+
+
+@pytest.mark.parametrize('csv_opts', [{'index': False}, {'index': False, 'compression': 'gzip'}, {}])
+def test_to_csv_same_as_df(tmp_path, csv_opts):
+    '''writing partition by partition writes the same file as writing the unified view'''
+    store = ReferenceStore(reference_df, 'UID')\
+        .append('salary_ID', salary_df)\
+        .append('awards_ID', awards_df)
+    store.to_csv(str(tmp_path / 'partitions.csv'), **csv_opts)
+    expected = pd.concat([reference_df, salary_df, awards_df], ignore_index=True)
+    expected.to_csv(str(tmp_path / 'expected.csv'), **csv_opts)
+
+    assert len(store.partitions) == 3
+    assert pd.read_csv(str(tmp_path / 'partitions.csv'), compression=csv_opts.get('compression')).equals(
+        pd.read_csv(str(tmp_path / 'expected.csv'), compression=csv_opts.get('compression')))
+    if 'compression' not in csv_opts:
+        assert (tmp_path / 'partitions.csv').read_text() == (tmp_path / 'expected.csv').read_text()
@@ -0,0 +1,43 @@
+#! usr/bin/env python3
+#
+# Author:   Ashwin Sharma (Invisible Institute)
+
+'''pytest functions for string_similarity'''
+
+import pytest
+import pandas as pd
+import numpy as np
+import itertools
+import textdistance
+from string_similarity import score_pairs, jaro_winkler, is_substring, is_nickname, metaphone_match
+
+names = ['', 'A', 'BOB', 'ROBERT', 'ROBERTO', 'MARTHA', 'MARHTA', 'DWAYNE', 'DUANE',
+         'DIXON', 'DICKSONX', 'KATHLEEN', 'KATHY', "O'REILLY", 'ORIELY', 'SMITH-JONES', 'ABCDEFGHIJKLMNOP']
+
+
+def test_jaro_winkler_same_as_textdistance():
+    '''batched jaro winkler gives the same scores as textdistance'''
+    left, right = map(np.array, zip(*itertools.product(names, names)))
+    expected = [textdistance.jaro_winkler(name1, name2) for name1, name2 in zip(left, right)]
+
+    assert np.allclose(jaro_winkler(left, right), expected, rtol=0, atol=1e-12)
+
+
+def test_score_pairs():
+    '''scores are broadcast back to every row, null pairs get null_score'''
+    left = pd.Series(['BOB', 'BOB', 'KATHLEEN', np.nan, 'SMITH'])
+    right = pd.Series(['BOBBY', 'BOBBY', 'KATHY', 'KATHY', 'JONES'])
+
+    assert score_pairs(left, right, is_substring, null_score=False).tolist() == \
+        [True, True, False, False, False]
+    assert score_pairs(left, right, is_nickname, null_score=False).tolist() == \
+        [True, True, True, False, False]
+    assert score_pairs(left, right, jaro_winkler)[2:4].tolist() == \
+        [textdistance.jaro_winkler('KATHLEEN', 'KATHY'), 0]
+
+
+def test_metaphone_match():
+    '''names match on primary or secondary codes, names without secondary codes (BOB, ROBERT) match each other'''
+    assert metaphone_match(np.array(['SMITH', 'JOHN', 'BOB', 'KATHY', 'KATHY']),
+                           np.array(['SMYTH', 'JON', 'ROBERT', 'ROBERT', 'CATHY'])).tolist() == \
+        [True, True, True, False, True]